@@ -8,6 +8,8 @@ import json
 import textwrap
 import shlex
 import re
+import signal
+import time
 from pathlib import Path
 
 from dataclasses import *
@@ -20,15 +22,13 @@ from . import estimates
 from . import moves
 
 from .commands import Program, ProgramMetadata
-from . import execute
 from .log import ExperimentMetadata, Log
-from .moves import movelists
 from .config import RuntimeConfig, configs
-from .runtime import Runtime
 from .small_protocols import small_protocols_dict, SmallProtocolArgs
 from .protocol import CellPaintingArgs
 from . import protocol_paths
 from . import commandlib
+from . import sweep
 
 from pbutils.mixins import DB
 from pbutils.args import arg, option
@@ -54,11 +54,15 @@ class Args(SmallProtocolArgs, CellPaintingArgs):
     force_update_protocol_paths: bool = arg(help='Update the protcol dir based on the windows server even if config is not --live.')
 
     timing_matrix:             bool = arg(help='Print a timing matrix.')
+    sweep:                     str  = arg(help='Grid for --timing-matrix as json, example: {"batch_sizes": ["6", "7"], "incu": ["1200", "X"]} (default: batch sizes 1 to 18)')
+    sweep_workers:             int  = arg(default=0, help='Processes for --timing-matrix (default: one per core)')
+    sweep_out:                 str  = arg(help='Stream --timing-matrix results to this .tsv or .jsonl file instead of stdout')
 
     run_program_in_log_filename: str  = arg(help='Run the program stored in a log file. Used to run simulated programs from the gui.')
 
     start_from_stage:          str  = arg(help="Start from this stage (example: 'Mito, plate 2')")
     list_stages:               bool = arg(help="List the stages and then exit")
+    monte_carlo:               int  = arg(default=0, help="Print the spread of durations and total time of the schedule over this many samples of the logged command durations")
 
     visualize:                 bool = arg(help='Run detailed protocol visualizer')
     init_cmd_for_visualize:    str  = arg(help='Starting cmdline for visualizer')
@@ -66,6 +70,7 @@ class Args(SmallProtocolArgs, CellPaintingArgs):
     sim_delays:                str  = arg(help='Add simulated delays, example: 8:300 for a slowdown to 300s on command with id 8. Separate multiple values with comma.')
 
     list_imports:              bool = arg(help='Print the imported python modules for type checking.')
+    profile_startup:           bool = arg(help='Run the command and then print the time spent importing each module.')
 
     add_estimates_from:        str  = arg(help='Add timing estimates from a log file')
     add_estimates_dest:        str  = arg(default='estimates.jsonl', help='Add timing estimates to this file (default: estimates.jsonl)')
@@ -107,23 +112,56 @@ def main():
     args, parser = arg.parse_args(Args, description='Make the lab robots do things.')
     if args.json_arg:
         args = Args(**json.loads(args.json_arg))
+    if args.profile_startup:
+        profile_startup([arg for arg in sys.argv[1:] if arg != '--profile-startup'])
+        sys.exit(0)
     return main_with_args(args, parser)
 
+def profile_startup(argv: list[str], top: int=30):
+    '''
+    Runs the command with python -X importtime and prints the modules with the
+    longest import times, including the modules they import.
+    '''
+    import subprocess
+    t0 = time.monotonic()
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'cellpainter.cli', *argv],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    total_secs = time.monotonic() - t0
+    rows: list[tuple[int, int, str]] = []
+    for line in res.stderr.splitlines():
+        if m := re.match(r'import time:\s*(\d+) \|\s*(\d+) \| (\s*)(\S+)$', line):
+            self_us, cumulative_us, _indent, module = m.groups()
+            rows += [(int(cumulative_us), int(self_us), module)]
+        elif not line.startswith('import time:'):
+            print(line, file=sys.stderr)
+    print()
+    print('cumulative', 'self', 'module', sep='\t')
+    for cumulative_us, self_us, module in sorted(rows, reverse=True)[:top]:
+        print(f'{cumulative_us / 1e6:.3f}s', f'{self_us / 1e6:.3f}s', module, sep='\t')
+    print()
+    print(f'{len(rows)} modules imported in {sum(self_us for _, self_us, _ in rows) / 1e6:.3f}s, command took {total_secs:.3f}s in total')
+
 def cmdline_to_log(cmdline: str):
     cmdname = 'cellpainter'
     print(cmdline, shlex.split(cmdline))
     args, _ = arg.parse_args(Args, args=[*shlex.split(cmdline)], exit_on_error=False)
     pbutils.pr(args)
     if args.log_file_for_visualize:
-        return Log.connect(args.log_file_for_visualize)
+        return Log.connect(args.log_file_for_visualize, read_only=True)
     else:
         p = args_to_program(args)
         assert p, 'no program from these arguments!'
-        return Log(execute.simulate_program(p, sim_delays=parse_sim_delays(args)))
+        from . import execute
+        return Log(execute.simulate_program(p, sim_delays=parse_sim_delays(args), incremental=True))
 
 def main_with_args(args: Args, parser: argparse.ArgumentParser | None=None):
 
     if args.list_imports:
+        # imported here when needed to keep the startup of the other commands short
+        from . import execute, runtime
         my_dir = os.path.dirname(__file__)
         for m in sys.modules.values():
             path = getattr(m, '__file__', None)
@@ -135,6 +173,22 @@ def main_with_args(args: Args, parser: argparse.ArgumentParser | None=None):
         estimates.add_estimates_from(args.add_estimates_from, path=args.add_estimates_dest)
         sys.exit(0)
 
+    if args.list_robotarm_programs:
+        for name in moves.get_movelists().keys():
+            print(name)
+        sys.exit(0)
+
+    if args.inspect_robotarm_programs:
+        for k, v in moves.get_movelists().items():
+            m = re.search(r'\d+', k)
+            if not m or m.group(0) in {"19", "21"}:
+                print()
+                print(k + ':\n' + textwrap.indent(v.describe(), '  '))
+        sys.exit(0)
+
+    from . import execute
+    from .runtime import Runtime
+
     config: RuntimeConfig = RuntimeConfig.lookup(args.config_name)
 
     arms = Runtime.init(config.replace(log_filename=None).only_arm())
@@ -151,39 +205,23 @@ def main_with_args(args: Args, parser: argparse.ArgumentParser | None=None):
     em = ExperimentMetadata(desc=args.desc, operators=args.operators)
 
     if args.timing_matrix:
-        out: list[list[Any]] = []
-        # for incu in ['1200', 'X']:
-        for incu in ['X']:
-            for N in [x + 1 for x in range(18)]:
-                for two_final_washes in [True]:
-                    for interleave in [True]:
-                        args2 = replace(args,
-                            protocol='cell-paint',
-                            interleave=interleave,
-                            two_final_washes=two_final_washes,
-                            incu=incu,
-                            batch_sizes=str(N)
-                        )
-                        p = args_to_program(args2)
-                        if p:
-                            try:
-                                sim_db = execute.simulate_program(p)
-                                G = Log(sim_db).group_durations()
-                                incubations = [times for event_name, times in G.items() if 'incubation' in event_name]
-                                if incubations:
-                                    X = incubations[0][0]
-                                else:
-                                    X = float('NaN')
-                                T = pbutils.pp_secs(Log(sim_db).time_end())
-                            except:
-                                T = float('NaN')
-                                X = float('NaN')
-                            print(f'{N=}, {X=}, {T=}')
-                            out += [[N, X, T]]
-        print()
-        print(*'N incu T'.split(), sep='\t')
-        for line in out:
-            print(*line, sep='\t')
+        grid: dict[str, list[Any]] = {
+            'batch_sizes': [str(N + 1) for N in range(18)],
+            'incu': ['X'],
+            'interleave': [True],
+            'two_final_washes': [True],
+        }
+        if args.sweep:
+            grid |= json.loads(args.sweep)
+        points = sweep.expand_grid(replace(args, protocol='cell-paint'), grid)
+        results = sweep.run_sweep(timing_point, points, workers=args.sweep_workers or None)
+        sweep.write_rows(
+            (
+                {k: getattr(point, k) for k in grid} | res
+                for point, res in results
+            ),
+            path=args.sweep_out or None,
+        )
         quit()
 
     if args.force_update_protocol_paths or config.name == 'live':
@@ -203,6 +241,12 @@ def main_with_args(args: Args, parser: argparse.ArgumentParser | None=None):
     elif args.list_stages:
         pbutils.pr(args_to_stages(args))
 
+    elif args.monte_carlo:
+        from . import montecarlo
+        p = args_to_program(args)
+        assert p, 'no program from these arguments!'
+        montecarlo.report(p, K=args.monte_carlo)
+
     elif args.run_program_in_log_filename:
         with DB.open(args.run_program_in_log_filename) as db:
             execute.execute_simulated_program(config, db, [
@@ -243,17 +287,6 @@ def main_with_args(args: Args, parser: argparse.ArgumentParser | None=None):
         assert runtime.ur
         runtime.ur.execute_moves([moves.RawCode(args.robotarm_send)], name='raw')
 
-    elif args.list_robotarm_programs:
-        for name in movelists.keys():
-            print(name)
-
-    elif args.inspect_robotarm_programs:
-        for k, v in movelists.items():
-            m = re.search(r'\d+', k)
-            if not m or m.group(0) in {"19", "21"}:
-                print()
-                print(k + ':\n' + textwrap.indent(v.describe(), '  '))
-
     else:
         assert parser
         parser.print_help()
@@ -341,6 +374,62 @@ def args_to_program(args: Args) -> Program | None:
     else:
         return None
 
+def timing_point(args: Args, cache_path: str | None = None) -> dict[str, Any]:
+    '''
+    Simulates one point of the timing matrix, using the schedule cache at
+    cache_path if given. It is passed here since the points can be run in
+    processes that do not share the module state of this one.
+
+    A point that fails gets null times and the error in its row.
+    '''
+    def on_sigterm(*_: Any):
+        # errors in simulation threads terminate the process (see Runtime.excepthook)
+        raise ValueError('Simulation failed')
+    X: str | None = None
+    T: float | None = None
+    error: str | None = None
+    sigterm = signal.signal(signal.SIGTERM, on_sigterm)
+    try:
+        if p := args_to_program(args):
+            from . import execute
+            sim_db = execute.simulate_program(p, incremental=True, cache_path=cache_path)
+            G = Log(sim_db).group_durations()
+            incubations = [times for event_name, times in G.items() if 'incubation' in event_name]
+            if incubations:
+                X = incubations[0][0]
+            T = Log(sim_db).time_end()
+        else:
+            error = 'No program'
+    except Exception as e:
+        error = f'{e.__class__.__name__}: {e}'
+    finally:
+        signal.signal(signal.SIGTERM, sigterm)
+    return {
+        'incubation': X,
+        'T': None if T is None else pbutils.pp_secs(T),
+        'secs': T,
+        'error': error,
+    }
+
+def test_timing_point_sweep(tmp_path: Path):
+    import functools
+    grid: dict[str, list[Any]] = {'batch_sizes': ['1', 'x']}
+    points = sweep.expand_grid(replace(Args(), protocol='cell-paint', interleave=True, two_final_washes=True), grid)
+    out = str(tmp_path / 'sweep.jsonl')
+    sweep.write_rows(
+        (
+            {k: getattr(point, k) for k in grid} | res
+            for point, res in sweep.run_sweep(functools.partial(timing_point, cache_path=str(tmp_path / 'schedules.db')), points, workers=2)
+        ),
+        path=out,
+    )
+    rows = {row['batch_sizes']: row for row in map(json.loads, Path(out).read_text().splitlines())}
+    assert rows['1']['error'] is None
+    assert rows['1']['secs'] > 0
+    assert rows['x'] == {'batch_sizes': 'x', 'incubation': None, 'T': None, 'secs': None, 'error': rows['x']['error']}
+    assert 'ValueError' in rows['x']['error']
+    assert (tmp_path / 'schedules.db').exists()
+
 def parse_sim_delays(args: Args):
     sim_delays: dict[int, float] = {}
     for kv in args.sim_delays.split(','):
@@ -187,7 +187,7 @@ def sleek_program(program: Command) -> Command:
             if cmd.program_name in moves.sleeking_not_allowed:
                 return None
             else:
-                return moves.movelists.get(cmd.program_name)
+                return moves.get_movelists().get(cmd.program_name)
         else:
             return None
     def pair_ok(cmd_and_metadata1: tuple[Command, Metadata], cmd_and_metadata2: tuple[Command, Metadata]) -> bool:
@@ -204,13 +204,13 @@ def sleek_program(program: Command) -> Command:
         ]
     )
 
-def prepare_program(program: Program, sim_delays: dict[int, float]) -> tuple[Program, dict[int, float]]:
+def prepare_program(program: Program, sim_delays: dict[int, float], incremental: bool=False) -> tuple[Program, dict[int, float]]:
     cmd = program.command
     cmd = sleek_program(cmd)
     cmd = cmd.remove_noops()
 
     with pbutils.timeit('scheduling'):
-        cmd, expected_ends = constraints.optimize(cmd)
+        cmd, expected_ends = constraints.optimize(cmd, incremental=incremental)
 
     def AddSimDelays(cmd: commands.Command) -> commands.Command:
         if isinstance(cmd, commands.Meta):
@@ -349,3 +349,82 @@ def test_ilv():
         (4, 'b -> c'),
         (4, 'c -> d'),
     ]
+
+def test_traversals():
+    '''
+    The traversals give the same results as the plain recursive definitions
+    on cell paint, before and after scheduling.
+    '''
+    from .cli import Args, args_to_program
+
+    def universe(cmd: Command) -> Iterator[Command]:
+        yield cmd
+        match cmd:
+            case SeqCmd():
+                for c in cmd.commands:
+                    yield from universe(c)
+            case Fork() | Meta() | OptimizeSection():
+                yield from universe(cmd.command)
+            case _:
+                pass
+
+    def transform(cmd: Command, f: Callable[[Command], Command], reverse: bool=False) -> Command:
+        match cmd:
+            case SeqCmd():
+                inner = list(reversed(cmd.commands)) if reverse else cmd.commands
+                inner = [transform(c, f, reverse) for c in inner]
+                inner = list(reversed(inner)) if reverse else inner
+                return f(cmd.replace(commands=inner))
+            case Fork() | Meta() | OptimizeSection():
+                return f(cmd.replace(command=transform(cmd.command, f, reverse)))
+            case _:
+                return f(cmd)
+
+    def collect(cmd: Command) -> list[tuple[Command, Metadata]]:
+        match cmd:
+            case SeqCmd():
+                return [tup for c in cmd.commands for tup in collect(c)]
+            case Meta():
+                return [(c, m.merge(cmd.metadata)) for c, m in collect(cmd.command)]
+            case _:
+                return [(cmd, Metadata())]
+
+    def resource(fork: Fork) -> str | None:
+        for cmd, _ in collect(fork.command):
+            if r := cmd.required_resource():
+                return r
+        return None
+
+    def renumber():
+        n = 0
+        def f(cmd: Command) -> Command:
+            nonlocal n
+            if isinstance(cmd, Checkpoint):
+                n += 1
+                return cmd.replace(name=f'{cmd.name} {n}')
+            return cmd
+        return f
+
+    program = args_to_program(Args(protocol='cell-paint', batch_sizes='2', interleave=True, two_final_washes=True))
+    assert program
+    scheduled, _ = prepare_program(program, sim_delays={})
+    for cmd in [program.command, scheduled.command]:
+        assert list(cmd.universe()) == list(universe(cmd))
+        assert cmd.transform(lambda c: c) is cmd
+        for reverse in [False, True]:
+            assert cmd.transform(renumber(), reverse=reverse) == transform(cmd, renumber(), reverse)
+        assert cmd.collect() == collect(cmd)
+        assert cmd.checkpoints() == {c.name for c in universe(cmd) if isinstance(c, Checkpoint)}
+        assert cmd.free_vars() == {
+            v
+            for c in universe(cmd)
+            for v in (
+                c.seconds.var_set() if isinstance(c, Idle) else
+                c.plus_seconds.var_set() if isinstance(c, WaitForCheckpoint) else
+                set[str]()
+            )
+        }
+        for c in universe(cmd):
+            assert c.is_noop() == all(isinstance(d, SeqCmd | Fork | Meta | OptimizeSection) for d in universe(c))
+            if isinstance(c, Fork):
+                assert c.resource == resource(c)
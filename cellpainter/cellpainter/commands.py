@@ -6,13 +6,14 @@ import abc
 
 from pbutils.mixins import DBMixin, ReplaceMixin
 
-from .moves import Effect, World, effects, MovePlate
+from .moves import Effect, World, MovePlate, get_effects
 from .symbolic import Symbolic
 import pbutils
 
-from labrobots.nikon_nis import JobNameDict
+if TYPE_CHECKING:
+    from labrobots.nikon_nis import JobNameDict
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Metadata:
     id: int = 0
 
@@ -37,10 +38,42 @@ class Metadata:
         repl: dict[str, Any] = {}
         for other in others:
             repl.update(pbutils.nub(other))
+        if not repl:
+            return self
         out = replace(self, **repl)
         return out
 
-class Command(ReplaceMixin, abc.ABC):
+A = TypeVar('A')
+
+class node_cache(Generic[A]):
+    '''
+    Like functools.cached_property but only caches on instances with a __dict__.
+
+    The leaves and Meta nodes use __slots__ to keep programs small and are
+    cheap to recompute, and the other inner nodes cache their result.
+    '''
+    def __init__(self, f: Callable[[Any], A]):
+        self.f = f
+
+    def __set_name__(self, owner: Any, name: str):
+        self.name = name
+
+    def __get__(self, obj: Any, objtype: Any=None) -> A:
+        d = getattr(obj, '__dict__', None)
+        if d is None:
+            return self.f(obj)
+        if self.name not in d:
+            d[self.name] = self.f(obj)
+        return d[self.name]
+
+class Command(ReplaceMixin):
+    '''
+    Commands are immutable so subterms are shared between the results of
+    transform and the sets computed by free_vars, checkpoints and is_noop
+    are cached on the inner nodes.
+    '''
+    __slots__ = ()
+
     @property
     def type(self) -> str:
         return self.__class__.__name__
@@ -94,33 +127,39 @@ class Command(ReplaceMixin, abc.ABC):
         return self.transform(F), did_transform
 
     def collect(self: Command, flatten_sections: bool=False) -> list[tuple[Command, Metadata]]:
-        match self:
-            case SeqCmd():
-                return [
-                    tup
-                    for cmd in self.commands
-                    for tup in cmd.collect()
-                ]
-            case Meta():
-                return [
-                    (collected_cmd, collected_metadata.merge(self.metadata))
-                    for collected_cmd, collected_metadata in self.command.collect()
-                ]
-            case OptimizeSection() if flatten_sections:
-                return self.command.collect()
-            # case OptimizeSection():
-            #     raise ValueError(f'collect({self})')
-            case _:
-                return [(self, Metadata())]
+        '''
+        The commands in sequence with their metadata merged from the outside in,
+        where outer metadata has precedence.
+        '''
+        out: list[tuple[Command, Metadata]] = []
+        def go(cmd: Command, metadata: Metadata, flatten_sections: bool=False):
+            match cmd:
+                case SeqCmd():
+                    for c in cmd.commands:
+                        go(c, metadata)
+                case Meta():
+                    go(cmd.command, cmd.metadata.merge(metadata))
+                case OptimizeSection() if flatten_sections:
+                    go(cmd.command, metadata)
+                # case OptimizeSection():
+                #     raise ValueError(f'collect({cmd})')
+                case _:
+                    out.append((cmd, metadata))
+        go(self, Metadata(), flatten_sections)
+        return out
 
     def is_noop(self: Command) -> bool:
+        return self._is_noop
+
+    @node_cache
+    def _is_noop(self: Command) -> bool:
         match self:
             case Idle():
                 return False
             case SeqCmd():
-                return all(cmd.is_noop() for cmd in self.commands)
+                return all(cmd._is_noop for cmd in self.commands)
             case Fork() | Meta() | OptimizeSection():
-                return self.command.is_noop()
+                return self.command._is_noop
             case _:
                 return False
 
@@ -128,6 +167,8 @@ class Command(ReplaceMixin, abc.ABC):
         '''
         Bottom-up transformation a la "Uniform boilerplate and list processing"
         (Mitchell & Runciman, 2007) https://dl.acm.org/doi/10.1145/1291201.1291208
+
+        Nodes whose children are unchanged are passed to f as they are.
         '''
         match self:
             case SeqCmd():
@@ -137,9 +178,16 @@ class Command(ReplaceMixin, abc.ABC):
                 inner_commands = [cmd.transform(f, reverse=reverse) for cmd in inner_commands]
                 if reverse:
                     inner_commands = list(reversed(inner_commands))
-                return f(self.replace(commands=inner_commands))
+                if any(new is not old for new, old in zip(inner_commands, self.commands)):
+                    return f(self.replace(commands=inner_commands))
+                else:
+                    return f(self)
             case Fork() | Meta() | OptimizeSection():
-                return f(self.replace(command=self.command.transform(f, reverse=reverse)))
+                inner_command = self.command.transform(f, reverse=reverse)
+                if inner_command is not self.command:
+                    return f(self.replace(command=inner_command))
+                else:
+                    return f(self)
             case _:
                 return f(self)
 
@@ -148,15 +196,17 @@ class Command(ReplaceMixin, abc.ABC):
         Universe of all subterms a la "Uniform boilerplate and list processing"
         (Mitchell & Runciman, 2007) https://dl.acm.org/doi/10.1145/1291201.1291208
         '''
-        yield self
-        match self:
-            case SeqCmd():
-                for cmd in self.commands:
-                    yield from cmd.universe()
-            case Fork() | Meta() | OptimizeSection():
-                yield from self.command.universe()
-            case _:
-                pass
+        stack: list[Command] = [self]
+        while stack:
+            cmd = stack.pop()
+            yield cmd
+            match cmd:
+                case SeqCmd():
+                    stack += reversed(cmd.commands)
+                case Fork() | Meta() | OptimizeSection():
+                    stack += [cmd.command]
+                case _:
+                    pass
 
     def push_metadata_into_forks(self) -> Command:
         res: list[Command] = []
@@ -180,11 +230,19 @@ class Command(ReplaceMixin, abc.ABC):
         )
 
     def checkpoints(self: Command) -> set[str]:
-        return {
-            cmd.name
-            for cmd in self.universe()
-            if isinstance(cmd, Checkpoint)
-        }
+        return set(self._checkpoints)
+
+    @node_cache
+    def _checkpoints(self: Command) -> frozenset[str]:
+        match self:
+            case Checkpoint():
+                return frozenset([self.name])
+            case SeqCmd():
+                return frozenset[str]().union(*(cmd._checkpoints for cmd in self.commands))
+            case Fork() | Meta() | OptimizeSection():
+                return self.command._checkpoints
+            case _:
+                return frozenset()
 
     def make_resource_checkpoints(self: Command) -> Command:
         '''
@@ -344,21 +402,26 @@ class Command(ReplaceMixin, abc.ABC):
         return self.transform(F)
 
     def free_vars(self: Command) -> set[str]:
-        out: set[str] = set()
-        for cmd in self.universe():
-            match cmd:
-                case Idle():
-                    out |= cmd.seconds.var_set()
-                case WaitForCheckpoint():
-                    out |= cmd.plus_seconds.var_set()
-                case _:
-                    pass
-        return out
+        return set(self._free_vars)
+
+    @node_cache
+    def _free_vars(self: Command) -> frozenset[str]:
+        match self:
+            case Idle():
+                return frozenset(self.seconds.var_set())
+            case WaitForCheckpoint():
+                return frozenset(self.plus_seconds.var_set())
+            case SeqCmd():
+                return frozenset[str]().union(*(cmd._free_vars for cmd in self.commands))
+            case Fork() | Meta() | OptimizeSection():
+                return self.command._free_vars
+            case _:
+                return frozenset()
 
     def effect(self) -> Effect | None:
         match self:
             case RobotarmCmd():
-                return effects.get(self.program_name)
+                return get_effects().get(self.program_name)
             case IncuCmd() if self.action == 'put' and self.incu_loc:
                 return MovePlate(source='incu', target=self.incu_loc)
             case IncuCmd() if self.action == 'get' and self.incu_loc:
@@ -366,11 +429,13 @@ class Command(ReplaceMixin, abc.ABC):
             case _:
                 return None
 
-class PhysicalCommand(Command, abc.ABC):
+class PhysicalCommand(Command):
+    __slots__ = ()
+
     def normalize(self) -> PhysicalCommand:
         return self
 
-@dataclass(frozen=True, kw_only=True)
+@dataclass(frozen=True, kw_only=True, slots=True)
 class Meta(Command):
     command: Command = field(default_factory=lambda: Noop())
     metadata: Metadata = field(default_factory=lambda: Metadata())
@@ -398,7 +463,7 @@ class OptimizeSection(Command):
     command: Command
     name: str | None = None
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Idle(Command):
     secs: Symbolic | float | int = 0.0
     only_for_scheduling: bool = False
@@ -410,13 +475,13 @@ class Idle(Command):
     def __add__(self, other: float | int | str | Symbolic) -> Idle:
         return self.replace(secs = self.seconds + other)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Checkpoint(Command):
     name: str
 
 WaitAssumption = Literal['nothing', 'will wait', 'no wait']
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class WaitForCheckpoint(Command):
     name: str = ''
     plus_secs: Symbolic | float | int = 0.0
@@ -429,12 +494,12 @@ class WaitForCheckpoint(Command):
     def __add__(self, other: float | int | str | Symbolic) -> WaitForCheckpoint:
         return self.replace(plus_secs=self.plus_seconds + other)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Duration(Command):
     name: str # constraint since this reference checkpoint
     constraint: None | Max = None
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Max:
     priority: int
     weight: float = 1
@@ -454,8 +519,8 @@ class Fork(Command):
     # assume: ForkAssumption = 'nothing'
     align: Literal['begin', 'end'] = 'begin'
 
-    @property
-    def resource(self):
+    @node_cache
+    def resource(self) -> str | None:
         for cmd, _ in self.command.collect():
             assert not isinstance(cmd, WaitForResource) # only the main thread can wait for resources
             if resource := cmd.required_resource():
@@ -474,7 +539,7 @@ class Fork(Command):
         assert self.resource
         return self >> WaitForResource(self.resource, assume=assume)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class WaitForResource(Command):
     '''
     only the main thread can wait for resources
@@ -482,7 +547,7 @@ class WaitForResource(Command):
     resource: str
     assume: WaitAssumption = 'nothing'
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class RobotarmCmd(PhysicalCommand):
     program_name: str
 
@@ -496,7 +561,7 @@ BiotekAction = Literal[
     'TestCommunications',
 ]
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class BiotekCmd(PhysicalCommand):
     machine: Literal['wash', 'disp']
     action: BiotekAction
@@ -536,7 +601,7 @@ BlueWashAction = Literal[
     'get_working_plate',
 ]
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class BlueCmd(PhysicalCommand):
     action: BlueWashAction
     protocol_path: str | None = None
@@ -548,14 +613,14 @@ class BlueCmd(PhysicalCommand):
     def required_resource(self):
         return 'blue'
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class DLidCheckStatusCmd(PhysicalCommand):
     dlid_loc: Literal['B12', 'B14']
     status: Literal['free', 'taken']
     def normalize(self):
         return DLidCheckStatusCmd(dlid_loc='B14', status='free')
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class IncuCmd(PhysicalCommand):
     action: Literal['put', 'get', 'get_status', 'reset_and_activate']
     incu_loc: str | None = None
@@ -786,7 +851,7 @@ def SCRATCH():
         ]
         cmds
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class PFCmd(PhysicalCommand):
     '''
     Run a program on the robotarm.
@@ -797,7 +862,7 @@ class PFCmd(PhysicalCommand):
     def required_resource(self):
         return 'pf'
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class XArmCmd(PhysicalCommand):
     '''
     Run a program on the robotarm.
@@ -842,7 +907,7 @@ class NikonAcquire(NikonABC):
         return NikonAcquire(job_project=self.job_project, job_name=self.job_name, project='', plate='')
 
     def job_name_dict(self) -> JobNameDict:
-        return JobNameDict(job_project=self.job_project, job_name=self.job_name)
+        return {'job_project': self.job_project, 'job_name': self.job_name}
 
 @dataclass(frozen=True)
 class NikonStageCmd(NikonABC):
@@ -855,7 +920,7 @@ class NikonStageCmd(NikonABC):
 
     def job_name_dict(self) -> JobNameDict:
         fallback = f'{self.action=}?'
-        return JobNameDict(job_project=self.job_project or fallback, job_name=self.job_name or fallback)
+        return {'job_project': self.job_project or fallback, 'job_name': self.job_name or fallback}
 
 class FridgeABC(PhysicalCommand, abc.ABC):
     def required_resource(self):
@@ -886,7 +951,7 @@ class FridgeEject(FridgeABC):
 class FridgeCmd(FridgeABC):
     action: Literal['get_status', 'reset_and_activate']
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class BarcodeClear(PhysicalCommand):
     '''
     Clears the last seen barcode from the barcode reader memory, synchronously (waits for completion)
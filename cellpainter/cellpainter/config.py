@@ -57,6 +57,7 @@ class RuntimeConfig(DBMixin):
     # ur_speed: int = 100
     # pf_speed: int = 50
     log_filename: str | None = None
+    log_flush_interval: float = 0.5
     plate_metadata_dir: str | None = None
 
     def only_arm(self) -> RuntimeConfig:
@@ -4,10 +4,13 @@ from dataclasses import *
 
 import sys
 import contextlib
+import functools
 
 from .symbolic import Symbolic
 from .commands import *
+from .difference_constraints import DifferenceConstraints, Infeasible, Unbounded
 
+@functools.cache
 def import_z3():
     # z3 messes with the sys.path and writes an error message on stderr, so we silent it here
     import sys
@@ -26,15 +29,11 @@ def import_z3():
         print('=== import z3 end ===')
     sys.path = [*sys_path0]
 
-import_z3()
-
-from z3 import Sum, If, Optimize, Solver, Real, Int, And, Or # type: ignore
-
 from . import estimates
 from .estimates import estimate
 import pbutils
 
-def optimize(cmd: Command) -> tuple[Command, dict[int, float]]:
+def optimize(cmd: Command, incremental: bool=False) -> tuple[Command, dict[int, float]]:
     cmd = cmd.make_resource_checkpoints()
     cmd = cmd.align_forks()
     cmd = cmd.assign_ids()
@@ -46,7 +45,8 @@ def optimize(cmd: Command) -> tuple[Command, dict[int, float]]:
         nonlocal ends, subst
         if isinstance(cmd, OptimizeSection):
             cmd_inst = cmd.command.resolve(subst)
-            opt = optimal_env(cmd_inst, name=cmd.name)
+            warm = warm_starts[cmd.name] if incremental else None
+            opt = optimal_env(cmd_inst, name=cmd.name, warm=warm)
             ends |= opt.expected_ends
             subst |= opt.env
             return cmd_inst.resolve(opt.env)
@@ -80,16 +80,223 @@ class Ids:
 class OptimalResult:
     env: dict[str, float]
     expected_ends: dict[int, float]
+    objectives: list[float] = field(default_factory=lambda: list[float]()) # values, most important first
+
+@dataclass
+class WarmStart:
+    '''
+    A z3 Optimize instance kept alive between calls to optimal_env.
+
+    The constraints shared with the previous programs stay asserted at the
+    base level and only the changed constraints and the objectives are added
+    in a push/pop scope. The previous model is given as initial values.
+    Re-optimizing after a small change (a different batch sep, a changed
+    estimate, an added plate) thus only adds the constraints that changed.
+
+    When a base constraint is no longer used the base is rebuilt from the
+    constraints in common, so the base converges to the stable part.
+    '''
+    s: Any = None
+    base: dict[int, Any] = field(default_factory=lambda: dict[int, Any]())
+    hints: list[tuple[Any, Any]] = field(default_factory=lambda: list[tuple[Any, Any]]())
+
+    def check(self, clauses: dict[int, Any], objectives: list[Any]) -> tuple[str, Any]:
+        from z3 import Optimize # type: ignore
+        if self.s is None or not self.base.keys() <= clauses.keys():
+            if self.s is None:
+                keep = clauses.keys()
+            else:
+                keep = self.base.keys() & clauses.keys()
+            # the clauses are kept alive so that their ids are not reused
+            self.base = {key: clauses[key] for key in keep}
+            self.s = Optimize()
+            for clause in self.base.values():
+                self.s.add(clause)
+        s = self.s
+        for var, value in self.hints:
+            s.set_initial_value(var, value)
+        s.push()
+        for key, clause in clauses.items():
+            if key not in self.base:
+                s.add(clause)
+        for objective in objectives:
+            s.maximize(objective)
+        check = str(s.check())
+        M = None
+        if check != 'unsat':
+            M = s.model()
+            self.hints = [(d(), M[d]) for d in M.decls()]
+        s.pop()
+        return check, M
+
+warm_starts: dict[str | None, WarmStart] = DefaultDict(WarmStart)
+
+class NeedsZ3(Exception):
+    pass
+
+def difference_env(cmd: Command) -> OptimalResult:
+    '''
+    Schedules a program in pure python when all its constraints are difference
+    constraints between points in time (see difference_constraints.py).
+
+    A WaitForCheckpoint with assume='nothing' and a slack variable of its own
+    waits exactly until the checkpoint plus the slack, since the slack can be
+    made larger whenever begin is later. Without slack it is encoded as being
+    at or after both the checkpoint and its begin. When the optimal schedule
+    of this relaxation is the max of the two it is also optimal with the
+    disjunction.
+
+    Raises NeedsZ3 when this does not hold, for free variables used in more
+    than one place and for programs that cannot be scheduled.
+    '''
+    g = DifferenceConstraints()
+
+    checkpoints: dict[str, int] = {}
+    slacks: dict[str, tuple[int, int, float]] = {}
+    maxes: list[tuple[int, int, int]] = []
+    levels: dict[int, dict[int, float]] = DefaultDict(lambda: DefaultDict(float))
+    ends: dict[int, int] = {}
+
+    def checkpoint(name: str) -> int:
+        if name not in checkpoints:
+            checkpoints[name] = g.node()
+        return checkpoints[name]
+
+    def span(u: int, secs: Symbolic) -> int:
+        v = g.node()
+        offset = round(float(secs.offset), 4)
+        match secs.var_names:
+            case []:
+                g.eq(v, u, offset)
+            case [var] if var not in slacks:
+                slacks[var] = (u, v, offset)
+                g.geq(v, u, offset)
+            case _:
+                raise NeedsZ3(f'{secs} is not a difference constraint')
+        return v
 
-def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False, name: str | None=None) -> OptimalResult:
+    def run(cmd: Command, begin: int, *, is_main: bool) -> int:
+        match cmd:
+            case Idle():
+                end = span(begin, cmd.seconds)
+                # seconds >= 0 also when its offset is negative
+                g.geq(end, begin, 0)
+                return end
+            case BarcodeClear():
+                return span(begin, Symbolic.const(estimate(cmd)))
+            case PhysicalCommand():
+                if isinstance(cmd, RobotarmCmd | PFCmd | XArmCmd | DLidCheckStatusCmd):
+                    assert is_main, f'Must be run in main thread {cmd=}'
+                else:
+                    assert not is_main, f'Cannot run in main thread {cmd=}'
+                return span(begin, Symbolic.const(estimate(cmd)))
+            case Checkpoint():
+                g.eq(checkpoint(cmd.name), begin, 0)
+                return begin
+            case WaitForCheckpoint():
+                point = span(checkpoint(cmd.name), cmd.plus_seconds)
+                g.geq(point, checkpoint(cmd.name), 0)
+                if cmd.assume == 'no wait':
+                    g.geq(begin, point, 0)
+                    return begin
+                elif cmd.assume == 'will wait' or cmd.plus_seconds.var_names:
+                    # with its own slack the wait is the max of the two
+                    g.geq(point, begin, 0)
+                    return point
+                else:
+                    wait_to = g.node()
+                    g.geq(wait_to, point, 0)
+                    g.geq(wait_to, begin, 0)
+                    maxes.append((wait_to, point, begin))
+                    return wait_to
+            case Duration():
+                g.geq(begin, checkpoint(cmd.name), 0)
+                match cmd.constraint:
+                    case Max():
+                        maxi = cmd.constraint
+                        levels[maxi.priority][begin] += maxi.weight
+                        levels[maxi.priority][checkpoint(cmd.name)] -= maxi.weight
+                    case None:
+                        pass
+                return begin
+            case SeqCmd():
+                end = begin
+                for c in cmd.commands:
+                    end = run(c, end, is_main=is_main)
+                return end
+            case Meta():
+                end = run(cmd.command, begin, is_main=is_main)
+                if cmd_id := cmd.metadata.id:
+                    ends[cmd_id] = end
+                return end
+            case Fork():
+                assert is_main, 'can only fork from the main thread'
+                _ = run(cmd.command, begin, is_main=False)
+                return begin
+            case _:
+                raise ValueError(f'No case for {cmd=}')
+
+    run(cmd, 0, is_main=True)
+
+    objectives = [
+        levels[prio]
+        for prio in sorted(levels.keys(), reverse=True)
+    ]
+    try:
+        t = g.lexicographic(objectives)
+    except (Infeasible, Unbounded) as e:
+        raise NeedsZ3(str(e))
+
+    for wait_to, point, begin in maxes:
+        if t[wait_to] > max(t[point], t[begin]) + 1e-4:
+            raise NeedsZ3('Wait is not the max of its checkpoint and begin')
+
+    env: dict[str, float] = {}
+    for var in sorted(cmd.free_vars()):
+        if var not in slacks:
+            raise NeedsZ3(f'{var=} is not a slack')
+        u, v, offset = slacks[var]
+        env[var] = round(t[v] - t[u] - offset, 4)
+
+    expected_ends = {
+        i: round(t[end], 4)
+        for i, end in ends.items()
+    }
+
+    return OptimalResult(
+        env=env,
+        expected_ends=expected_ends,
+        objectives=[
+            round(sum(c * t[v] for v, c in objective.items()), 4)
+            for objective in objectives
+        ],
+    )
+
+def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False, name: str | None=None, warm: WarmStart | None=None) -> OptimalResult:
+    '''
+    Schedules with difference_env when possible and otherwise with z3,
+    re-using the solver in warm if given.
+    '''
+    if not cmd.free_vars():
+        return OptimalResult({}, {})
+
+    if not unsat_core and not explain_mode:
+        try:
+            return difference_env(cmd)
+        except NeedsZ3:
+            pass
+
+    return z3_env(cmd, unsat_core=unsat_core, explain_mode=explain_mode, name=name, warm=warm)
+
+def z3_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False, name: str | None=None, warm: WarmStart | None=None) -> OptimalResult:
     if unsat_core:
         # pbutils.pr(cmd)
         pass
 
     variables = cmd.free_vars()
 
-    if not variables:
-        return OptimalResult({}, {})
+    import_z3()
+    from z3 import Sum, Optimize, Solver, Real, Int, BoolVal, And, Or # type: ignore
 
     ids = Ids()
 
@@ -97,10 +304,16 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
     Factor = 10 ** Resolution
     use_ints = False
 
-    if unsat_core:
-        s: Any = Solver()
-    else:
-        s: Any = Optimize()
+    s: Any = Solver() if unsat_core else None
+
+    # constraints by their z3 ast id (asts are hash-consed), so that WarmStart can tell which are new
+    clauses: dict[int, Any] = {}
+    nonneg: set[str] = set()
+
+    def add(clause: Any):
+        if isinstance(clause, bool):
+            clause = BoolVal(clause)
+        clauses.setdefault(clause.get_id(), clause)
 
     def to_expr(x: Symbolic | float | int | str) -> Any:
         x = Symbolic.wrap(x)
@@ -108,14 +321,18 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
             res = round(float(x.offset) * Factor)
             for v in x.var_names:
                 vv = Int(v)
-                s.add(vv >= 0)
+                if v not in nonneg:
+                    nonneg.add(v)
+                    add(vv >= 0)
                 res += vv
             return res
         else:
             res = round(float(x.offset), Resolution)
             for v in x.var_names:
                 vv = Real(v)
-                s.add(vv >= 0.0)
+                if v not in nonneg:
+                    nonneg.add(v)
+                    add(vv >= 0.0)
                 res += vv
             return res
 
@@ -139,9 +356,9 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
                 f'{max_a_b} == max({a}, {b}) ({added}, {kws})'
             )
         else:
-            s.add(max_a_b >= a)
-            s.add(max_a_b >= b)
-            s.add(Or(max_a_b == a, max_a_b == b))
+            add(max_a_b >= a)
+            add(max_a_b >= b)
+            add(Or(max_a_b == a, max_a_b == b))
         return m
 
     def constrain(lhs: Symbolic | float | int | str, op: Literal['>', '>=', '=='], rhs: Symbolic | float | int | str, **kws: Any):
@@ -162,7 +379,7 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
             added += 1
             s.assert_and_track(clause, f'{lhs} {op} {rhs} ({added}, {kws})')
         else:
-            s.add(clause)
+            add(clause)
 
     maximize_terms: dict[int, list[tuple[float, Symbolic]]] = DefaultDict(list)
     ends: dict[int, Symbolic] = {}
@@ -253,9 +470,9 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
     # batch_sep = 180 # for specs jump
     # constrain('batch sep', '==', batch_sep * 60)
 
-    s.push()
-
     if unsat_core:
+        for clause in clauses.values():
+            s.add(clause)
         check = str(s.check())
         print(check)
         if check == 'unsat':
@@ -266,17 +483,27 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
             raise ValueError(f'Optimization says unsat, but unsat core version says {check}')
 
     # add the constraints with most important first (lexicographic optimization order)
+    maximizes: list[Any] = []
     for _prio, terms in sorted(maximize_terms.items(), reverse=True):
-        maximize = Sum(*[  # type: ignore
+        maximizes += [Sum(*[  # type: ignore
             coeff * to_expr(v) for coeff, v in terms
-        ])
-        if isinstance(maximize, (int, float)):
-            pass # nothing to do, these were already constants
-        else:
-            s.maximize(maximize)
+        ])]
+    # constants need not be maximized
+    objectives = [m for m in maximizes if not isinstance(m, (int, float))]
 
+    M: Any = None
     with pbutils.timeit(name, end='... ') if name else contextlib.nullcontext():
-        check = str(s.check())
+        if warm:
+            check, M = warm.check(clauses, objectives)
+        else:
+            s = Optimize()
+            for clause in clauses.values():
+                s.add(clause)
+            for objective in objectives:
+                s.maximize(objective)
+            check = str(s.check())
+            if check != 'unsat':
+                M = s.model()
         if check == 'unsat':
             if 0:
                 print('Impossible to schedule, obtaining unsat core')
@@ -292,11 +519,10 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
                     raise ValueError('Explain mode did not throw an error')
             raise ValueError(f'Impossible to schedule! {len(estimates.guesses)} missing time estimates: {", ".join(str(g) for g in estimates.guesses.keys())}'.rstrip(': ') + '.')
 
-    M = s.model()
-
     def model_value(a: Symbolic | str) -> float:
-        s = Symbolic.wrap(a)
-        e = to_expr(s)
+        return expr_value(to_expr(Symbolic.wrap(a)))
+
+    def expr_value(e: Any) -> float:
         if isinstance(e, (float, int)):
             if use_ints:
                 return float(e) / Factor
@@ -342,4 +568,62 @@ def optimal_env(cmd: Command, unsat_core: bool=False, explain_mode: bool=False,
         if reports:
             raise ValueError('Impossible to schedule! However it would be possible if these programs were shorter:\n' + '\n'.join(reports))
 
-    return OptimalResult(env=env, expected_ends=expected_ends)
+    return OptimalResult(env=env, expected_ends=expected_ends, objectives=[expr_value(m) for m in maximizes])
+
+def test_difference_env_schedulable():
+    from .protocol import cell_paint_program, make_protocol_config, CellPaintingArgs
+    from .protocol_paths import get_protocol_paths
+    paths = get_protocol_paths()['automation_v5.0']
+    config = make_protocol_config(paths, CellPaintingArgs(interleave=True, two_final_washes=True))
+    # two batches of six is the most the output locations allow, a batch of eight does not fit
+    for batch_sizes, schedulable in [([6, 6], True), ([8, 8], False)]:
+        cmd = cell_paint_program(batch_sizes, config).command
+        cmd = cmd.make_resource_checkpoints().align_forks().assign_ids()
+        try:
+            res = difference_env(cmd)
+        except NeedsZ3:
+            assert not schedulable
+        else:
+            assert schedulable and res.env.keys() == cmd.free_vars()
+
+def test_difference_env_agrees_with_z3():
+    '''
+    Both reach the same objective values. Their schedules can differ when
+    there are several optimal ones, so each is checked against quicksim.
+    '''
+    from .protocol import cell_paint_program, make_protocol_config, CellPaintingArgs
+    from .protocol_paths import get_protocol_paths
+    from .commandlib import quicksim, check_correspondence
+    paths = get_protocol_paths()['automation_v5.0']
+    for batch_sizes, interleave in [([1], False), ([2], True), ([3], False)]:
+        config = make_protocol_config(paths, CellPaintingArgs(incu='1200', interleave=interleave, two_final_washes=True))
+        cmd = cell_paint_program(batch_sizes, config).command
+        cmd = cmd.make_resource_checkpoints().align_forks().assign_ids()
+        diff = difference_env(cmd)
+        z3 = z3_env(cmd)
+        assert diff.env.keys() == z3.env.keys() == cmd.free_vars()
+        assert diff.expected_ends.keys() == z3.expected_ends.keys()
+        assert len(diff.objectives) == len(z3.objectives)
+        for d, z in zip(diff.objectives, z3.objectives):
+            assert abs(d - z) < 1e-3
+        for res in [diff, z3]:
+            quicksim_ends, _checkpoints = quicksim(cmd.resolve(res.env), {}, cast(Any, estimate))
+            check_correspondence(cmd, optimizer_ends=res.expected_ends, quicksim_ends=quicksim_ends)
+
+def test_warm_start():
+    from .protocol import cell_paint_program, make_protocol_config, CellPaintingArgs
+    from .protocol_paths import get_protocol_paths
+    paths = get_protocol_paths()['automation_v5.0']
+    # the incubation time is optimized so these need z3
+    config = make_protocol_config(paths, CellPaintingArgs(incu='X', two_final_washes=True))
+    warm = WarmStart()
+    # the last re-solve drops constraints from the base so it is rebuilt
+    for batch_sizes in [[1], [2], [2], [1]]:
+        cmd = cell_paint_program(batch_sizes, config).command
+        cmd = cmd.make_resource_checkpoints().align_forks().assign_ids()
+        cold = z3_env(cmd)
+        hot = z3_env(cmd, warm=warm)
+        assert hot.env.keys() == cold.env.keys() == cmd.free_vars()
+        assert len(hot.objectives) == len(cold.objectives)
+        for h, c in zip(hot.objectives, cold.objectives):
+            assert abs(h - c) < 1e-3
@@ -0,0 +1,260 @@
+'''
+Difference constraints t[v] >= t[u] + w solved with longest paths and min-cost flow.
+
+A system of difference constraints is feasible iff its constraint graph has
+no positive cycle, and the least solution is the longest path from time zero.
+
+Maximizing a linear objective sum(c[v] * t[v]) over such a system is the LP
+dual of an uncapacitated min-cost flow problem where node v supplies c[v]
+units and an edge u -> v with weight w costs -w. This is solved with
+successive shortest paths, using -t of a feasible solution as potentials.
+By complementary slackness the optimal face is the system with every edge
+that carries flow made tight, which is again a system of difference
+constraints, so lexicographic objectives are solved one level at a time.
+'''
+from __future__ import annotations
+from dataclasses import *
+from typing import *
+
+import heapq
+
+eps = 1e-6
+inf = float('inf')
+
+class Infeasible(Exception):
+    pass
+
+class Unbounded(Exception):
+    pass
+
+@dataclass
+class DifferenceConstraints:
+    '''
+    Constraints t[v] >= t[u] + w over nodes 0..num_nodes-1 where node 0 is fixed at zero.
+    '''
+    src: list[int] = field(default_factory=lambda: list[int]())
+    dst: list[int] = field(default_factory=lambda: list[int]())
+    weight: list[float] = field(default_factory=lambda: list[float]())
+    out: list[list[int]] = field(default_factory=lambda: [[]])
+    inn: list[list[int]] = field(default_factory=lambda: [[]])
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.out)
+
+    def node(self) -> int:
+        self.out.append([])
+        self.inn.append([])
+        return self.num_nodes - 1
+
+    def geq(self, v: int, u: int, w: float):
+        '''
+        t[v] >= t[u] + w
+        '''
+        e = len(self.weight)
+        self.src.append(u)
+        self.dst.append(v)
+        self.weight.append(w)
+        self.out[u].append(e)
+        self.inn[v].append(e)
+
+    def eq(self, v: int, u: int, w: float):
+        '''
+        t[v] == t[u] + w
+        '''
+        self.geq(v, u, w)
+        self.geq(u, v, -w)
+
+    def least(self, below: list[float] | None = None, changed: Iterable[int] = (0,)) -> list[float]:
+        '''
+        The least solution, by label-correcting Bellman-Ford from node 0.
+
+        Nodes are processed lowest first. They are created in program order
+        so most edges go to higher nodes and few nodes are relaxed more than
+        once. A positive cycle shows up as a cycle among the edges that last
+        relaxed each node, which is checked for every num_nodes relaxations.
+
+        Adding constraints only moves the least solution forward, so a
+        previous solution can be given in below together with the nodes
+        that have new outgoing edges.
+        '''
+        n = self.num_nodes
+        if below is None:
+            t = [-inf] * n
+            t[0] = 0.0
+        else:
+            t = list(below)
+        pred = [-1] * n
+        num_relaxed = 0
+        heap = sorted(set(changed))
+        queued = [False] * n
+        for u in heap:
+            queued[u] = True
+        dst, weight, out = self.dst, self.weight, self.out
+        while heap:
+            u = heapq.heappop(heap)
+            queued[u] = False
+            tu = t[u]
+            for e in out[u]:
+                v = dst[e]
+                tv = tu + weight[e]
+                if tv > t[v] + eps:
+                    if v == 0:
+                        raise Infeasible('Time zero is pushed forward')
+                    t[v] = tv
+                    pred[v] = u
+                    num_relaxed += 1
+                    if num_relaxed % n == 0 and has_cycle(pred):
+                        raise Infeasible('Positive cycle')
+                    if not queued[v]:
+                        queued[v] = True
+                        heapq.heappush(heap, v)
+        if -inf in t:
+            raise Unbounded('Some point in time is not constrained from time zero')
+        return t
+
+    def tight_edges(self, c: dict[int, float], t: list[float]) -> list[int]:
+        '''
+        Maximizes sum(c[v] * t[v]) starting from the feasible solution t and
+        returns the edges carrying flow in an optimal dual solution.
+        Node 0 is fixed so it balances the flow of all other nodes.
+
+        Each augmenting path is found with Dijkstra on the reduced costs. Its
+        arrays are allocated once and only the entries it touched are reset.
+        '''
+        src, dst, weight, out, inn = self.src, self.dst, self.weight, self.out, self.inn
+        n = self.num_nodes
+        pi = [-x for x in t]
+        flow = [0.0] * len(weight)
+        excess = [0.0] * n
+        for v, x in c.items():
+            if v != 0 and abs(x) > eps:
+                excess[v] = x
+        balance = -sum(excess)
+        if abs(balance) > eps:
+            excess[0] = balance
+        sources = [v for v in range(n) if excess[v] > eps]
+        dist = [inf] * n
+        done = [False] * n
+        pred_edge = [0] * n
+        pred_forward = [False] * n
+        while sources:
+            s = sources[-1]
+            if excess[s] <= eps:
+                sources.pop()
+                continue
+            dist[s] = 0.0
+            touched = [s]
+            visited: list[int] = []
+            heap = [(0.0, s)]
+            sink = None
+            while heap:
+                d, u = heapq.heappop(heap)
+                if done[u]:
+                    continue
+                done[u] = True
+                visited.append(u)
+                if excess[u] < -eps:
+                    sink = u
+                    break
+                pu = pi[u]
+                for e in out[u]:
+                    v = dst[e]
+                    if done[v]:
+                        continue
+                    rc = pu - pi[v] - weight[e]
+                    nd = d + rc if rc > 0.0 else d
+                    if nd < dist[v]:
+                        if dist[v] == inf:
+                            touched.append(v)
+                        dist[v] = nd
+                        pred_edge[v] = e
+                        pred_forward[v] = True
+                        heapq.heappush(heap, (nd, v))
+                for e in inn[u]:
+                    if flow[e] <= eps:
+                        continue
+                    v = src[e]
+                    if done[v]:
+                        continue
+                    rc = pu - pi[v] + weight[e]
+                    nd = d + rc if rc > 0.0 else d
+                    if nd < dist[v]:
+                        if dist[v] == inf:
+                            touched.append(v)
+                        dist[v] = nd
+                        pred_edge[v] = e
+                        pred_forward[v] = False
+                        heapq.heappush(heap, (nd, v))
+            if sink is None:
+                raise Unbounded('Objective is unbounded')
+            D = dist[sink]
+            for v in visited:
+                if dist[v] < D:
+                    pi[v] += dist[v] - D
+            amount = min(excess[s], -excess[sink])
+            path: list[tuple[int, bool]] = []
+            v = sink
+            while v != s:
+                e, forward = pred_edge[v], pred_forward[v]
+                path += [(e, forward)]
+                if not forward:
+                    amount = min(amount, flow[e])
+                v = src[e] if forward else dst[e]
+            for e, forward in path:
+                flow[e] += amount if forward else -amount
+            excess[s] -= amount
+            excess[sink] += amount
+            for v in touched:
+                dist[v] = inf
+            for v in visited:
+                done[v] = False
+        return [e for e, f in enumerate(flow) if f > eps]
+
+    def lexicographic(self, levels: list[dict[int, float]]) -> list[float]:
+        '''
+        Maximizes sum(c[v] * t[v]) for each c in levels, most important
+        first, and returns the least solution on the optimal face.
+        '''
+        t = self.least()
+        for c in levels:
+            tight = self.tight_edges(c, t)
+            for e in tight:
+                self.geq(self.src[e], self.dst[e], -self.weight[e])
+            t = self.least(t, [self.dst[e] for e in tight])
+        return t
+
+def has_cycle(pred: list[int]) -> bool:
+    '''
+    True if following pred from some node leads back to it. Nodes without pred have -1.
+    '''
+    seen = [-1] * len(pred)
+    for start in range(len(pred)):
+        v = start
+        while v != -1 and seen[v] == -1:
+            seen[v] = start
+            v = pred[v]
+        if v != -1 and seen[v] == start:
+            return True
+    return False
+
+def test_lexicographic():
+    g = DifferenceConstraints()
+    a, b, c = g.node(), g.node(), g.node()
+    g.eq(a, 0, 10)       # a = 10
+    g.geq(b, a, 5)       # b >= a + 5
+    g.geq(c, b, 0)       # c >= b
+    g.geq(a, c, -20)     # c <= a + 20
+    assert g.least() == [0, 10, 15, 15]
+    # maximize c - b, then minimize b
+    t = g.lexicographic([{c: 1, b: -1}, {b: -1}])
+    assert t == [0, 10, 15, 30]
+    # minimize c - a, then maximize b - a
+    g = DifferenceConstraints()
+    a, b, c = g.node(), g.node(), g.node()
+    g.geq(a, 0, 1)
+    g.geq(b, a, 5)
+    g.geq(c, b, 0)
+    g.geq(a, c, -20)
+    t = g.lexicographic([{c: -1, a: 1}, {b: 1, a: -1}])
+    assert t == [0, 1, 6, 6]
@@ -3,6 +3,7 @@ from dataclasses import *
 from typing import *
 
 from datetime import timedelta
+import functools
 
 from .log import Log
 from .commands import *
@@ -55,7 +56,7 @@ def add_estimates_from(log_path: str, *, path: str=estimates_jsonl_path):
                 ]
         entries = trimmed
     else:
-        with Log.open(log_path) as log:
+        with Log.open(log_path, read_only=True) as log:
             rt = log.runtime_metadata()
             assert rt
             for e in log.command_states():
@@ -113,32 +114,39 @@ def rewrite_estimates(in_path: str=estimates_json_path, out_path: str=estimates_
     flat = sorted(flat, key=entry_order)
     pbutils.serializer.write_jsonl(flat, out_path)
 
-estimates = read_estimates()
 guesses: dict[PhysicalCommand, float] = {}
 
-estimates = {
-    RobotarmCmd('noop'): 0.5,
-    **estimates
-}
+@functools.cache
+def get_estimates() -> dict[PhysicalCommand, float]:
+    '''
+    The estimates, read on first use. Guesses for missing commands are added by estimate.
+    '''
+    estimates = {
+        RobotarmCmd('noop'): 0.5,
+        **read_estimates()
+    }
+
+    for cmd, v in list(estimates.items()):
+        if isinstance(cmd, BiotekCmd) and cmd.action =='Run':
+            kv = cmd.replace(machine=cmd.machine, action='Validate')
+            kr = cmd.replace(machine=cmd.machine, action='RunValidated')
+            if kv not in estimates and kr not in estimates:
+                estimates[kv] = 4.0 if cmd.machine == 'disp' else 1.5
+                estimates[kr] = v - estimates[kv]
 
-for cmd, v in list(estimates.items()):
-    if isinstance(cmd, BiotekCmd) and cmd.action =='Run':
-        kv = cmd.replace(machine=cmd.machine, action='Validate')
-        kr = cmd.replace(machine=cmd.machine, action='RunValidated')
-        if kv not in estimates and kr not in estimates:
-            estimates[kv] = 4.0 if cmd.machine == 'disp' else 1.5
-            estimates[kr] = v - estimates[kv]
+    if 1:
+        for k, v in list(estimates.items()):
+            if isinstance(k, RobotarmCmd):
+                estimates[k] = v / 1.0
 
-if 1:
-    for k, v in list(estimates.items()):
-        if isinstance(k, RobotarmCmd):
-            estimates[k] = v / 1.0
+    return estimates
 
 import re
 
 def estimate(cmd: PhysicalCommand) -> float:
     assert isinstance(cmd, PhysicalCommand), f'{cmd} is not estimatable'
     cmd = cmd.normalize()
+    estimates = get_estimates()
     if cmd not in estimates:
         match cmd:
             case BiotekCmd(action='Validate'):
@@ -14,12 +14,13 @@ from .log import (
 
 from .runtime import RuntimeConfig, Runtime
 from . import commandlib
+from . import moves
 import pbutils
-from .moves import movelists
 from . import bioteks
 from . import bluewash
 from . import incubator
 from . import protocol_paths
+from . import schedule_cache
 from .estimates import estimate
 from . import estimates
 from datetime import datetime
@@ -35,6 +36,34 @@ from urllib.request import urlopen
 
 import sys
 
+def squid_progress(statuses: Iterable[dict[str, Any]]) -> Iterator[str]:
+    '''
+    The progress texts of a squid acquisition. Ends when squid is interactive
+    again after it has started running.
+    '''
+    started = False
+    for status in statuses:
+        if not status.get('interactive'):
+            started = True
+            if (progress_bar_text := status.get('progress_bar_text')):
+                yield progress_bar_text
+        elif started:
+            return
+
+def nikon_progress(statuses: Iterable[dict[str, Any]]) -> Iterator[str]:
+    '''
+    The progress texts of a nikon job. Ends when the job is no longer running.
+    '''
+    for status in statuses:
+        if not status.get('running'):
+            return
+        well, countdown = status.get('well'), status.get('countdown')
+        if countdown:
+            text = f'time remaining: {countdown}'
+            if well:
+                text = f'{well}, {text}'
+            yield text
+
 def execute(cmd: Command, runtime: Runtime, metadata: Metadata):
     if isinstance(cmd, PhysicalCommand) and metadata.est is None:
         metadata = metadata.merge(Metadata(est=estimate(cmd)))
@@ -84,16 +113,16 @@ def execute(cmd: Command, runtime: Runtime, metadata: Metadata):
                 runtime.thread_done()
 
         case RobotarmCmd():
-            movelist = movelists.get(cmd.program_name)
+            movelist = moves.get_movelists().get(cmd.program_name)
             if movelist is None:
                 raise ValueError(f'Missing robotarm move {cmd.program_name}')
             with_gripper = runtime.config.ur_env.mode != 'execute no gripper'
-            script = movelist.make_ur_script(with_gripper=with_gripper, name=cmd.program_name)
             for ur in runtime.time_resource_use(entry, runtime.ur):
+                script = movelist.make_ur_script(with_gripper=with_gripper, name=cmd.program_name)
                 ur.execute_script(script)
 
         case PFCmd():
-            movelist = movelists.get(cmd.program_name)
+            movelist = moves.get_movelists().get(cmd.program_name)
 
             if movelist is None:
                 raise ValueError(f'Missing robotarm move {cmd.program_name}')
@@ -109,7 +138,7 @@ def execute(cmd: Command, runtime: Runtime, metadata: Metadata):
                     pf.execute_moves(movelist)
 
         case XArmCmd():
-            movelist = movelists.get(cmd.program_name)
+            movelist = moves.get_movelists().get(cmd.program_name)
 
             if movelist is None:
                 raise ValueError(f'Missing robotarm move {cmd.program_name}')
@@ -180,16 +209,8 @@ def execute(cmd: Command, runtime: Runtime, metadata: Metadata):
                 if not ok:
                     raise ValueError(f'Failed to start squid acquire. Is squid busy?')
 
-                # wait until it has started running:
-                while squid.status().get('interactive'):
-                    runtime.sleep(1.0)
-
-                # wait until it has finished running:
-                while not squid.status().get('interactive'):
-                    if (progress_bar_text := squid.status().get('progress_bar_text')):
-                        runtime.set_progress_text(entry, text=progress_bar_text)
-
-                    runtime.sleep(1.0)
+                for text in squid_progress(runtime.follow_progress(squid, squid.status)):
+                    runtime.set_progress_text(entry, text=text)
 
         case NikonAcquire():
             for nikon in runtime.time_resource_use(entry, runtime.nikon):
@@ -201,15 +222,10 @@ def execute(cmd: Command, runtime: Runtime, metadata: Metadata):
                     project=cmd.project,
                     plate=cmd.plate,
                 )
-                while nikon.is_running():
-                    status = nikon.screen_scraper_status()
-                    well, countdown = status.get('well'), status.get('countdown')
-                    if countdown:
-                        text = f'{well}, time remaining: {countdown}'
-                        if well:
-                             text = f'{well}, {text}'
-                        runtime.set_progress_text(entry, text=text)
-                    runtime.sleep(1.0)
+                def poll_nikon():
+                    return {**nikon.screen_scraper_status(), 'running': nikon.is_running()}
+                for text in nikon_progress(runtime.follow_progress(nikon, poll_nikon)):
+                    runtime.set_progress_text(entry, text=text)
 
         case NikonStageCmd() as cmd:
             for nikon, nikon_stage in runtime.time_resource_use(entry, runtime.nikon_and_stage):
@@ -311,14 +327,22 @@ def execute(cmd: Command, runtime: Runtime, metadata: Metadata):
 @contextlib.contextmanager
 def make_runtime(config: RuntimeConfig, program: Program) -> Iterator[Runtime]:
     runtime = Runtime.init(config)
-    with runtime.excepthook():
-        program.save(runtime.log_db)
-        if program.world0:
-            runtime.set_world(program.world0)
-        yield runtime
-
-def simulate_program(program: Program, sim_delays: dict[int, float] = {}, log_filename: str | None=None) -> DB:
-    program, expected_ends = commandlib.prepare_program(program, sim_delays=sim_delays)
+    try:
+        with runtime.excepthook():
+            program.save(runtime.log_db)
+            if program.world0:
+                runtime.set_world(program.world0)
+            yield runtime
+    finally:
+        runtime.log_writer.close()
+
+def simulate_program(program: Program, sim_delays: dict[int, float] = {}, log_filename: str | None=None, use_cache: bool=True, incremental: bool=False, cache_path: str | None=None) -> DB:
+    cache_key = use_cache and not log_filename and schedule_cache.program_key(program, sim_delays)
+    if cache_key and (cached := schedule_cache.get(cache_key, cache_path)):
+        print('using cached schedule', file=sys.stderr)
+        return cached
+
+    program, expected_ends = commandlib.prepare_program(program, sim_delays=sim_delays, incremental=incremental)
 
     with pbutils.timeit('check quick simulation'):
         quicksim_ends, _checkpoints = commandlib.quicksim(program.command, {}, cast(Any, estimate))
@@ -336,6 +360,9 @@ def simulate_program(program: Program, sim_delays: dict[int, float] = {}, log_fi
             sim_ends={state.id: state.t for state in states}
             commandlib.check_correspondence(cmd, optimizer_ends=expected_ends, sim_ends=sim_ends)
 
+    if cache_key:
+        schedule_cache.put(cache_key, runtime_est.log_db, cache_path)
+
     return runtime_est.log_db
 
 def execute_simulated_program(config: RuntimeConfig, sim_db: DB, metadata: list[DBMixin]):
@@ -372,7 +399,8 @@ def execute_simulated_program(config: RuntimeConfig, sim_db: DB, metadata: list[
                         protocol_dirs.add(protocol_dir)
 
             print(f'checking protocol files ({len(protocol_files)} files)...', file=sys.stderr)
-            path_infos = labrobots.WindowsNUC().remote(timeout_secs=10).dir_list.list()
+            nuc = labrobots.WindowsNUC().remote(timeout_secs=60)
+            path_infos: list[PathInfo] = nuc.dir_list.list()
             existing_files = {path_info['path'] for path_info in path_infos}
             missing_files = sorted([
                 protocol_file
@@ -383,9 +411,15 @@ def execute_simulated_program(config: RuntimeConfig, sim_db: DB, metadata: list[
                 print(f'error: missing protocols:', *missing_files, file=sys.stderr, sep='\n  ')
                 raise ValueError(f'Missing {len(missing_files)} protocols')
 
-            for protocol_dir in protocol_dirs:
+            # the files of all protocol dirs are fetched in one request
+            with nuc.batch() as nuc_batch:
+                dir_files = {
+                    protocol_dir: nuc_batch.dir_list.read_files(protocol_dir)
+                    for protocol_dir in sorted(protocol_dirs)
+                }
+            for protocol_dir, files in dir_files.items():
                 with pbutils.timeit(f'saving {protocol_dir} protocol files'):
-                    protocol_paths.add_protocol_dir_as_sqlar(runtime.log_db, protocol_dir)
+                    protocol_paths.add_files_as_sqlar(runtime.log_db, files.result())
 
         states = sim_db.get(CommandState).list()
         with runtime.log_db.transaction:
@@ -419,3 +453,26 @@ def execute_simulated_program(config: RuntimeConfig, sim_db: DB, metadata: list[
 def execute_program(config: RuntimeConfig, program: Program, metadata: list[DBMixin]=[], sim_delays: dict[int, float] = {}):
     db = simulate_program(program, sim_delays=sim_delays)
     execute_simulated_program(config, db, metadata)
+
+def test_squid_progress():
+    statuses = iter([
+        {'interactive': True},
+        {'interactive': False},
+        {'interactive': False, 'progress_bar_text': 'well A01'},
+        {'interactive': False, 'progress_bar_text': 'well A02'},
+        {'interactive': True},
+        {'interactive': False, 'progress_bar_text': 'not read'},
+    ])
+    assert list(squid_progress(statuses)) == ['well A01', 'well A02']
+    assert next(statuses) == {'interactive': False, 'progress_bar_text': 'not read'}
+
+def test_nikon_progress():
+    statuses = iter([
+        {'running': True},
+        {'running': True, 'well': 'A01', 'countdown': '10:00'},
+        {'running': True, 'well': None, 'countdown': '9:00'},
+        {'running': False, 'well': 'A02', 'countdown': '8:00'},
+        {'running': True, 'well': 'A03', 'countdown': '7:00'},
+    ])
+    assert list(nikon_progress(statuses)) == ['A01, time remaining: 10:00', 'time remaining: 9:00']
+    assert next(statuses)['well'] == 'A03'
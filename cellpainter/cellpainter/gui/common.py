@@ -8,6 +8,7 @@ import math
 import os
 import signal
 import json
+import time
 
 import viable as V
 
@@ -21,7 +22,7 @@ def sigkill(pid: int):
 
 def path_to_log(path: str) -> Log | None:
     try:
-        return Log.connect(path)
+        return Log.connect(path, read_only=True)
     except:
         return None
 
@@ -30,6 +31,20 @@ def as_stderr(log_path: str):
     p = p.with_suffix('.stderr')
     return p
 
+def log_version(log_path: str) -> tuple[Any, ...]:
+    '''
+    Changes when the log or its stderr is written to, and every second for
+    the countdowns and to notice when the controller has shut down.
+    '''
+    def stat(p: Path):
+        try:
+            st = p.stat()
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+    files = [Path(log_path), Path(log_path + '-wal'), as_stderr(log_path)]
+    return *map(stat, files), int(time.time())
+
 def pp_secs(secs: int | float, zero: str='0'):
     dt = timedelta(seconds=math.ceil(secs))
     if dt < timedelta(seconds=0):
@@ -53,7 +53,11 @@ class Edit(Generic[D]):
         def update(next: str=js('this.value'), db_path: str | Path =self.db_path, obj: D=self.obj):
             next_conv = from_str(next)
             with DB.open(db_path) as db:
-                ob = obj.reload(db) # type: ignore
+                if obj.id == -1: # type: ignore
+                    # a default that is saved the first time it is edited
+                    ob = db.get(obj.__class__).one_or(obj)
+                else:
+                    ob = obj.reload(db) # type: ignore
                 ob = ob.replace(**{field: next_conv}) # type: ignore
                 ob.save(db) # type: ignore
         if textarea:
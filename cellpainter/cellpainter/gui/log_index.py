@@ -0,0 +1,168 @@
+'''
+Index of the logs directory for the logs page.
+
+Each log has a summary row keyed by its path, modification time and size.
+Only logs that are new or have changed since the last refresh are opened.
+'''
+from __future__ import annotations
+from dataclasses import *
+from typing import *
+
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import threading
+import traceback
+
+import apsw
+
+import pbutils.mixins
+from pbutils.mixins import DB, DBMixin
+
+from ..log import ExperimentMetadata, Log
+from ..commands import ProgramMetadata
+
+index_path = 'cache/logs.db'
+logs_dir = 'logs'
+
+@dataclass(frozen=True)
+class LogSummary(DBMixin):
+    path: str
+    mtime_ns: int
+    size: int
+    config_name: str = ''
+    start_time: datetime | None = None
+    duration: float = 0.0
+    program_metadata: ProgramMetadata = field(default_factory=ProgramMetadata)
+    experiment_metadata: ExperimentMetadata = field(default_factory=ExperimentMetadata)
+    protocol_files: list[list[str]] = field(default_factory=list) # names and times
+    id: int = -1
+    __meta__ = pbutils.mixins.Meta(indexes={'path': ['path']})
+
+refresh_lock = threading.Lock()
+
+@contextmanager
+def open_index() -> Generator[DB, None, None]:
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    with DB.open(index_path) as db:
+        yield db
+
+def version(path: Path) -> tuple[int, int]:
+    '''
+    The modification time and size of the log, including its write-ahead log.
+    '''
+    mtime_ns = 0
+    size = 0
+    for p in [path, path.with_name(path.name + '-wal')]:
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        mtime_ns = max(mtime_ns, st.st_mtime_ns)
+        size += st.st_size
+    return mtime_ns, size
+
+def summarize(path: Path, mtime_ns: int, size: int) -> LogSummary:
+    summary = LogSummary(str(path), mtime_ns, size)
+    try:
+        g = Log.connect(path, read_only=True)
+        try:
+            rt = g.runtime_metadata()
+            if rt is None:
+                print(f'{path=}: no runtime metadata')
+                return summary
+            pm = g.program_metadata() or ProgramMetadata()
+            em = g.experiment_metadata() or ExperimentMetadata()
+            try:
+                name_times = g.sqlar_files(include_data=False)
+            except:
+                name_times = []
+            summary = replace(summary,
+                config_name=rt.config_name,
+                start_time=rt.start_time,
+                duration=g.time_end(only_completed=True),
+                program_metadata=pm,
+                experiment_metadata=em,
+                protocol_files=[[name, str(time)] for name, time, _ in name_times],
+            )
+        finally:
+            g.db.close()
+        return summary
+    except BaseException as e:
+        print(repr(e), traceback.format_exc())
+        return summary
+
+def refresh(db: DB):
+    '''
+    Updates the summaries of new and changed logs and removes those of deleted logs.
+    '''
+    paths = {
+        str(path): path
+        for path in sorted(Path(logs_dir).glob('*.db'))
+        if 'simulate' not in str(path)
+    }
+    versions = {k: version(path) for k, path in paths.items()}
+    with refresh_lock:
+        indexed = {
+            s.path: s
+            for s in db.get(LogSummary)
+        }
+        stale = [s for k, s in indexed.items() if k not in paths]
+        changed = [
+            summarize(path, *versions[k])
+            for k, path in paths.items()
+            if (s := indexed.get(k)) is None or (s.mtime_ns, s.size) != versions[k]
+        ]
+        if not stale and not changed:
+            return
+        try:
+            with db.transaction:
+                for s in stale:
+                    s.delete(db)
+                for s in changed:
+                    # looked up again in the transaction since another process serving the gui may have added it
+                    if old := db.get(LogSummary).where(LogSummary.path == s.path).one_or(None):
+                        s = replace(s, id=old.id)
+                    s.save(db)
+        except apsw.BusyError:
+            pass
+
+def summaries(show_all: bool) -> list[LogSummary]:
+    '''
+    The summaries of the live logs, sorted by path. Only cell painting
+    logs are included unless show_all is set.
+    '''
+    with open_index() as db:
+        refresh(db)
+        q = db.get(LogSummary).where(pbutils.mixins.sql.like(LogSummary.config_name, '%live%'))
+        if not show_all:
+            q = q.where(LogSummary.program_metadata.protocol == 'cell-paint')
+        return q.order(LogSummary.path).list()
+
+def test_refresh(tmp_path: Any, monkeypatch: Any):
+    from ..log import RuntimeMetadata
+    monkeypatch.setattr(__name__ + '.logs_dir', str(tmp_path))
+    path = tmp_path / 'live.db'
+    g = Log.connect(path)
+    RuntimeMetadata(datetime(2024, 1, 2), 'live', str(path)).save(g.db)
+    ProgramMetadata(protocol='cell-paint').save(g.db)
+    g.db.close()
+    db = DB.connect(':memory:')
+
+    before = path.read_bytes()
+    refresh(db)
+    assert path.read_bytes() == before
+    [s] = db.get(LogSummary).list()
+    assert (s.config_name, s.start_time, s.program_metadata.protocol) == ('live', datetime(2024, 1, 2), 'cell-paint')
+    assert s.experiment_metadata == ExperimentMetadata()
+
+    g = Log.connect(path)
+    ExperimentMetadata(desc='test').save(g.db)
+    g.db.close()
+    refresh(db)
+    [s2] = db.get(LogSummary).list()
+    assert (s2.id, s2.experiment_metadata.desc) == (s.id, 'test')
+
+    path.unlink()
+    refresh(db)
+    assert db.get(LogSummary).list() == []
@@ -142,6 +142,9 @@ sheet = '''
     }
 '''
 
+def latest_logfile() -> Path | None:
+    return max(Path('logs').glob('20*live*.db'), default=None)
+
 @serve.route('/')
 @serve.route('/<path:path_from_route>')
 def index(path_from_route: str | None = None) -> Iterator[Tag | V.Node | dict[str, str]]:
@@ -150,11 +153,7 @@ def index(path_from_route: str | None = None) -> Iterator[Tag | V.Node | dict[st
     path_is_latest = False
     path = common.path_var_value() or path_from_route
     if path == 'latest':
-        logs = [
-            log
-            for log in Path('logs').glob('20*live*.db')
-        ]
-        logfile = max(logs, default=None)
+        logfile = latest_logfile()
         if logfile:
             path_is_latest = True
             path = str(logfile)
@@ -305,7 +304,10 @@ def index(path_from_route: str | None = None) -> Iterator[Tag | V.Node | dict[st
         else:
             view_type = store.str(options=['overview'], name='view')
 
-        vis = ar.make_vis(t_end)
+        vis_window = store.session.str('', name='vis_window')
+        window, window_script = V.scroll_window(vis_window, 'vis-area', axis='x')
+        vis = ar.make_vis(t_end, window)
+        yield window_script
 
         overview_tables += [div(
             common.make_table(ar.running()),
@@ -619,10 +621,11 @@ def index(path_from_route: str | None = None) -> Iterator[Tag | V.Node | dict[st
             pass
         else:
             # new events can still happen
-            yield V.queue_refresh(100)
+            live_path = path
+            yield V.live(lambda: (common.log_version(live_path), path_is_latest and latest_logfile()))
     elif path_is_latest:
-        # simulation finished: start a slower poll
-        yield V.queue_refresh(1000)
+        # simulation finished: wait for the next run
+        yield V.live(latest_logfile, interval=1.0)
 
 def form(*vs: Int | Str | Bool):
     for v in vs:
@@ -12,11 +12,9 @@ from subprocess import run, STDOUT, PIPE
 import shlex
 import json
 
-from ..log import ExperimentMetadata, Log
-from ..commands import ProgramMetadata
-
 from .db_edit import Edit
 from . import common
+from . import log_index
 
 from pbutils import dotdict
 
@@ -32,134 +30,97 @@ def show_logs() -> Iterator[Tag | V.Node | dict[str, str]]:
     tabindexes: Any = {}
     logs: list[dict[str, Any]] = []
     selected: list[Path] = []
-    for log in sorted(Path('logs').glob('*.db')):
-        if 1 and 'simulate' in str(log):
-            continue
+    statuses = git_statuses()
+    for summary in log_index.summaries(show_all=show_all.value):
+        log = Path(summary.path)
         row: dict[str, Any] = dotdict()
-        try:
-            g = Log.connect(log)
-            # g.make_zipfile()
-            pm = g.program_metadata() or ProgramMetadata().save(g.db)
-            em = g.experiment_metadata() or ExperimentMetadata().save(g.db)
-            edit_em = Edit(log, em, tabindexes=tabindexes, enable_edit=enable_edit.value, echo=echo.value)
-            edit_em = Edit(log, em, tabindexes=tabindexes, enable_edit=enable_edit.value, echo=echo.value)
-            edit_pm = Edit(log, pm, tabindexes=tabindexes, enable_edit=enable_edit.value, echo=echo.value)
-            if (rt := g.runtime_metadata()):
-                if 'live' not in rt.config_name:
-                    continue
-                row.wkd = rt.start_time.strftime('%a')
-                row.datetime = rt.start_time.strftime('%Y-%m-%d %H:%M') #  + '-' + (rt.start_time + timedelta(seconds=g.time_end(only_completed=True))).strftime('%H:%M')
-                row.duration = div(common.pp_secs(g.time_end(only_completed=True)), class_='right')
-                row.desc = edit_em(edit_em.attr.desc)
-                row.operators = edit_em(edit_em.attr.operators)
-                row.plates = edit_pm(edit_pm.attr.num_plates, int, enable_edit=False).extend(class_='right')
-                # row.batch_sizes = edit_pm(edit_pm.attr.batch_sizes, int, enable_edit=False).extend(class_='right')
+        pm = summary.program_metadata
+        em = summary.experiment_metadata
+        edit_em = Edit(log, em, tabindexes=tabindexes, enable_edit=enable_edit.value, echo=echo.value)
+        edit_pm = Edit(log, pm, tabindexes=tabindexes, enable_edit=enable_edit.value, echo=echo.value)
+        if (start_time := summary.start_time):
+            row.wkd = start_time.strftime('%a')
+            row.datetime = start_time.strftime('%Y-%m-%d %H:%M')
+        row.duration = div(common.pp_secs(summary.duration), class_='right')
+        row.desc = edit_em(edit_em.attr.desc)
+        row.operators = edit_em(edit_em.attr.operators)
+        row.plates = edit_pm(edit_pm.attr.num_plates, int, enable_edit=False).extend(class_='right')
+        # row.batch_sizes = edit_pm(edit_pm.attr.batch_sizes, int, enable_edit=False).extend(class_='right')
 
-                row.start_stage = edit_pm(edit_pm.attr.from_stage, lambda x: None if not x or x == 'None' else x, enable_edit=False)
-                try:
-                    name_times = g.sqlar_files(include_data=False)
-                except:
-                    name_times = []
-                if name_times and pm.protocol == 'cell-paint':
-                    dir, _, _ = name_times[0][0].partition('/')
-                    show=show_protocol_dir.value == str(log)
-                    row.protocol_dir = div(
-                        dir,
-                        pre(
-                            '\n'.join([
-                                f'{time} {name}'
-                                for name, time, _ in name_times
-                            ]),
-                        ),
-                        show=show,
-                        css='''
-                            & {
-                                user-select: none;
-                                cursor: pointer;
-                            }
-                            &[show] {
-                                color: #eee;
-                            }
-                            & > pre {
-                                display: none;
-                            }
-                            &[show] > pre {
-                                display: block;
-                                position: fixed;
-                                bottom: 0;
-                                left: 50%;
-                                transform: translateX(-50%);
-                                width: fit-content;
-                                padding: 5px 9px;
-                                border: 2px #000a solid;
-                                color: var(--fg);
-                            }
-                        ''',
-                        onclick=show_protocol_dir.update('' if show else str(log)),
-                    )
-                else:
-                    row.protocol_dir= ''
-                if show_all.value:
-                    row.protocol = edit_pm(edit_pm.attr.protocol, enable_edit=False)
-                elif pm.protocol == 'cell-paint':
-                    pass
-                else:
-                    continue
-                row.notes = V.div(
-                    em.long_desc,
-                    href='', onclick='event.preventDefault();' + call(common.path_var_assign, str(log)),
-                    cursor='pointer',
-                    title=em.long_desc,
-                    white_space='nowrap',
-                    text_overflow='ellipsis',
-                    overflow='hidden',
-                    display='block',
-                    width='10ch',
-                )
-                row.open = V.a(
-                    'open', href='', onclick='event.preventDefault();' + call(common.path_var_assign, str(log)), class_='center',
-                    tabindex='-1',
-                )
-                select = store.bool(name=str(log))
-                if select.value:
-                    selected += [log]
-                row.select = label(
-                    select.input().extend(display='block', margin='auto'),
-                    width='100%',
-                    display='block',
-                    cursor='pointer',
-                    align='center',
-                    css='''
-                        &:focus-within {
-                            outline: 1px white solid;
-                        }
-                    '''
-                )
-                git_status = run(['git', 'status', '--untracked-files', '--porcelain', '--ignored', str(log)], capture_output=True, encoding='utf-8')
-                row.git = div(git_status.stdout.strip()[:2], align='center')
-            else:
-                print(f'{log=}: no runtime metadata')
-                continue
-        except BaseException as e:
-            import traceback as tb
-            print(repr(e), tb.format_exc())
-        else:
-            pass
-            # row.err = ''
-        if 0:
-            row.path = pre(
-                str(log),
-                onclick=call(common.path_var_assign, str(log)),
-                title=                                                                                      # type: ignore
-                    '\n'.join([                                                                             # type: ignore
-                        sql                                                                                 # type: ignore
-                        for sql, in g.db.con.execute('select sql from sqlite_master').fetchall()            # type: ignore
-                    ] +                                                                                     # type: ignore
-                    [                                                                                       # type: ignore
-                        table_name + ': ' + str(g.db.con.execute(f'select * from {table_name}').fetchone()) # type: ignore
-                        for table_name, in g.db.con.execute('select name from sqlite_master').fetchall()    # type: ignore
-                    ])                                                                                      # type: ignore
+        row.start_stage = edit_pm(edit_pm.attr.from_stage, lambda x: None if not x or x == 'None' else x, enable_edit=False)
+        name_times = summary.protocol_files
+        if name_times and pm.protocol == 'cell-paint':
+            dir, _, _ = name_times[0][0].partition('/')
+            show=show_protocol_dir.value == str(log)
+            row.protocol_dir = div(
+                dir,
+                pre(
+                    '\n'.join([
+                        f'{time} {name}'
+                        for name, time in name_times
+                    ]),
+                ),
+                show=show,
+                css='''
+                    & {
+                        user-select: none;
+                        cursor: pointer;
+                    }
+                    &[show] {
+                        color: #eee;
+                    }
+                    & > pre {
+                        display: none;
+                    }
+                    &[show] > pre {
+                        display: block;
+                        position: fixed;
+                        bottom: 0;
+                        left: 50%;
+                        transform: translateX(-50%);
+                        width: fit-content;
+                        padding: 5px 9px;
+                        border: 2px #000a solid;
+                        color: var(--fg);
+                    }
+                ''',
+                onclick=show_protocol_dir.update('' if show else str(log)),
             )
+        else:
+            row.protocol_dir= ''
+        if show_all.value:
+            row.protocol = edit_pm(edit_pm.attr.protocol, enable_edit=False)
+        row.notes = V.div(
+            em.long_desc,
+            href='', onclick='event.preventDefault();' + call(common.path_var_assign, str(log)),
+            cursor='pointer',
+            title=em.long_desc,
+            white_space='nowrap',
+            text_overflow='ellipsis',
+            overflow='hidden',
+            display='block',
+            width='10ch',
+        )
+        row.open = V.a(
+            'open', href='', onclick='event.preventDefault();' + call(common.path_var_assign, str(log)), class_='center',
+            tabindex='-1',
+        )
+        select = store.bool(name=str(log))
+        if select.value:
+            selected += [log]
+        row.select = label(
+            select.input().extend(display='block', margin='auto'),
+            width='100%',
+            display='block',
+            cursor='pointer',
+            align='center',
+            css='''
+                &:focus-within {
+                    outline: 1px white solid;
+                }
+            '''
+        )
+        row.git = div(statuses.get(log.name, ''), align='center')
         if 0:
             row.mtime = pre(
                 str(datetime.fromtimestamp(log.stat().st_mtime).replace(microsecond=0)),
@@ -260,6 +221,19 @@ def show_logs() -> Iterator[Tag | V.Node | dict[str, str]]:
         css_=common.inverted_inputs_css,
     )
 
+def git_statuses() -> dict[str, str]:
+    '''
+    The git status codes of the files in the logs directory by file name,
+    from one call to git status.
+    '''
+    git_status = run(['git', 'status', '--untracked-files', '--porcelain', '--ignored', '-z', '--', log_index.logs_dir], capture_output=True, encoding='utf-8')
+    statuses: dict[str, str] = {}
+    for entry in git_status.stdout.split('\0'):
+        # entries are XY PATH, where XY is the status code
+        if entry[2:3] == ' ':
+            statuses[Path(entry[3:]).name] = entry[:2].strip()
+    return statuses
+
 def confirm(s: str, next: str):
     return V.Action(f'confirm({json.dumps(s)}) && ({next})')
 
@@ -116,11 +116,14 @@ class ExternalState:
     @staticmethod
     def from_config(config: RuntimeConfig):
         if config.name in ['pf-live', 'xarm-live']:
+            with labrobots.WindowsGBG().remote(timeout_secs=10).batch() as gbg:
+                fridge_slots = gbg.fridge.contents()
+                last_barcode = gbg.barcode.read()
             return ExternalState(
                 config = config,
                 imager_plate_metadata = read_imager_plate_metadata(config),
-                fridge_slots = labrobots.WindowsGBG().remote(timeout_secs=10).fridge.contents(),
-                last_barcode = labrobots.WindowsGBG().remote(timeout_secs=10).barcode.read(),
+                fridge_slots = fridge_slots.result(),
+                last_barcode = last_barcode.result(),
                 squid_protocols = pbutils.catch(
                     lambda: labrobots.MikroAsus().remote(timeout_secs=10).squid.list_protocols(),
                     ['squid webservice down?']
@@ -7,16 +7,187 @@ from viable import js, Int, Tag, div
 from datetime import datetime, timedelta
 
 import math
+import os
+import threading
 
 from ..log import ExperimentMetadata, Log
+from ..log import section_starts, section_ends, vis_rows, vis_resources, vis_resources_fallback
 
 from .. import commands
 from ..commands import *
 import pbutils
+import pbutils.mixins
 from ..log import CommandState, Message, VisRow, RuntimeMetadata, countdown
 
 from . import common
 
+@dataclass
+class LogCache:
+    '''
+    The gui rows of a log kept in memory and updated with the rows written
+    since the last update, using the change cursor of the log database.
+    Section bounds are only recomputed for sections with changed rows.
+    Logs without a Changes table are reloaded whenever the file has changed.
+
+    The cache is shared between requests so it is only read and updated under its lock.
+    '''
+    log: Log
+    ino: int
+    cursor: int = 0
+    loaded: bool = False
+    data_version: int | None = None
+    states: dict[int, CommandState] = field(default_factory=dict)
+    sections: DefaultDict[str, dict[int, CommandState]] = field(default_factory=lambda: DefaultDict(dict))
+    by_resource: DefaultDict[str | None, dict[int, CommandState]] = field(default_factory=lambda: DefaultDict(dict))
+    bounds: dict[str, tuple[float, float, int, float]] = field(default_factory=dict) # min t0, max t0, min id, max t
+    thread_resources: set[str | None] = field(default_factory=set)
+    lock: threading.RLock = field(default_factory=threading.RLock)
+
+    max_ids_per_query: ClassVar[int] = 500
+
+    def clear(self):
+        self.cursor = 0
+        self.loaded = False
+        self.states.clear()
+        self.sections.clear()
+        self.by_resource.clear()
+        self.bounds.clear()
+        self.thread_resources.clear()
+
+    def update(self):
+        with self.lock:
+            db = self.log.db
+            if not db.has_table('Changes'):
+                [[data_version]] = db.con.execute('pragma data_version')
+                if data_version != self.data_version:
+                    self.clear()
+                    self.data_version = data_version
+            cursor, changed = db.changes(self.cursor)
+            if not self.loaded:
+                rows = self.log.gui_query().list()
+                self.thread_resources = set(self.log.resources())
+                ids = [row.id for row in rows]
+                self.loaded = True
+            else:
+                ids = sorted(changed.get('CommandState', set()))
+                rows: list[CommandState] = []
+                for i in range(0, len(ids), self.max_ids_per_query):
+                    chunk = ids[i:i+self.max_ids_per_query]
+                    rows += db.get(CommandState).where(pbutils.mixins.sql.isin(CommandState.id, chunk)).list()
+            dirty: set[str] = set()
+            for id in ids:
+                if (prev := self.states.pop(id, None)) is not None:
+                    dirty.add(prev.metadata.section)
+                    del self.sections[prev.metadata.section][id]
+                    del self.by_resource[prev.resource][id]
+            for row in rows:
+                self.thread_resources.add(row.metadata.thread_resource)
+                if row.resource is not None and not row.gui_boring:
+                    dirty.add(row.metadata.section)
+                    self.states[row.id] = row
+                    self.sections[row.metadata.section][row.id] = row
+                    self.by_resource[row.resource][row.id] = row
+            for section in dirty:
+                if states := self.sections[section]:
+                    self.bounds[section] = (
+                        min(state.t0 for state in states.values()),
+                        max(state.t0 for state in states.values()),
+                        min(states.keys()),
+                        max(state.t for state in states.values()),
+                    )
+                else:
+                    self.bounds.pop(section, None)
+            self.cursor = cursor
+
+    def section_bounds(self) -> dict[str, tuple[float, float, int]]:
+        with self.lock:
+            return {k: (t0, t, id) for k, (t0, t, id, _) in self.bounds.items()}
+
+    def time_end(self) -> float:
+        with self.lock:
+            if self.bounds:
+                return max(t for _, _, _, t in self.bounds.values()) + 10.0
+            else:
+                return 0.0
+
+    def resources(self) -> list[str | None]:
+        with self.lock:
+            return sorted(self.thread_resources, key=lambda r: (r is not None, r or ''))
+
+    def vis_states(self) -> list[CommandState]:
+        with self.lock:
+            for resources in [vis_resources, vis_resources_fallback]:
+                states = [
+                    state
+                    for resource in resources
+                    for state in self.by_resource.get(resource, {}).values()
+                ]
+                if states:
+                    return sorted(states, key=lambda state: state.id)
+            return []
+
+    def vis(self, t: float | None = None) -> list[VisRow]:
+        with self.lock:
+            bounds = self.section_bounds()
+            time_end = self.time_end()
+            states = self.vis_states()
+        return vis_rows(
+            section_starts(bounds),
+            section_ends(bounds, time_end),
+            time_end,
+            states,
+            t,
+        )
+
+log_caches: dict[str, LogCache] = {}
+log_caches_lock = threading.Lock()
+max_log_caches = 16
+
+def log_cache(m: Log) -> LogCache | None:
+    '''
+    The up to date cache for the log file, which is reused between refreshes.
+    '''
+    filename = m.db.con.filename
+    if not filename:
+        return None
+    ino = os.stat(filename).st_ino
+    with log_caches_lock:
+        cache = log_caches.pop(filename, None)
+        if cache is None or cache.ino != ino:
+            cache = LogCache(Log.connect(filename, read_only=True), ino)
+        log_caches[filename] = cache
+        while len(log_caches) > max_log_caches:
+            del log_caches[next(iter(log_caches))]
+    cache.update()
+    return cache
+
+def test_log_cache(tmp_path: Any):
+    for with_changes in [True, False]:
+        path = tmp_path / f'{with_changes}.db'
+        log = Log.connect(path)
+        if not with_changes:
+            # as a log written before changes were recorded
+            log.db.con.execute(pbutils.mixins.DataClassDesc.get(CommandState).schema())
+        def save(id: int, t0: float, t: float, machine: Literal['wash', 'disp'], section: str):
+            cmd = BiotekCmd(machine, 'Run')
+            metadata = Metadata(id=id, section=section, thread_resource=machine)
+            CommandState(t0, t, cmd, metadata, 'completed', id).save(log.db)
+        save(1, 0.0, 5.0, 'wash', 'Mito 0')
+        save(2, 6.0, 9.0, 'disp', 'Mito 0')
+        cache = LogCache(Log.connect(path, read_only=True), os.stat(path).st_ino)
+        def check():
+            cache.update()
+            assert cache.section_bounds() == log.section_bounds()
+            assert cache.time_end() == log.time_end()
+            assert cache.resources() == log.resources()
+            assert cache.vis() == log.vis()
+        check()
+        save(3, 10.0, 20.0, 'wash', 'PFA 0')
+        check()
+        save(2, 6.0, 30.0, 'disp', 'PFA 0')
+        check()
+        assert cache.section_bounds().keys() == {'Mito 0', 'PFA 0'}
+
 @dataclass(frozen=True, kw_only=True)
 class AnalyzeResult:
     zero_time: datetime
@@ -46,21 +217,23 @@ class AnalyzeResult:
         runtime_metadata = m.runtime_metadata()
         if not runtime_metadata:
             return None
+        cache = log_cache(m) or m
+        time_end = cache.time_end()
         completed = runtime_metadata.completed is not None
         zero_time = runtime_metadata.start_time
         t_now = (datetime.now() - zero_time).total_seconds()
 
         if completed:
-            t_now = m.time_end() + 0.01
+            t_now = time_end + 0.01
 
         alive = common.process_is_alive(runtime_metadata.pid, runtime_metadata.log_filename)
 
         if not alive:
-            t_now = m.time_end() + 0.01
+            t_now = time_end + 0.01
 
         errors = m.errors()
         if errors:
-            t_now = max([e.t for e in errors], default = m.time_end()) + 1
+            t_now = max([e.t for e in errors], default = time_end) + 1
 
         if drop_after is not None:
             # completed = False
@@ -68,7 +241,11 @@ class AnalyzeResult:
 
         running_state = m.running(t=drop_after)
         world = m.world(t=drop_after)
-        sections = m.section_starts_with_endpoints()
+        sections = {
+            'begin': 0.0,
+            **section_starts(cache.section_bounds()),
+            'end': time_end,
+        }
         program_metadata = m.program_metadata() or ProgramMetadata()
 
         progress_texts = {
@@ -78,12 +255,7 @@ class AnalyzeResult:
             if (text := m.progress_text(state.id))
         }
 
-        resources = (
-            m.db.get(CommandState)
-            .select(CommandState.metadata.thread_resource, distinct=True)
-            .order(by=CommandState.metadata.thread_resource)
-            .list()
-        )
+        resources = cache.resources()
 
         return AnalyzeResult(
             zero_time=zero_time,
@@ -99,8 +271,8 @@ class AnalyzeResult:
             world=world,
             process_is_alive=alive,
             sections=sections,
-            time_end=m.time_end(),
-            vis=m.vis(t_now if not errors else None),
+            time_end=time_end,
+            vis=cache.vis(t_now if not errors else None),
             drop_after=drop_after,
         )
 
@@ -235,10 +407,16 @@ class AnalyzeResult:
             })
         return table
 
-    def make_vis(self, t_end: Int | None = None) -> Tag:
+    def make_vis(self, t_end: Int | None = None, window: tuple[float, float] | None = None) -> Tag:
+        '''
+        One column per section with its rows positioned by time. If window is
+        given only the rows in the columns that overlap it, in pixels from the
+        left of the area, are rendered.
+        '''
         width = 23
+        column_width = width * 2.3
 
-        area = div()
+        area = div(id='vis-area')
         area.css += f'''
             position: relative;
             user-select: none;
@@ -309,6 +487,10 @@ class AnalyzeResult:
             if source in ('now', 'bg'):
                 my_width = 2
 
+            left = (row.section_column * 2.3 + slot) * width
+            if window and not window[0] - column_width <= left <= window[1]:
+                continue
+
             color = {
                 'wash': 'var(--cyan)',
                 'blue': 'var(--blue)',
@@ -373,7 +555,7 @@ class AnalyzeResult:
                 plate_id,
                 can_hover=can_hover,
                 style=f'''
-                    left:{(row.section_column*2.3 + slot) * width:.0f}px;
+                    left:{left:.0f}px;
                     top:{  y0 * 100:.3f}%;
                     height:{h * 100:.3f}%;
                     --row-color:{color};
@@ -78,8 +78,24 @@ class CommandState(DBMixin):
     gui_boring: bool = False
     resource: str | None = None
 
+    # generated in sql, see __meta__, and set on the class as a column when the table is used
+    gui: ClassVar[bool]
+
     # views={'duration': 'round(t - t0, 3)'},
 
+    __meta__ = pbutils.mixins.Meta(
+        generated={
+            'gui': (bool, 'resource is not null and not gui_boring'),
+        },
+        indexes={
+            'gui_section': ['gui', 'metadata$section', 't0'],
+            'gui_t': ['gui', 't'],
+            'state': ['state'],
+            't0': ['t0'],
+        },
+        changes=True,
+    )
+
     def __post_init__(self):
         self.resource = self.cmd.required_resource()
         self.cmd_type = self.cmd.type
@@ -132,19 +148,110 @@ class VisRow:
     now: bool = False
     bg: bool = False
 
+vis_resources = ['disp', 'wash', 'blue']
+vis_resources_fallback = ['squid', 'nikon', 'fridge', 'incu'] # for incu load and fridge load
+
+def section_starts(bounds: dict[str, tuple[float, float, int]]) -> dict[str, float]:
+    '''
+    Section start times from Log.section_bounds, in order.
+    '''
+    out = {
+        k: t0
+        for k, (t0, _, _) in sorted(bounds.items(), key=lambda kv: (kv[1][0], kv[1][2]))
+    }
+    if '' in out and len(out) >= 2:
+        empty = out.pop('')
+        first, *_ = out.keys()
+        out[first] = min(out[first], empty)
+    return out
+
+def section_ends(bounds: dict[str, tuple[float, float, int]], time_end: float) -> dict[str, float]:
+    '''
+    The last t0 of each section from Log.section_bounds, except for the last section which ends at time_end.
+    '''
+    out = {
+        k: t
+        for k, (_, t, _) in sorted(bounds.items(), key=lambda kv: (kv[1][1], kv[1][2]))
+    }
+    if out:
+        *_, last = out.keys()
+        out[last] = time_end
+    return out
+
+def vis_rows(
+    section_starts: dict[str, float],
+    section_ends: dict[str, float],
+    time_end: float,
+    states: list[CommandState],
+    t: float | None = None,
+) -> list[VisRow]:
+    section_starts = dict(section_starts)
+    if not section_starts:
+        return []
+    first_section, *_ = section_starts.keys()
+    section_starts[first_section] = 0.0
+    section_columns = {section: i for i, section in enumerate(section_starts.keys())}
+
+    rows: list[VisRow] = []
+    for (section_name, section_t0), next in pbutils.iterate_with_next(section_starts.items()):
+        if next:
+            _, section_t = next
+        else:
+            section_t = time_end
+        bg_row = VisRow(
+            t0 = section_t0,
+            t = section_t,
+            section = section_name,
+            bg = True,
+        )
+        rows += [bg_row]
+
+    for state in states:
+        row = VisRow(
+            t0 = state.t0,
+            t = state.t,
+            state = state,
+            section = state.metadata.section,
+        )
+        rows += [row]
+
+    def time_to_section(t: float):
+        for section, t0 in reversed(section_starts.items()):
+            if t >= t0:
+                return section
+        return 'before time'
+
+    if t is not None:
+        now_row = VisRow(
+            t0 = t,
+            t = t,
+            section = time_to_section(t),
+            now = True,
+        )
+        rows += [now_row]
+
+    for row in rows:
+        if row.section == '':
+            row.section = time_to_section(row.t0)
+        row.section_column = section_columns[row.section]
+        row.section_t0 = section_starts[row.section]
+        row.section_t_with_overflow = max(row.t, section_ends[row.section])
+
+    return rows
+
 
 @dataclass(frozen=True)
 class Log:
     db: DB
 
     @staticmethod
-    def connect(filename: str | Path):
-        return Log(DB.connect(filename))
+    def connect(filename: str | Path, read_only: bool=False):
+        return Log(DB.connect(filename, read_only=read_only))
 
     @staticmethod
     @contextmanager
-    def open(filename: str | Path):
-        with DB.open(filename) as db:
+    def open(filename: str | Path, read_only: bool=False):
+        with DB.open(filename, read_only=read_only) as db:
             yield Log(db)
 
     def command_states(self):
@@ -153,15 +260,14 @@ class Log:
 
     def gui_query(self):
         q = self.db.get(CommandState)
-        q = q.where(CommandState.resource != None)
-        q = q.where(CommandState.gui_boring != True)
+        q = q.where(CommandState.gui == True)
         return q
 
     def world(self, t: float | None = None) -> dict[str, str]:
         q = self.db.get(World).order(World.t, 'desc')
         if t is not None:
             q = q.where(World.t <= t)
-        for w in q:
+        for w in q.limit(1):
             return w.data
         else:
             return {}
@@ -181,37 +287,23 @@ class Log:
     def progress_text(self, id: int) -> str | None:
         return self.db.get(ProgressText).where(ProgressText.id == id).select(ProgressText.text).one_or(None)
 
+    def section_bounds(self) -> dict[str, tuple[float, float, int]]:
+        '''
+        The first and last t0 and the first id of each section, in one query.
+        '''
+        g = self.gui_query().group(CommandState.metadata.section)
+        g = g.json_array(
+            pbutils.mixins.sql.min(CommandState.t0),
+            pbutils.mixins.sql.max(CommandState.t0),
+            pbutils.mixins.sql.min(CommandState.id),
+        )
+        return {k: (t0, t, id) for k, (t0, t, id) in g.items()}
+
     def section_starts(self) -> dict[str, float]:
-        q = self.gui_query()
-        out: dict[str, float] = {}
-        for k in q.select(CommandState.metadata.section):
-            if k in out:
-                continue
-            out[k] = q.order(CommandState.t0).where(CommandState.metadata.section == k).one().t0
-        out = dict(sorted(out.items(), key=lambda kv: kv[1]))
-        if '' in out and len(out) >= 2:
-            empty = out.pop('')
-            first, *_ = out.keys()
-            out[first] = min(out[first], empty)
-        return out
-        # g = q.group(CommandState.metadata.section)
-        # return {
-        #     k: v
-        #     for k, v in sorted(g.min(CommandState.t0).items(), key=lambda kv: kv[1])
-        # }
+        return section_starts(self.section_bounds())
 
     def section_ends(self) -> dict[str, float]:
-        q = self.gui_query()
-        out: dict[str, float] = {}
-        for k in q.select(CommandState.metadata.section):
-            if k in out:
-                continue
-            out[k] = q.order(CommandState.t0, dir='desc').where(CommandState.metadata.section == k).one().t0
-        out = dict(sorted(out.items(), key=lambda kv: kv[1]))
-        if out:
-            *_, last = out.keys()
-            out[last] = self.time_end()
-        return out
+        return section_ends(self.section_bounds(), self.time_end())
 
     def time_end(self, only_completed: bool=False):
         q = self.gui_query()
@@ -232,87 +324,25 @@ class Log:
             'end': self.time_end()
         }
 
-    def vis(self, t: float | None = None) -> list[VisRow]:
-        section_starts = self.section_starts()
-        section_ends = self.section_ends()
-        if not section_starts:
-            return []
-        first_section, *_ = section_starts.keys()
-        section_starts[first_section] = 0.0
-        section_columns = {section: i for i, section in enumerate(section_starts.keys())}
-
-        rows: list[VisRow] = []
-        for (section_name, section_t0), next in pbutils.iterate_with_next(section_starts.items()):
-            if next:
-                _, section_t = next
-            else:
-                section_t = self.time_end()
-            bg_row = VisRow(
-                t0 = section_t0,
-                t = section_t,
-                section = section_name,
-                bg = True,
-            )
-            rows += [bg_row]
-
-        q = self.gui_query()
-        states = q.where_some(
-            CommandState.resource == 'disp',
-            CommandState.resource == 'wash',
-            CommandState.resource == 'blue',
+    def resources(self) -> list[str | None]:
+        return (
+            self.db.get(CommandState)
+            .select(CommandState.metadata.thread_resource, distinct=True)
+            .order(by=CommandState.metadata.thread_resource)
+            .list()
         )
-        if not states.list():
-            # show incu if no bioteks (for incu load)
-            # show fridge if no microscopes (for fridge load)
-            states = q.where_some(
-                CommandState.resource == 'squid',
-                CommandState.resource == 'nikon',
-                CommandState.resource == 'fridge',
-                CommandState.resource == 'incu',
-            )
-        for state in states:
-            if 0:
-                # this cannot be right, the runtime should update the states
-                if t is not None:
-                    if state.t0 > t:
-                        state.state = 'planned'
-                    elif state.t < t:
-                        state.state = 'completed'
-                    else:
-                        state.state = 'running'
-            row = VisRow(
-                t0 = state.t0,
-                t = state.t,
-                state = state,
-                section = state.metadata.section,
-            )
-            rows += [row]
-
-        def time_to_section(t: float):
-            for section, t0 in reversed(section_starts.items()):
-                if t >= t0:
-                    return section
-            return 'before time'
-
-        if t is not None:
-            now_row = VisRow(
-                t0 = t,
-                t = t,
-                section = time_to_section(t),
-                now = True,
-            )
-            rows += [now_row]
-
-        section_ends = self.section_ends()
 
-        for row in rows:
-            if row.section == '':
-                row.section = time_to_section(row.t0)
-            row.section_column = section_columns[row.section]
-            row.section_t0 = section_starts[row.section]
-            row.section_t_with_overflow = max(row.t, section_ends[row.section])
+    def vis_states(self) -> list[CommandState]:
+        q = self.gui_query()
+        states = q.where(pbutils.mixins.sql.isin(CommandState.resource, vis_resources)).list()
+        if not states:
+            states = q.where(pbutils.mixins.sql.isin(CommandState.resource, vis_resources_fallback)).list()
+        return states
 
-        return rows
+    def vis(self, t: float | None = None) -> list[VisRow]:
+        bounds = self.section_bounds()
+        time_end = self.time_end()
+        return vis_rows(section_starts(bounds), section_ends(bounds, time_end), time_end, self.vis_states(), t)
 
     def durations(self) -> dict[str, float]:
         return {
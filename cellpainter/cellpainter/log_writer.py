@@ -0,0 +1,130 @@
+'''
+Buffered writes to the runtime log database.
+'''
+from __future__ import annotations
+from dataclasses import *
+from typing import *
+
+import atexit
+import sys
+import threading
+import traceback
+
+from pbutils.mixins import DB, DBMixin
+
+@dataclass
+class LogWriter:
+    '''
+    Rows are queued by save and written in one transaction per flush.
+
+    Rows with an id are written once per flush with their latest value, so a
+    command that starts and completes between two flushes is written once.
+    Rows without an id get theirs when they are written, in the order they were saved.
+
+    A log on disk is flushed every interval seconds by a background thread
+    with its own connection. An in-memory log has no other connections so
+    it is only flushed when asked to. If a flush fails its rows are put back
+    and written by the next one.
+    '''
+    db: DB
+    interval: float = 0.5
+    max_pending: int = 10000
+
+    pending: dict[tuple[type[DBMixin], int], DBMixin] = field(default_factory=lambda: dict[tuple[type[DBMixin], int], DBMixin]())
+    pending_lock: threading.Lock = field(default_factory=threading.Lock)
+    flush_lock: threading.Lock = field(default_factory=threading.Lock)
+    stopped: threading.Event = field(default_factory=threading.Event)
+    thread: threading.Thread | None = None
+    writer_db: DB | None = None
+    num_saved: int = 0
+
+    def __post_init__(self):
+        filename = self.db.con.filename
+        if filename and self.interval > 0:
+            self.writer_db = DB.connect(filename)
+            self.writer_db.con.execute('pragma synchronous=OFF;')
+            self.thread = threading.Thread(target=self.run, name='log writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def save(self, row: DBMixin):
+        with self.pending_lock:
+            self.num_saved += 1
+            if row.id == -1:
+                key = (row.__class__, -self.num_saved)
+            else:
+                key = (row.__class__, row.id)
+            self.pending[key] = replace(cast(Any, row))
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, {}
+            if pending:
+                db = self.writer_db or self.db
+                try:
+                    with db.transaction:
+                        for row in pending.values():
+                            row.save(db)
+                except:
+                    with self.pending_lock:
+                        # rows saved meanwhile are newer
+                        self.pending = pending | self.pending
+                    raise
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                print('log writer:', traceback.format_exc(), file=sys.stderr)
+
+    def close(self):
+        '''
+        Writes the remaining rows and stops the background thread.
+        '''
+        self.stopped.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        if self.thread:
+            atexit.unregister(self.close)
+            self.thread = None
+
+def test_log_writer(tmp_path: Any):
+    from .log import ProgressText
+    path = tmp_path / 'log.db'
+    writer = LogWriter(DB.connect(path), interval=60)
+    writer.save(ProgressText('a', id=1))
+    writer.save(ProgressText('b', id=2))
+    writer.save(ProgressText('c', id=1))
+    writer.save(ProgressText('d'))
+    other = DB.connect(path)
+    assert not other.has_table('ProgressText')
+    writer.close()
+    assert [(p.id, p.text) for p in other.get(ProgressText)] == [(1, 'c'), (2, 'b'), (3, 'd')]
+
+def test_log_writer_retry(tmp_path: Any):
+    from .log import ProgressText
+    import time
+    path = tmp_path / 'log.db'
+    writer = LogWriter(DB.connect(path), interval=0.01)
+    db = writer.writer_db
+    writer.writer_db = DB.connect(path, read_only=True)
+    writer.save(ProgressText('a', id=1))
+    writer.save(ProgressText('b'))
+    time.sleep(0.1)
+    writer.save(ProgressText('c', id=1))
+    writer.writer_db = db
+    other = DB.connect(path, read_only=True)
+    rows: list[tuple[int, str]] = []
+    for _ in range(100):
+        # written by the background thread, which kept running after the failed flushes
+        if rows := [(p.id, p.text) for p in other.get(ProgressText)]:
+            break
+        time.sleep(0.01)
+    assert rows == [(1, 'c'), (2, 'b')]
+    writer.close()
@@ -0,0 +1,156 @@
+'''
+Monte Carlo robustness of schedules: quicksim over K samples of the command durations at once.
+'''
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import *
+
+from collections import deque
+import functools
+
+import numpy as np
+
+import pbutils
+
+from .commands import *
+from . import commandlib
+from . import estimates
+from .estimates import EstEntry, estimate
+
+@dataclass(frozen=True)
+class Samples:
+    ends: dict[int, np.ndarray]
+    checkpoints: dict[str, np.ndarray]
+    durations: dict[str, np.ndarray]
+    makespan: np.ndarray
+
+def quicksim_samples(program: Command, durations: Callable[[PhysicalCommand], np.ndarray], K: int) -> Samples:
+    '''
+    Like commandlib.quicksim but every point in time is an array of K scenarios.
+
+    The threads only interact through checkpoints so they are run one at a
+    time until they wait for a checkpoint that has not happened yet.
+    '''
+    checkpoints: dict[str, np.ndarray] = {}
+    ends: dict[int, np.ndarray] = {}
+    duration_samples: dict[str, np.ndarray] = {}
+
+    @dataclass
+    class Thread:
+        todo: deque[tuple[Command, Metadata]]
+        t: np.ndarray
+
+    threads = [Thread(deque(program.collect()), np.zeros(K))]
+
+    def run(thread: Thread) -> bool:
+        '''
+        Runs the thread until it is blocked or done. Returns if it made progress.
+        '''
+        progress = False
+        t = thread.t
+        while thread.todo:
+            hd, meta = thread.todo[0]
+            match hd:
+                case Checkpoint():
+                    checkpoints[hd.name] = t
+                case WaitForCheckpoint():
+                    if hd.name not in checkpoints:
+                        break
+                    t = np.maximum(t, checkpoints[hd.name] + hd.plus_seconds.unwrap())
+                case Duration():
+                    if hd.name not in checkpoints:
+                        break
+                    duration_samples[hd.name] = t - checkpoints[hd.name]
+                case Fork():
+                    threads.append(Thread(deque(hd.command.collect()), t))
+                    thread.todo.popleft()
+                    continue
+                case Idle():
+                    t = t + hd.seconds.unwrap()
+                case PhysicalCommand():
+                    t = t + durations(hd)
+                case _:
+                    raise ValueError(f'No case for cmd={hd}')
+            ends[meta.id] = t
+            thread.todo.popleft()
+            progress = True
+        thread.t = t
+        return progress
+
+    while True:
+        progress = False
+        for thread in threads:
+            progress |= run(thread)
+        blocked = [thread for thread in threads if thread.todo]
+        if not blocked:
+            break
+        if not progress:
+            raise ValueError(f'Threads blocked indefinitely: {[str(thread.todo[0][0]) for thread in blocked]}')
+
+    makespan = np.max([thread.t for thread in threads], axis=0)
+
+    return Samples(ends, checkpoints, duration_samples, makespan)
+
+@functools.cache
+def logged_durations(path: str=estimates.estimates_jsonl_path) -> dict[PhysicalCommand, list[float]]:
+    entries: list[EstEntry] = list(pbutils.serializer.read_jsonl(path))
+    groups = pbutils.group_by(entries, key=lambda entry: entry['cmd'])
+    return {
+        cmd: [ent['duration'] for ent in ents]
+        for cmd, ents in groups.items()
+    }
+
+def sample_durations(K: int, seed: int=0) -> Callable[[PhysicalCommand], np.ndarray]:
+    '''
+    Draws K durations for each command from its logged durations, using the
+    estimate for all K if it has been logged fewer than two times.
+    '''
+    rng = np.random.default_rng(seed)
+    def durations(cmd: PhysicalCommand) -> np.ndarray:
+        logged = logged_durations().get(cmd.normalize(), [])
+        if len(logged) < 2:
+            return np.full(K, estimate(cmd))
+        else:
+            return rng.choice(logged, size=K)
+    return durations
+
+def report(program: Program, K: int, seed: int=0):
+    '''
+    Prints how the durations and total time of the schedule vary over K
+    samples of the command durations.
+    '''
+    program, _expected_ends = commandlib.prepare_program(program, sim_delays={})
+    planned = quicksim_samples(program.command, lambda cmd: np.full(1, estimate(cmd)), 1)
+    with pbutils.timeit(f'simulating {K} samples'):
+        samples = quicksim_samples(program.command, sample_durations(K, seed), K)
+    rows = [
+        (name, planned.durations[name][0], xs)
+        for name, xs in sorted(samples.durations.items())
+        if not name.startswith('align ') # internal to Command.align_forks
+    ]
+    rows += [('total', planned.makespan[0], samples.makespan)]
+    print('name', 'planned', 'p5', 'p50', 'p95', 'max', 'late>1m', sep='\t')
+    for name, plan, xs in rows:
+        p5, p50, p95 = np.percentile(xs, [5, 50, 95])
+        late = np.count_nonzero(xs > plan + 60) / len(xs)
+        print(
+            name,
+            *[pbutils.pp_secs(x) for x in [plan, p5, p50, p95, xs.max()]],
+            f'{late:.0%}',
+            sep='\t',
+        )
+
+def test_one_sample_is_quicksim():
+    from .cli import Args, args_to_program
+    program = args_to_program(Args(protocol='cell-paint', batch_sizes='2', interleave=True, two_final_washes=True))
+    assert program
+    program, _expected_ends = commandlib.prepare_program(program, sim_delays={})
+    ends, checkpoints = commandlib.quicksim(program.command, {}, cast(Any, estimate))
+    samples = quicksim_samples(program.command, lambda cmd: np.full(1, estimate(cmd)), 1)
+    assert ends.keys() <= samples.ends.keys()
+    for i, t in ends.items():
+        assert abs(samples.ends[i][0] - t) < 1e-6
+    assert checkpoints.keys() == samples.checkpoints.keys()
+    for name, t in checkpoints.items():
+        assert abs(samples.checkpoints[name][0] - t) < 1e-6
+    assert abs(samples.makespan[0] - max(ends.values())) < 1e-6
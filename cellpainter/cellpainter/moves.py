@@ -7,10 +7,15 @@ from typing import *
 
 from pathlib import Path
 import abc
+import functools
+import hashlib
+import os
+import pickle
 import re
 import pbutils
 import textwrap
 from pbutils.mixins import DBMixin
+import pbutils.mixins
 
 from .ur_script import URScript
 
@@ -573,6 +578,8 @@ class World(DBMixin):
     t: float = 0  # filled in when executing
     id: int = -1
 
+    __meta__ = pbutils.mixins.Meta(indexes={'t': ['t']})
+
     def __getitem__(self, key: str) -> str:
         return self.data[key]
 
@@ -634,32 +641,105 @@ class DLid(Effect):
 
 pbutils.serializer.register(globals())
 
-movelists: dict[str, MoveList]
-movelists = read_movelists()
-
 B21 = 'B21'
 B16 = 'B16'
-effects: dict[str, Effect] = {}
 
-for k, v in movelists.items():
-    m = re.match(r'(\w+)-to-(\w+)$', k)
-    if m:
-        source, target = m.groups()
-        effects[k] = MovePlate(source=source, target=target)
+def make_effects(movelists: dict[str, MoveList]) -> dict[str, Effect]:
+    effects: dict[str, Effect] = {}
+
+    for k in movelists:
+        m = re.match(r'(\w+)-to-(\w+)$', k)
+        if m:
+            source, target = m.groups()
+            effects[k] = MovePlate(source=source, target=target)
+
+    effects['dlid B14'] = DLid(plate_loc='B14', dlid_loc='D2')
+    effects['dlid B12'] = DLid(plate_loc='B12', dlid_loc='D1')
+
+    for i in HotelLocs_A:
+        for b in HotelLocs_Base:
+            effects[f'lid-B{i} off [base B{b}]'] = TakeLidOff(source=f'B{b}', target=f'B{i}')
+            effects[f'lid-B{i} on [base B{b}]'] = PutLidOn(source=f'B{i}', target=f'B{b}')
 
-effects['dlid B14'] = DLid(plate_loc='B14', dlid_loc='D2')
-effects['dlid B12'] = DLid(plate_loc='B12', dlid_loc='D1')
+    for k in list(effects.keys()):
+        effects[k + ' transfer'] = effects[k]
 
-for i in HotelLocs_A:
-    for b in HotelLocs_Base:
-        lid_Bi = f'lid-B{i}'
-        effects[f'lid-B{i} off [base B{b}]'] = TakeLidOff(source=f'B{b}', target=f'B{i}')
-        effects[f'lid-B{i} on [base B{b}]'] = PutLidOn(source=f'B{i}', target=f'B{b}')
+    for i in HotelLocs_A:
+        Ai = f'A{i}'
+        effects[f'{Ai}-to-incu transfer from drop neu'] = MovePlate(source=Ai, target='incu')
+
+    return effects
+
+bundle_path = 'cache/movelists.pickle'
+
+@dataclass(frozen=True)
+class MovelistBundle:
+    '''
+    The expanded movelists and their effects, compiled from the files they
+    are made from. Versions are the modification times and sizes of the
+    files, and the digest is of their contents.
+    '''
+    versions: list[tuple[str, int, int]]
+    digest: str
+    movelists: dict[str, MoveList]
+    effects: dict[str, Effect]
 
-for k in list(effects.keys()):
-    effects[k + ' transfer'] = effects[k]
+def bundle_sources() -> list[Path]:
+    here = Path(__file__).parent
+    return [
+        *sorted(Path('./movelists').glob('*.jsonl')),
+        here / 'moves.py',
+        here / 'ur_script.py',
+    ]
 
-for i in HotelLocs_A:
-    Ai = f'A{i}'
-    effects[f'{Ai}-to-incu transfer from drop neu'] = MovePlate(source=Ai, target='incu')
+def write_bundle(bundle: MovelistBundle):
+    path = Path(bundle_path)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(pickle.dumps(bundle, protocol=pickle.HIGHEST_PROTOCOL))
+        # replaced atomically since other processes may be reading it
+        tmp.replace(path)
+    except OSError as e:
+        print(f'Could not write {bundle_path}: {e}')
+
+@functools.cache
+def get_bundle() -> MovelistBundle:
+    '''
+    The bundle in cache/movelists.pickle if it is up to date, otherwise
+    the movelists are read again and the bundle is rewritten.
+    '''
+    sources = bundle_sources()
+    versions = [
+        (str(p), (st := p.stat()).st_mtime_ns, st.st_size)
+        for p in sources
+    ]
+    try:
+        bundle = pickle.loads(Path(bundle_path).read_bytes())
+        assert isinstance(bundle, MovelistBundle)
+    except Exception:
+        bundle = None
+    if bundle and bundle.versions == versions:
+        return bundle
+    h = hashlib.sha256()
+    for p in sources:
+        h.update(str(p).encode())
+        h.update(p.read_bytes())
+    digest = h.hexdigest()
+    if bundle and bundle.digest == digest:
+        # the files were touched but not changed, as by a git checkout
+        bundle = replace(bundle, versions=versions)
+    else:
+        movelists = read_movelists()
+        bundle = MovelistBundle(versions, digest, movelists, make_effects(movelists))
+    write_bundle(bundle)
+    return bundle
+
+def get_movelists() -> dict[str, MoveList]:
+    '''
+    The movelists, read on first use.
+    '''
+    return get_bundle().movelists
 
+def get_effects() -> dict[str, Effect]:
+    return get_bundle().effects
@@ -7,6 +7,7 @@ from datetime import datetime
 from pathlib import Path
 from threading import Lock
 import ast
+import functools
 import json
 import math
 import re
@@ -19,7 +20,7 @@ from .ur_script import URScript
 import pbutils
 
 from viable import store, js, call, Serve, Flask
-from viable import Tag, div, button, pre, input
+from viable import Node, Tag, div, button, pre, input
 import viable as V
 
 import labrobots
@@ -284,7 +285,185 @@ def get_programs() -> dict[str, Path]:
         if filter in guess_robot(path.stem)
     }
 
-def index() -> Iterator[Tag | dict[str, str]]:
+def row_cells(program_name: str, visible_moves: list[tuple[int, Move]], row_index: int, section_var: V.Str) -> list[Tag]:
+    '''
+    The cells of a row that only change when the movelist is edited.
+    '''
+    i, m = visible_moves[row_index]
+    cells: list[Tag] = []
+    cells += [div(
+        style=f'grid-column: 1 / -1',
+        css='''
+            :nth-child(even) > & {
+                background: #f4f4f4
+            }
+        ''')]
+
+    if isinstance(m, moves.Section):
+        sect = div(
+            css="""
+                & {
+                    grid-column: x / -1;
+                    margin-top: 12px;
+                    padding-bottom: 4px;
+                }
+                & button {
+                    padding: 1px 14px 5px;
+                    margin-right: 6px;
+                    font-family: sans;
+                    font-size: 14px;
+                }
+            """
+        )
+        cells += [sect]
+        sect += button(m.section,
+            tabindex='-1',
+            onclick=call(section_var.assign, m.section),
+            style="cursor: pointer;"
+        )
+        return cells
+
+    if m.is_gripper():
+        cells += [div(
+            'gripper close' if m.is_close() else 'gripper open',
+            css='''
+                grid-column: x / span 3;
+                justify-self: end;
+                font-family: sans;
+                font-size: 13px;
+                font-style: italic;
+            '''
+        )]
+
+    cells += [button('go',
+        tabindex='-1',
+        style=f'grid-column: go',
+        css='margin: 0 10px;',
+        onclick=call(arm_do, m),
+    )]
+
+    from_here = [m for _, m in visible_moves[row_index:] if not isinstance(m, moves.Section)]
+    to_here = [m for _, m in visible_moves[:row_index+1] if not isinstance(m, moves.Section)]
+
+    cells += [div(
+        button('run from here',
+            tabindex='-1',
+            css='margin: 0;',
+            onclick=call(arm_do, *from_here),
+            title=', '.join(m.try_name() or m.__class__.__name__ for m in from_here)
+        ),
+        button('to',
+            tabindex='-1',
+            css='margin: 0;',
+            onclick=call(arm_do, *to_here),
+            title=', '.join(m.try_name() or m.__class__.__name__ for m in to_here)
+        ),
+        style=f'grid-column: run',
+        css='margin: 0 10px; display: flex;',
+    )]
+
+    cells += [button('update',
+        tabindex='-1',
+        style=f'grid-column: update',
+        css='margin: 0 10px;',
+        onclick=call(update, program_name, i),
+        oncontextmenu='event.preventDefault();' + call(update, program_name, i, grouped=True),
+    )]
+
+    cells += [input(
+        style=f'grid-column: name',
+        type='text',
+        css='''
+            &:hover:not([disabled]) {
+                background: #fff8;
+                box-shadow:
+                    inset  1px  0px #0006,
+                    inset  0px  1px #0006,
+                    inset -1px  0px #0006,
+                    inset  0px -1px #0006;
+            }
+            & {
+                padding: 0 10px;
+                margin-right: 10px;
+                border: 0;
+                background: unset;
+                min-width: 0; /* makes flex able to shrink element */
+                font-size: 14px;
+            }
+        ''',
+        disabled=not hasattr(m, 'name'),
+        value=getattr(m, 'name', ''),
+        oninput=call(edit_at, program_name, i, js("{name:event.target.value}")),
+    )]
+    script = m.to_ur_script()
+    if isinstance(m, moves.MoveLin):
+        script = f'''MoveLin({
+            m.xyz[0]:7.1f},{
+            m.xyz[1]:7.1f},{
+            m.xyz[2]:7.1f},{
+            m.rpy[0]:5.1f},{
+            m.rpy[1]:5.1f},{
+            m.rpy[2]:6.1f})'''
+        if m.in_joint_space:
+            script += 'J'
+        if m.tag:
+            script += '*'
+    cells += [V.pre(script,
+        style=f'grid-column: value',
+        css='margin: unset',
+        title=repr(m),
+        onclick=call(edit_at, program_name, i, {}, action='duplicate'),
+        oncontextmenu='event.preventDefault();confirm("Delete?")&&' + call(edit_at, program_name, i, {}, action='delete')
+    )]
+    return cells
+
+def program_buttons(visible_program: list[Move]) -> Tag:
+    '''
+    The buttons below the moves, which only change when the movelist is edited.
+    '''
+    freedrive: list[Move]
+    stop_robot: list[Move]
+    if state.ur:
+        freedrive = [moves.RawCode('freedrive_mode() sleep(3600)')]
+        stop_robot = []
+    elif state.pf:
+        freedrive = [moves.RawCode('Freedrive')]
+        stop_robot = [moves.RawCode('StopFreedrive')]
+    elif state.xarm:
+        freedrive = [moves.XArmBuiltin('freedrive')]
+        stop_robot = [moves.XArmBuiltin('stop')]
+    else:
+        freedrive = []
+        stop_robot = []
+
+    return div(
+        css="""
+            & {
+                display: flex;
+            }
+            & {
+                margin-top: 10px;
+            }
+            & button {
+                padding: 10px 20px;
+            }
+            & button:not(:first-child) {
+                margin-left: 10px;
+            }
+        """).append(
+            button('run program',   tabindex='-1', onclick=call(arm_do, *visible_program),
+                                                   oncontextmenu='event.preventDefault();' + call(arm_do, *(visible_program * 100)), css='width: 160px'),
+            button('init pf',       tabindex='-1', onclick=call(state.pf.init)) if state.pf else '',
+            button('freedrive',     tabindex='-1', onclick=call(arm_do, *freedrive)),
+            # button('snap',          tabindex='-1', onclick=call(snap)),
+            # button('snap many',     tabindex='-1', onclick=call(snap_many, js('prompt("desc", "")'))),
+            button('stop robot',    tabindex='-1', onclick=call(arm_do, *stop_robot), css='flex-grow: 1; color: red; font-size: 48px'),
+            button('gripper open',  tabindex='-1', onclick=call(arm_do, moves.RawCode("GripperMove(88)") if state.ur else moves.GripperMove(100))),
+            button('gripper close', tabindex='-1', onclick=call(arm_do, moves.RawCode("GripperMove(255)") if state.ur else moves.GripperMove(75 if state.pf else 255))),
+            button('grip test',     tabindex='-1', onclick=call(arm_do, moves.RawCode("GripperTest()"))),
+    )
+
+def index() -> Iterator[Node | dict[str, str]]:
     state.init()
     programs = get_programs()
     program_var = store.query.str(name='program')
@@ -292,6 +471,7 @@ def index() -> Iterator[Tag | dict[str, str]]:
     program_name = program_var.value or list(programs.keys())[0]
     section: str = section_var.value
     ml = MoveList.read_jsonl(programs[program_name])
+    ml_stat = programs[program_name].stat()
 
     yield V.title(program_name + ' ' + section)
 
@@ -426,38 +606,11 @@ def index() -> Iterator[Tag | dict[str, str]]:
                     background: #fd9
                 }
             ''')
-        row += div(
-            style=f'grid-column: 1 / -1',
-            css='''
-                :nth-child(even) > & {
-                    background: #f4f4f4
-                }
-            ''')
         grid += row
-
-        if isinstance(m, moves.Section):
-            sect = div(
-                css="""
-                    & {
-                        grid-column: x / -1;
-                        margin-top: 12px;
-                        padding-bottom: 4px;
-                    }
-                    & button {
-                        padding: 1px 14px 5px;
-                        margin-right: 6px;
-                        font-family: sans;
-                        font-size: 14px;
-                    }
-                """
-            )
-            row += sect
-            sect += button(m.section,
-                tabindex='-1',
-                onclick=call(section_var.assign, m.section),
-                style="cursor: pointer;"
-            )
-            continue
+        row += V.cached(
+            (row_cells, program_name, ml_stat.st_mtime_ns, ml_stat.st_size, section, row_index),
+            functools.partial(row_cells, program_name, visible_moves, row_index, section_var),
+        )
 
         if isinstance(m, moves.MoveLin) and (xyz := info.get("xyz")) and (rpy := info.get("rpy")):
             dx, dy, dz =  dxyz = pbutils.zip_sub(m.xyz, xyz, ndigits=6)
@@ -505,141 +658,9 @@ def index() -> Iterator[Tag | dict[str, str]]:
                     '''
                 )
 
-        if m.is_gripper():
-            row += div(
-                'gripper close' if m.is_close() else 'gripper open',
-                css='''
-                    grid-column: x / span 3;
-                    justify-self: end;
-                    font-family: sans;
-                    font-size: 13px;
-                    font-style: italic;
-                '''
-            )
-
-        row += button('go',
-            tabindex='-1',
-            style=f'grid-column: go',
-            css='margin: 0 10px;',
-            onclick=call(arm_do, m),
-        )
-
-        from_here = [m for _, m in visible_moves[row_index:] if not isinstance(m, moves.Section)]
-        to_here = [m for _, m in visible_moves[:row_index+1] if not isinstance(m, moves.Section)]
-
-        row += div(
-            button('run from here',
-                tabindex='-1',
-                css='margin: 0;',
-                onclick=call(arm_do, *from_here),
-                title=', '.join(m.try_name() or m.__class__.__name__ for m in from_here)
-            ),
-            button('to',
-                tabindex='-1',
-                css='margin: 0;',
-                onclick=call(arm_do, *to_here),
-                title=', '.join(m.try_name() or m.__class__.__name__ for m in to_here)
-            ),
-            style=f'grid-column: run',
-            css='margin: 0 10px; display: flex;',
-        )
-
-        row += button('update',
-            tabindex='-1',
-            style=f'grid-column: update',
-            css='margin: 0 10px;',
-            onclick=call(update, program_name, i),
-            oncontextmenu='event.preventDefault();' + call(update, program_name, i, grouped=True),
-        )
-
-        row += input(
-            style=f'grid-column: name',
-            type='text',
-            css='''
-                &:hover:not([disabled]) {
-                    background: #fff8;
-                    box-shadow:
-                        inset  1px  0px #0006,
-                        inset  0px  1px #0006,
-                        inset -1px  0px #0006,
-                        inset  0px -1px #0006;
-                }
-                & {
-                    padding: 0 10px;
-                    margin-right: 10px;
-                    border: 0;
-                    background: unset;
-                    min-width: 0; /* makes flex able to shrink element */
-                    font-size: 14px;
-                }
-            ''',
-            disabled=not hasattr(m, 'name'),
-            value=getattr(m, 'name', ''),
-            oninput=call(edit_at, program_name, i, js("{name:event.target.value}")),
-        )
-        if not isinstance(m, moves.Section):
-            script = m.to_ur_script()
-            if isinstance(m, moves.MoveLin):
-                script = f'''MoveLin({
-                    m.xyz[0]:7.1f},{
-                    m.xyz[1]:7.1f},{
-                    m.xyz[2]:7.1f},{
-                    m.rpy[0]:5.1f},{
-                    m.rpy[1]:5.1f},{
-                    m.rpy[2]:6.1f})'''
-                if m.in_joint_space:
-                    script += 'J'
-                if m.tag:
-                    script += '*'
-            row += V.pre(script,
-                style=f'grid-column: value',
-                css='margin: unset',
-                title=repr(m),
-                onclick=call(edit_at, program_name, i, {}, action='duplicate'),
-                oncontextmenu='event.preventDefault();confirm("Delete?")&&' + call(edit_at, program_name, i, {}, action='delete')
-            )
-
-    freedrive: list[Move]
-    stop_robot: list[Move]
-    if state.ur:
-        freedrive = [moves.RawCode('freedrive_mode() sleep(3600)')]
-        stop_robot = []
-    elif state.pf:
-        freedrive = [moves.RawCode('Freedrive')]
-        stop_robot = [moves.RawCode('StopFreedrive')]
-    elif state.xarm:
-        freedrive = [moves.XArmBuiltin('freedrive')]
-        stop_robot = [moves.XArmBuiltin('stop')]
-    else:
-        freedrive = []
-        stop_robot = []
-
-
-    yield div(
-        css="""
-            & {
-                display: flex;
-            }
-            & {
-                margin-top: 10px;
-            }
-            & button {
-                padding: 10px 20px;
-            }
-            & button:not(:first-child) {
-                margin-left: 10px;
-            }
-        """).append(
-            button('run program',   tabindex='-1', onclick=call(arm_do, *visible_program),
-                                                   oncontextmenu='event.preventDefault();' + call(arm_do, *(visible_program * 100)), css='width: 160px'),
-            button('init pf',       tabindex='-1', onclick=call(state.pf.init)) if state.pf else '',
-            button('freedrive',     tabindex='-1', onclick=call(arm_do, *freedrive)),
-            # button('snap',          tabindex='-1', onclick=call(snap)),
-            # button('snap many',     tabindex='-1', onclick=call(snap_many, js('prompt("desc", "")'))),
-            button('stop robot',    tabindex='-1', onclick=call(arm_do, *stop_robot), css='flex-grow: 1; color: red; font-size: 48px'),
-            button('gripper open',  tabindex='-1', onclick=call(arm_do, moves.RawCode("GripperMove(88)") if state.ur else moves.GripperMove(100))),
-            button('gripper close', tabindex='-1', onclick=call(arm_do, moves.RawCode("GripperMove(255)") if state.ur else moves.GripperMove(75 if state.pf else 255))),
-            button('grip test',     tabindex='-1', onclick=call(arm_do, moves.RawCode("GripperTest()"))),
+    yield V.cached(
+        (program_buttons, program_name, ml_stat.st_mtime_ns, ml_stat.st_size, section),
+        functools.partial(program_buttons, visible_program),
     )
 
     foot = div(css='''
@@ -590,8 +590,6 @@ def test_make_protocol_config():
     for args in argss:
         make_protocol_config(paths_v5(), args)
 
-test_make_protocol_config()
-
 def program_test_comm(with_incu: bool=True, with_blue: bool=True) -> Command:
     '''
     Test communication with robotarm, washer, dispenser and incubator.
@@ -1,8 +1,9 @@
+from __future__ import annotations
 from dataclasses import *
 from typing import *
 
-import labrobots
-from labrobots.dir_list import PathInfo
+if TYPE_CHECKING:
+    from labrobots.dir_list import PathInfo, ReadFile
 from .log import Log, DB
 
 import pbutils
@@ -145,6 +146,7 @@ skip = set('''
 '''.split())
 
 def update_protocol_paths() -> list[PathInfo]:
+    import labrobots
     path_infos = labrobots.WindowsNUC().remote(timeout_secs=10).dir_list.list()
     res: dict[str, ProtocolPaths] = {}
     for protocol_dir, infos in sorted(pbutils.group_by(path_infos, lambda info: info['path'].partition('/')[0]).items()):
@@ -198,7 +200,11 @@ def add_protocol_dir_as_sqlar(db: DB, protocol_dir: str):
     '''
     Add the LHC files in the protocol_dir as an SQLite Archive (sqlar) table (without compression for simplicity)
     '''
+    import labrobots
     files = labrobots.WindowsNUC().remote(timeout_secs=60).dir_list.read_files(protocol_dir)
+    add_files_as_sqlar(db, files)
+
+def add_files_as_sqlar(db: DB, files: list[ReadFile]):
     with db.transaction:
         for f in files:
             data: bytes = base64.b64decode(f['data_b64'])
@@ -2,7 +2,7 @@ from __future__ import annotations
 from typing import *
 
 from viable import Serve, js, store, Flask, call
-from viable import Tag, pre, div, span, label
+from viable import Node, Tag, pre, div, span, label, cached, scroll_window
 
 from .log import Log
 from . import commands
@@ -88,7 +88,7 @@ def add_to_serve(serve: Serve, cmdline0: str, cmdline_to_log: Callable[[str], Lo
     cmdline_to_log = lru_cache(cmdline_to_log)
 
     @serve.route(route)
-    def index() -> Iterator[Tag | dict[str, str]]:
+    def index() -> Iterator[Node | dict[str, str]]:
 
         yield {
             'sheet': '''
@@ -141,6 +141,8 @@ def add_to_serve(serve: Serve, cmdline0: str, cmdline_to_log: Callable[[str], Lo
         delay_secs = store.query.int(0, min=0, max=60)
         zoom_int = store.query.int(100, min=1, max=1000)
         vertical = store.query.bool(True)
+        windowed = store.query.bool(True)
+        vis_window = store.session.str('')
         pfa_duration = store.query.int(15, min=0, max=100)
         store.assign_names(locals())
         zoom = zoom_int.value / 100.0
@@ -164,6 +166,7 @@ def add_to_serve(serve: Serve, cmdline0: str, cmdline_to_log: Callable[[str], Lo
                 label(span('zoom: '), zoom_int.range(), span(str(zoom_int.value))),
                 # label(span('pfa duration: '), pfa_duration.range().extend(width=200), span(f'{pfa_duration.value} s')),
                 label(span('vertical: '), vertical.input().extend(style='justify-self: left')),
+                label(span('windowed: '), windowed.input().extend(style='justify-self: left')),
                 background='#fff',
                 border_bottom='1px #0008 solid',
                 p=20,
@@ -202,212 +205,228 @@ def add_to_serve(serve: Serve, cmdline0: str, cmdline_to_log: Callable[[str], Lo
 
             yield pre('\n'.join(log.group_durations_for_display()))
 
-        area = div(style=f'''
-            width: 100%;
-            -height: {zoom * max(e.t for e in entries)}px;
-        ''', css='''
-            & {
-                position: relative;
-                user-select: none;
-                -transform: translateY(-50%) rotate(90deg) scaleX(-1);
-            }
-            & > * > span {
-                -transform: translate(-25%, -25%) rotate(90deg) scaleX(-1);
-            }
-        ''')
-        ts: list[float] = []
-        eps = 0.0
-        for e in entries:
-            ts += [e.t0, e.t + eps]
-        t_dict: dict[float, list[int]] = DefaultDict(list)
-        for i, t in list(enumerate(sorted(ts))):
-            t_dict[t].insert(0, i)
-        for e in reversed(entries):
-            if 0:
-                t0 = t_dict[e.t0].pop()
-                t = t_dict[e.t + eps].pop() + 0.9
-            else:
-                t0 = e.t0
-                t = e.t
-            cmd = e.cmd
-            m = e.metadata
-            slot = m.slot
-            plate = pbutils.catch(lambda: int(m.plate_id or '0'), 0)
-            machine = e.machine() or ''
-            sources: dict[Any, str] = {
-                commands.Idle: 'idle',
-                commands.WaitForCheckpoint: 'wait',
-                commands.Duration: 'duration',
-            }
-            source = sources.get(e.cmd.__class__, machine) or ''
-            if cast(Any, t0) is None:
-                continue
-            if slot == 0:
-                slot = {
-                    'fridge': 2,
-                    'incu': 2,
-                    'wash': 3,
-                    'blue': 3,
-                    'disp': 4,
-                    'nikon': 3,
-                    'squid': 3,
-                    None: 1
-                }.get(m.thread_resource, 1)
-            slot = 2 * slot
-            if machine in ('', 'robotarm', 'pf'):
-                slot -= 1
-            if isinstance(e.cmd, commands.WaitForCheckpoint):
-                slot -= 1
-            if isinstance(e.cmd, commands.Checkpoint):
-                continue
-            if source == 'duration':
-                slot = 10 + plate
-            slot += 1
-            color_map = {
-                '':         'var(--fg)',
-                'wait':     'var(--yellow)',
-                'idle':     'var(--yellow)',
-                'robotarm': 'var(--blue)',
-                'pf':       'var(--blue)',
-                'xarm':     'var(--blue)',
-                'wash':     'var(--cyan)',
-                'blue':     'var(--cyan)',
-                'disp':     'var(--purple)',
-                'incu':     'var(--green)',
-                'fridge':   'var(--cyan)',
-                'squid':    'var(--red)',
-                'nikon':    'var(--orange)',
-            }
-            color = color_map.get(source, '#ccc')
-            fg_color = '#000'
-            width = 14
-            my_width = 14
-            my_offset = 0
-            if not vertical.value:
-                slot = {
-                    'incu': 3,
-                    'fridge': 2,
-                    'wash': 2,
-                    'blue': 2,
-                    'disp': 1,
-                    'nikon': 3,
-                    'squid': 3,
-                    None: 0,
-                }.get(m.thread_resource, 0)
+        window: tuple[int, int] | None = None
+        if windowed.value:
+            # only the entries near the viewport are rendered, the rest when scrolled to
+            window, window_script = scroll_window(vis_window, 'protocol-vis', axis='y' if vertical.value else 'x')
+            yield window_script
+
+        def build_area() -> Tag:
+            area = div(id='protocol-vis', style=f'''
+                width: 100%;
+                -height: {zoom * max(e.t for e in entries)}px;
+            ''', css='''
+                & {
+                    position: relative;
+                    user-select: none;
+                    -transform: translateY(-50%) rotate(90deg) scaleX(-1);
+                }
+                & > * > span {
+                    -transform: translate(-25%, -25%) rotate(90deg) scaleX(-1);
+                }
+            ''')
+            if window:
+                # the area keeps the size of all entries so that the page can be scrolled to the others
+                extent = zoom * max((e.t for e in entries), default=0.0)
+                area.extend(style=f'min-height: {extent:.1f}px' if vertical.value else f'min-width: {20 + extent:.1f}px')
+            ts: list[float] = []
+            eps = 0.0
+            for e in entries:
+                ts += [e.t0, e.t + eps]
+            t_dict: dict[float, list[int]] = DefaultDict(list)
+            for i, t in list(enumerate(sorted(ts))):
+                t_dict[t].insert(0, i)
+            for e in reversed(entries):
+                if 0:
+                    t0 = t_dict[e.t0].pop()
+                    t = t_dict[e.t + eps].pop() + 0.9
+                else:
+                    t0 = e.t0
+                    t = e.t
+                cmd = e.cmd
+                m = e.metadata
+                slot = m.slot
+                plate = pbutils.catch(lambda: int(m.plate_id or '0'), 0)
+                machine = e.machine() or ''
+                sources: dict[Any, str] = {
+                    commands.Idle: 'idle',
+                    commands.WaitForCheckpoint: 'wait',
+                    commands.Duration: 'duration',
+                }
+                source = sources.get(e.cmd.__class__, machine) or ''
+                if cast(Any, t0) is None:
+                    continue
+                if window and not (window[0] <= zoom * t and zoom * t0 <= window[1]):
+                    continue
+                if slot == 0:
+                    slot = {
+                        'fridge': 2,
+                        'incu': 2,
+                        'wash': 3,
+                        'blue': 3,
+                        'disp': 4,
+                        'nikon': 3,
+                        'squid': 3,
+                        None: 1
+                    }.get(m.thread_resource, 1)
+                slot = 2 * slot
+                if machine in ('', 'robotarm', 'pf'):
+                    slot -= 1
+                if isinstance(e.cmd, commands.WaitForCheckpoint):
+                    slot -= 1
+                if isinstance(e.cmd, commands.Checkpoint):
+                    continue
+                if source == 'duration':
+                    slot = 10 + plate
+                slot += 1
+                color_map = {
+                    '':         'var(--fg)',
+                    'wait':     'var(--yellow)',
+                    'idle':     'var(--yellow)',
+                    'robotarm': 'var(--blue)',
+                    'pf':       'var(--blue)',
+                    'xarm':     'var(--blue)',
+                    'wash':     'var(--cyan)',
+                    'blue':     'var(--cyan)',
+                    'disp':     'var(--purple)',
+                    'incu':     'var(--green)',
+                    'fridge':   'var(--cyan)',
+                    'squid':    'var(--red)',
+                    'nikon':    'var(--orange)',
+                }
+                color = color_map.get(source, '#ccc')
+                fg_color = '#000'
+                width = 14
+                my_width = 14
+                my_offset = 0
+                if not vertical.value:
+                    slot = {
+                        'incu': 3,
+                        'fridge': 2,
+                        'wash': 2,
+                        'blue': 2,
+                        'disp': 1,
+                        'nikon': 3,
+                        'squid': 3,
+                        None: 0,
+                    }.get(m.thread_resource, 0)
+                    if isinstance(cmd, commands.Duration):
+                        continue
+                        slot = 4
                 if isinstance(cmd, commands.Duration):
+                    my_width = 4
+                    if 'transfer' in cmd.name:
+                        color = colors.get('color1')
+                    if 'lid' in cmd.name:
+                        my_offset += 4
+                    if 'pre disp' in cmd.name:
+                        my_offset += 8
+                    if '37C' in cmd.name:
+                        my_offset += 4
+                        color = colors.get(color_map['incu'])
+                if source == 'wait':
+                    my_width = 7
+                if source == 'idle':
+                    my_width = 7
+                if source == 'run':
                     continue
-                    slot = 4
-            if isinstance(cmd, commands.Duration):
-                my_width = 4
-                if 'transfer' in cmd.name:
-                    color = colors.get('color1')
-                if 'lid' in cmd.name:
-                    my_offset += 4
-                if 'pre disp' in cmd.name:
-                    my_offset += 8
-                if '37C' in cmd.name:
-                    my_offset += 4
-                    color = colors.get(color_map['incu'])
-            if source == 'wait':
-                my_width = 7
-            if source == 'idle':
-                my_width = 7
-            if source == 'run':
-                continue
-            width *= 2
-            my_width *= 2
-            my_offset *= 2
-            if (est := e.metadata.est) and (dur := e.duration):
-                pct = round(100 * dur / est, 1)
-            else:
-                pct = 100.0
-            for_show = pbutils.nub(e) | dict(
-                t=pbutils.pp_secs(t),
-                t0=pbutils.pp_secs(t0),
-                machine=machine,
-                source=source,
-                est=pbutils.pp_secs(e.metadata.est or 0.0),
-                duration=pbutils.pp_secs(e.duration or 0.0),
-                id=e.metadata.id,
-                pct=pct,
-                stage=e.metadata.stage,
-                thread_resource=m.thread_resource,
-            )
-            area += div(
-                (m.plate_id if t - t0 > 9.0 and my_width > 4 else '') or '',
-                css='''
-                    position: absolute;
-                    border-radius: 2px;
-                    border: 1px #0005 solid;
-                    display: grid;
-                    place-items: center;
-                    font-size: 12px;
-                    background: var(--bg-color);
-                    cursor: pointer;
-                    filter: contrast(1.3);
-                    text-align: center;
-                ''',
-                css__=f'''
-                    --bg-color: {color};
-                    --fg-color: {fg_color};
-                ''',
-                style=
-                    f'''
-                        left: {slot * width + my_offset:.1f}px;
-                        width: {my_width - 2:.1f}px;
-                        top: {zoom * t0:.1f}px;
-                        height: {max(zoom * (t - t0), 1):.1f}px;
-                        min-height: 5px;
-                    '''
-                    if vertical.value else
-                    f'''
-                        top: {slot * width + my_offset:.1f}px;
-                        height: {my_width - 2:.1f}px;
-                        left: {20 + zoom * t0:.1f}px;
-                        width: {max(zoom * (t - t0), 1):.1f}px;
-                        min-width: 5px;
-                    '''
-                ,
-                css_=
-                    '''
-                        &:hover::after {
-                            position: absolute;
-                            display: block;
-                            left: 100%;
-                            top: 0;
-                            margin-left: 5px;
-                            content: attr(shortinfo);
-                        }
-                        &:hover {
-                            z-index: 10;
-                        }
-                    '''
-                    if vertical.value else
-                    '''
-                        &:hover::after {
-                            position: absolute;
-                            display: block;
-                            height: 100%;
-                            top: 100%;
-                            content: attr(shortinfo);
-                        }
-                        &:hover {
-                            z-index: 10;
-                        }
+                width *= 2
+                my_width *= 2
+                my_offset *= 2
+                if (est := e.metadata.est) and (dur := e.duration):
+                    pct = round(100 * dur / est, 1)
+                else:
+                    pct = 100.0
+                for_show = pbutils.nub(e) | dict(
+                    t=pbutils.pp_secs(t),
+                    t0=pbutils.pp_secs(t0),
+                    machine=machine,
+                    source=source,
+                    est=pbutils.pp_secs(e.metadata.est or 0.0),
+                    duration=pbutils.pp_secs(e.duration or 0.0),
+                    id=e.metadata.id,
+                    pct=pct,
+                    stage=e.metadata.stage,
+                    thread_resource=m.thread_resource,
+                )
+                area += div(
+                    (m.plate_id if t - t0 > 9.0 and my_width > 4 else '') or '',
+                    css='''
+                        position: absolute;
+                        border-radius: 2px;
+                        border: 1px #0005 solid;
+                        display: grid;
+                        place-items: center;
+                        font-size: 12px;
+                        background: var(--bg-color);
+                        cursor: pointer;
+                        filter: contrast(1.3);
+                        text-align: center;
+                    ''',
+                    css__=f'''
+                        --bg-color: {color};
+                        --fg-color: {fg_color};
                     ''',
-                shortinfo=str(e.cmd) if vertical.value else str(e.duration),
-                css___='outline: 2px #f00a dashed; border-radius: 0;' if pct > 101 else '',
-                data_color=color,
-                data_fg_color=fg_color,
-                data_info=pbutils.show(for_show, use_color=False),
-                data_short_info=pbutils.show(e.cmd, use_color=False),
-                onclick='''
-                    console.log('%c' + this.dataset.info, `color: ${this.dataset.fgColor}; background: ${this.dataset.color}`)
-                ''',
-                ondblclick='event.preventDefault();' + call(delay_ids.assign, str(m.id)),
-                oncontextmenu='event.preventDefault();' + call(delay_ids.assign, str(m.id)),
-            )
+                    style=
+                        f'''
+                            left: {slot * width + my_offset:.1f}px;
+                            width: {my_width - 2:.1f}px;
+                            top: {zoom * t0:.1f}px;
+                            height: {max(zoom * (t - t0), 1):.1f}px;
+                            min-height: 5px;
+                        '''
+                        if vertical.value else
+                        f'''
+                            top: {slot * width + my_offset:.1f}px;
+                            height: {my_width - 2:.1f}px;
+                            left: {20 + zoom * t0:.1f}px;
+                            width: {max(zoom * (t - t0), 1):.1f}px;
+                            min-width: 5px;
+                        '''
+                    ,
+                    css_=
+                        '''
+                            &:hover::after {
+                                position: absolute;
+                                display: block;
+                                left: 100%;
+                                top: 0;
+                                margin-left: 5px;
+                                content: attr(shortinfo);
+                            }
+                            &:hover {
+                                z-index: 10;
+                            }
+                        '''
+                        if vertical.value else
+                        '''
+                            &:hover::after {
+                                position: absolute;
+                                display: block;
+                                height: 100%;
+                                top: 100%;
+                                content: attr(shortinfo);
+                            }
+                            &:hover {
+                                z-index: 10;
+                            }
+                        ''',
+                    shortinfo=str(e.cmd) if vertical.value else str(e.duration),
+                    css___='outline: 2px #f00a dashed; border-radius: 0;' if pct > 101 else '',
+                    data_color=color,
+                    data_fg_color=fg_color,
+                    data_info=pbutils.show(for_show, use_color=False),
+                    data_short_info=pbutils.show(e.cmd, use_color=False),
+                    onclick='''
+                        console.log('%c' + this.dataset.info, `color: ${this.dataset.fgColor}; background: ${this.dataset.color}`)
+                    ''',
+                    ondblclick='event.preventDefault();' + call(delay_ids.assign, str(m.id)),
+                    oncontextmenu='event.preventDefault();' + call(delay_ids.assign, str(m.id)),
+                )
+
+            return area
 
-        yield area
+        # the simulated log is cached by line so the area only depends on these
+        yield cached((route, line, zoom_int.value, vertical.value, window), build_area)
 
 
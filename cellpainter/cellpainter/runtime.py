@@ -5,7 +5,6 @@ from typing import *
 import os
 import signal
 import sys
-import threading
 import traceback
 
 from contextlib import contextmanager
@@ -22,6 +21,7 @@ from .xarm import XArm
 from .timelike import Timelike
 from .moves import World, Effect
 from .log import Message, CommandState, CommandWithMetadata, ProgressText, Log
+from .log_writer import LogWriter
 
 from labrobots import (
     BarcodeReader,
@@ -39,6 +39,7 @@ from labrobots import (
     NikonNIS,
     NikonStage,
 )
+from labrobots.machine import progress_events, has_progress
 
 import contextlib
 
@@ -53,6 +54,7 @@ class Runtime:
     time: Timelike
 
     log_db: DB = field(default_factory=lambda: DB.connect(':memory:'))
+    log_writer: LogWriter = field(init=False)
 
     lock: RLock = field(default_factory=RLock)
 
@@ -63,6 +65,8 @@ class Runtime:
         lambda: DefaultDict[str, list[Queue[None]]](list)
     )
 
+    progress_texts: dict[int, str] = field(default_factory=lambda: dict[int, str]())
+
     ur: UR | None = None
     pf: PF | None = None
     xarm: XArm | None = None
@@ -107,6 +111,7 @@ class Runtime:
 
         if self.log_db:
             self.log_db.con.execute('pragma synchronous=OFF;')
+        self.log_writer = LogWriter(self.log_db, interval=self.config.log_flush_interval)
 
         if self.config.signal_handlers == 'install':
             def handle_signal(signum: int, _frame: Any):
@@ -194,13 +199,14 @@ class Runtime:
             pass
 
     def get_log(self) -> Log:
+        self.log_writer.flush()
         return Log(self.log_db)
 
     def spawn(self, f: Callable[[], None]) -> None:
         def F():
             with self.excepthook():
                 f()
-        threading.Thread(target=F, daemon=True).start()
+        self.time.spawn(F)
 
     @contextmanager
     def excepthook(self):
@@ -212,14 +218,16 @@ class Runtime:
             self.log(Message(str(e), traceback=traceback.format_exc(), is_error=True))
             os.kill(os.getpid(), signal.SIGTERM)
 
-    def log(self, message: Message) -> Message:
+    def log(self, message: Message) -> None:
         with self.lock:
             t = self.monotonic()
-            message = message.replace(t=t).save(self.log_db)
+            message = message.replace(t=t)
+            self.log_writer.save(message)
+            if message.is_error:
+                self.log_writer.flush()
             if message.traceback:
                 print(message.msg, file=sys.stderr)
                 print(message.traceback, file=sys.stderr)
-            return message
 
     world: World | None = None
 
@@ -227,7 +235,7 @@ class Runtime:
         with self.lock:
             if world is not None:
                 world = world.replace(t=self.time.monotonic())
-                world = world.save(self.log_db)
+                self.log_writer.save(world)
             self.world = world
 
     def apply_effect(self, effect: Effect, entry: CommandWithMetadata | None, fatal_errors: bool=False):
@@ -320,14 +328,15 @@ class Runtime:
                     metadata=entry.metadata,
                     state='running',
                     id=id,
-                ).save(self.log_db)
+                )
+                self.log_writer.save(state)
                 self.log_state(state)
             yield
             with self.lock:
                 t = self.monotonic()
                 state.state='completed'
                 state.t=t
-                state = state.save(self.log_db)
+                self.log_writer.save(state)
                 self.log_state(state)
 
         return worker()
@@ -348,7 +357,8 @@ class Runtime:
                 metadata=entry.metadata,
                 state='completed',
                 id=id,
-            ).save(self.log_db)
+            )
+            self.log_writer.save(state)
             self.log_state(state)
 
     def pp_time_offset(self, secs: int | float):
@@ -402,5 +412,49 @@ class Runtime:
         id = int(entry.metadata.id)
         assert id >= 0
         with self.lock:
-            ProgressText(text=text, id=id).save(self.log_db)
+            if self.progress_texts.get(id) == text:
+                return
+            self.progress_texts[id] = text
+            self.log_writer.save(ProgressText(text=text, id=id))
+
+    def follow_progress(self, machine: Any, poll: Callable[[], A]) -> Generator[A, None, None]:
+        '''
+        The progress of a remote machine each time it changes, from its event
+        stream. If the machine has no event stream, or it cannot be opened or
+        is lost, poll is used every second instead.
+        '''
+        if has_progress(machine):
+            try:
+                for value in progress_events(machine):
+                    if value is None:
+                        raise ValueError('The machine has no progress events')
+                    yield value
+            except (OSError, ValueError) as e:
+                print(f'Polling progress since the event stream is not available: {e}')
+        while True:
+            yield poll()
+            self.sleep(1.0)
+
 
+def test_follow_progress(capsys: Any):
+    import itertools
+    runtime = Runtime.init(RuntimeConfig.simulate())
+    try:
+        # nothing is served here so the event stream cannot be opened
+        host = 'http://127.0.0.1:1'
+        nikon = NikonNIS.remote('nikon', host, skip_up_check=True, timeout_secs=1)
+        polls = itertools.count()
+        values = runtime.follow_progress(nikon, lambda: next(polls))
+        assert [next(values) for _ in range(3)] == [0, 1, 2]
+        assert runtime.monotonic() == 2.0
+        values.close()
+        assert 'Polling progress' in capsys.readouterr().out
+
+        # squid has no progress events so it is polled without subscribing
+        squid = Squid.remote('squid', host, skip_up_check=True, timeout_secs=1)
+        values = runtime.follow_progress(squid, lambda: {'interactive': True})
+        assert next(values) == {'interactive': True}
+        values.close()
+        assert 'Polling progress' not in capsys.readouterr().out
+    finally:
+        runtime.log_writer.close()
@@ -0,0 +1,154 @@
+'''
+Content-addressed cache of simulated programs.
+
+The key is the program before scheduling together with the estimates and a
+digest of the code, and the value is the simulation log: the scheduled
+program, its planned command states and the world over time.
+Least recently used entries are evicted.
+'''
+from __future__ import annotations
+from dataclasses import *
+from typing import *
+
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import functools
+import hashlib
+
+import apsw
+
+import pbutils
+from pbutils.mixins import DB, DBMixin
+
+from .commands import Program, Seq, WaitForCheckpoint, RobotarmCmd
+from . import estimates
+
+cache_path = 'cache/schedules.db'
+max_entries = 100
+
+@dataclass
+class CachedSchedule(DBMixin):
+    key: str
+    log_db: bytes
+    last_used: datetime = field(default_factory=datetime.now)
+    id: int = -1
+
+@functools.cache
+def code_digest() -> str:
+    '''
+    Digest of the source files and movelists, which determine the schedule
+    and the simulation together with the program and the estimates.
+    '''
+    h = hashlib.sha256()
+    paths = [
+        *sorted(Path(__file__).parent.glob('**/*.py')),
+        *sorted(Path('./movelists').glob('*.jsonl')),
+    ]
+    for path in paths:
+        h.update(str(path).encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+@functools.cache
+def estimates_digest(path: str = estimates.estimates_jsonl_path) -> str:
+    '''
+    Digest of the estimates file. The estimates in memory are not used since
+    estimate adds guesses to them as it goes.
+    '''
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+def program_key(program: Program, sim_delays: dict[int, float]) -> str:
+    h = hashlib.sha256()
+    h.update(pbutils.serializer.dumps(program.replace(id=-1)).encode())
+    h.update(pbutils.serializer.dumps(sorted(map(list, sim_delays.items()))).encode())
+    h.update(estimates_digest().encode())
+    h.update(code_digest().encode())
+    return h.hexdigest()
+
+@contextmanager
+def open_cache(path: str | None = None) -> Generator[DB, None, None]:
+    '''
+    The cache at path, by default at cache_path.
+    '''
+    path = path or cache_path
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    db = DB.connect(path)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get(key: str, path: str | None = None) -> DB | None:
+    '''
+    The cached simulation log as an in-memory database, or None.
+    A busy cache is a miss, and a hit is not marked as used if the cache is busy.
+    '''
+    try:
+        with open_cache(path) as db:
+            entry = db.get(CachedSchedule).where(CachedSchedule.key == key).one_or(None)
+            if entry is None:
+                return None
+            try:
+                replace(entry, last_used=datetime.now()).save(db)
+            except apsw.BusyError:
+                pass
+    except apsw.BusyError:
+        return None
+    return DB.deserialize(entry.log_db)
+
+def put(key: str, log_db: DB, path: str | None = None):
+    '''
+    Stores a copy of the simulation log and evicts the least recently used entries.
+    Does nothing if the cache is busy for too long, for example by many parallel simulations.
+    '''
+    data = log_db.serialize()
+    try:
+        with open_cache(path) as db:
+            with db.transaction:
+                for entry in db.get(CachedSchedule).where(CachedSchedule.key == key):
+                    entry.delete(db)
+                CachedSchedule(key, data).save(db)
+                for entry in db.get(CachedSchedule).order(CachedSchedule.last_used, 'desc').limit(-1, offset=max_entries):
+                    entry.delete(db)
+    except apsw.BusyError:
+        pass
+
+def test_schedule_cache(tmp_path: Path, monkeypatch: Any):
+    monkeypatch.setattr(f'{__name__}.cache_path', str(tmp_path / 'schedules.db'))
+    monkeypatch.setattr(f'{__name__}.max_entries', 2)
+    log_db = DB.connect(':memory:')
+    CachedSchedule('log', b'contents').save(log_db)
+    assert get('a') is None
+    put('a', log_db)
+    hit = get('a')
+    assert hit is not None
+    assert [e.log_db for e in hit.get(CachedSchedule)] == [b'contents']
+    put('b', log_db)
+    put('c', log_db)
+    assert get('a') is None
+    assert get('b') is not None
+    assert get('c') is not None
+    # a hit while another process writes is returned but not marked as used
+    other = DB.connect(cache_path)
+    [before] = other.get(CachedSchedule).where(CachedSchedule.key == 'b')
+    with other.transaction:
+        assert get('b') is not None
+    [after] = other.get(CachedSchedule).where(CachedSchedule.key == 'b')
+    assert before.last_used == after.last_used
+    other.close()
+
+def test_program_key(tmp_path: Path):
+    program = Program(Seq(WaitForCheckpoint('x')))
+    key = program_key(program, {})
+    assert key == program_key(program.replace(id=1), {})
+    assert key != program_key(program, {1: 1.0})
+    assert key != program_key(Program(Seq(WaitForCheckpoint('y'))), {})
+    estimates.estimate(RobotarmCmd('not-in-the-estimates'))
+    assert key == program_key(program, {})
+
+    a = tmp_path / 'a.jsonl'
+    b = tmp_path / 'b.jsonl'
+    a.write_text('{"cmd":{"type":"BarcodeClear"},"datetime":"2025-03-28 22:17:14","duration":0.038}\n')
+    b.write_text('{"cmd":{"type":"BarcodeClear"},"datetime":"2025-03-28 22:17:14","duration":0.040}\n')
+    assert estimates_digest(str(a)) != estimates_digest(str(b))
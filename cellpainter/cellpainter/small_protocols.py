@@ -8,6 +8,7 @@ from .moves import World
 from . import moves
 from . import estimates
 
+import functools
 import re
 import pbutils
 from .log import Metadata
@@ -26,7 +27,8 @@ from .protocol import (
 from . import protocol
 from . import protocol_paths
 
-from labrobots.liconic import FridgeSlots
+if TYPE_CHECKING:
+    from labrobots.liconic import FridgeSlots
 
 from pbutils.args import arg
 
@@ -58,7 +60,11 @@ SmallProtocol: TypeAlias = Callable[[SmallProtocolArgs], Program]
 ur_protocols: list[SmallProtocol] = []
 pf_protocols: list[SmallProtocol] = []
 
-def protocol_args(small_protocol: SmallProtocol) -> set[str]:
+@functools.cache
+def protocol_args(small_protocol: SmallProtocol) -> frozenset[str]:
+    '''
+    The arguments the protocol reads, found by running it once.
+    '''
     out: set[str] = set()
     args = SmallProtocolArgs()
     missing = object()
@@ -75,7 +81,7 @@ def protocol_args(small_protocol: SmallProtocol) -> set[str]:
         _ = small_protocol(intercepted_args)
     except:
         pass
-    return out - {'fridge_contents'}
+    return frozenset(out - {'fridge_contents'})
 
 @ur_protocols.append
 def incu_load(args: SmallProtocolArgs):
@@ -621,11 +627,11 @@ def wave(args: SmallProtocolArgs):
 def fill_estimates(cmd: Command):
     for c in cmd.universe():
         if isinstance(c, RobotarmCmd):
-            moves.movelists[c.program_name] = moves.MoveList()
+            moves.get_movelists()[c.program_name] = moves.MoveList()
         if isinstance(c, Meta) and (est := c.metadata.est) is not None:
             i = c.peel_meta()
             if isinstance(i, estimates.PhysicalCommand):
-                estimates.estimates[i] = est
+                estimates.get_estimates()[i] = est
                 # print(i, est)
 
 
@@ -1379,9 +1385,13 @@ def run_robotarm(args: SmallProtocolArgs):
 class SmallProtocolData:
     name: str
     make: SmallProtocol
-    args: set[str]
     doc: str
 
+    @property
+    def args(self) -> frozenset[str]:
+        # found by running the protocol so only done when needed, not for the list of protocols
+        return protocol_args(self.make)
+
 small_protocols: list[SmallProtocol] = ur_protocols + pf_protocols
 
 def small_protocols_dict(imager: bool=True, painter: bool=True):
@@ -1389,7 +1399,6 @@ def small_protocols_dict(imager: bool=True, painter: bool=True):
         p.__name__: SmallProtocolData(
             p.__name__,
             p,
-            protocol_args(p),
             pbutils.doc_header(p)
         )
         for p in [
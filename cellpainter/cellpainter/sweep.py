@@ -0,0 +1,66 @@
+'''
+Runs a function over a grid of dataclass arguments in a process pool and
+streams the results as they finish.
+'''
+from __future__ import annotations
+from typing import *
+from dataclasses import *
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import itertools
+import json
+import math
+import sys
+
+A = TypeVar('A')
+
+def expand_grid(base: A, grid: dict[str, list[Any]]) -> list[A]:
+    '''
+    All combinations of the grid values replaced into base, last key varying fastest.
+    '''
+    names = {f.name for f in fields(cast(Any, base))}
+    for k in grid:
+        if k not in names:
+            raise ValueError(f'Unknown field {k!r} in grid (available: {", ".join(sorted(names))})')
+    return [
+        replace(cast(Any, base), **dict(zip(grid.keys(), values)))
+        for values in itertools.product(*grid.values())
+    ]
+
+def run_sweep(f: Callable[[A], dict[str, Any]], points: list[A], workers: int | None = None) -> Iterator[tuple[A, dict[str, Any]]]:
+    '''
+    Yields the points with their results in the order they finish.
+    Runs in this process when workers is 1.
+    '''
+    if workers == 1:
+        for point in points:
+            yield point, f(point)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(f, point): point for point in points}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def write_rows(rows: Iterable[dict[str, Any]], path: str | None = None) -> list[dict[str, Any]]:
+    '''
+    Writes rows as they arrive to a .jsonl file or as tsv to a file or stdout.
+    The tsv header is taken from the first row. NaN is written as null in jsonl.
+    '''
+    written: list[dict[str, Any]] = []
+    fp = open(path, 'w') if path else sys.stdout
+    try:
+        jsonl = path is not None and Path(path).suffix == '.jsonl'
+        for row in rows:
+            if jsonl:
+                print(json.dumps({k: None if isinstance(v, float) and math.isnan(v) else v for k, v in row.items()}), file=fp)
+            else:
+                if not written:
+                    print(*row.keys(), sep='\t', file=fp)
+                print(*row.values(), sep='\t', file=fp)
+            fp.flush()
+            written += [row]
+    finally:
+        if path:
+            fp.close()
+    return written
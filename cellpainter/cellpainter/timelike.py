@@ -4,7 +4,10 @@ from typing import *
 
 import abc
 import time
+import heapq
+import itertools
 import threading
+from collections import deque
 from queue import Queue
 from threading import Lock
 
@@ -45,23 +48,39 @@ class Timelike(abc.ABC):
     def thread_done(self):
         pass
 
-from threading import Thread
+    @abc.abstractmethod
+    def spawn(self, f: Callable[[], None]) -> None:
+        pass
 
+from threading import Thread
 
-@dataclass
+@dataclass(eq=False)
 class ThreadData:
     name: str = field(default_factory=lambda: threading.current_thread().name)
-    state: Literal['busy', 'blocked', 'sleeping'] = 'busy'
+    state: Literal['busy', 'ready', 'blocked', 'sleeping'] = 'busy'
     sleep_until: float = float('inf')
-    inbox: Queue[None] = field(default_factory=Queue)
-    blocked_at: Queue[Any] | None = None
+    baton: Lock = field(default_factory=Lock)
+
+    def __post_init__(self):
+        self.baton.acquire()
 
 @dataclass
 class SimulatedTime(Timelike):
-    threads: dict[Thread, ThreadData] = field(default_factory=lambda: DefaultDict[Thread, ThreadData](ThreadData))
+    '''
+    Discrete event simulation of the threads of a program.
+
+    Exactly one thread runs at a time. When it sleeps, blocks or finishes it
+    hands over to the next ready thread, or else to the thread with the
+    earliest wakeup, skipping time forward. Threads are woken in the order
+    they became ready so that simulations are reproducible.
+    '''
+    threads: dict[Thread, ThreadData] = field(default_factory=lambda: dict[Thread, ThreadData]())
     skipped_time: float = 0.0
-    lock: Lock = field(default_factory=Lock)
+    ready: deque[ThreadData] = field(default_factory=lambda: deque[ThreadData]())
+    wakeups: list[tuple[float, int, ThreadData]] = field(default_factory=lambda: list[tuple[float, int, ThreadData]]())
+    seq: Iterator[int] = field(default_factory=itertools.count)
     qsize: dict[int, int] = field(default_factory=lambda: DefaultDict[int, int](int))
+    blocked: dict[int, deque[ThreadData]] = field(default_factory=lambda: DefaultDict[int, deque[ThreadData]](deque))
 
     def log(self):
         return
@@ -77,107 +96,92 @@ class SimulatedTime(Timelike):
     def monotonic(self):
         return self.skipped_time
 
+    def spawn(self, f: Callable[[], None]) -> None:
+        def F():
+            thread_data.baton.acquire()
+            f()
+        thread = Thread(target=F, daemon=True)
+        thread_data = self.threads[thread] = ThreadData(thread.name, state='ready')
+        self.ready.append(thread_data)
+        thread.start()
+
     def register_thread(self, name: str):
-        with self.lock:
-            tid = threading.current_thread()
+        tid = threading.current_thread()
+        if tid in self.threads:
+            self.threads[tid].name = name
+        else:
+            assert not self.threads, f'Thread {tid.name} was not started with spawn'
             self.threads[tid] = ThreadData(name)
 
     def current_thread_data(self) -> ThreadData:
         tid = threading.current_thread()
-        return self.threads[tid]
+        thread_data = self.threads.get(tid)
+        assert thread_data is not None, f'Thread {tid.name} was not started with spawn'
+        return thread_data
 
     def current_thread_name(self) -> str:
         return self.current_thread_data().name
 
     def thread_done(self):
-        with self.lock:
-            tid = threading.current_thread()
-            del self.threads[tid]
-            self.wake_up()
+        tid = threading.current_thread()
+        self.current_thread_data()
+        del self.threads[tid]
+        self.hand_over()
 
     def queue_put(self, queue: Queue[A], a: A) -> None:
-        with self.lock:
-            i = id(queue)
-            self.qsize[i] += 1
-        queue.put(a)
-        with self.lock:
-            self.wake_up()
+        self.queue_put_nowait(queue, a)
 
     def queue_put_nowait(self, queue: Queue[A], a: A) -> None:
-        with self.lock:
-            i = id(queue)
-            self.qsize[i] += 1
+        i = id(queue)
+        self.qsize[i] += 1
         queue.put_nowait(a)
+        if self.blocked[i]:
+            thread_data = self.blocked[i].popleft()
+            thread_data.state = 'ready'
+            self.ready.append(thread_data)
 
     def queue_get(self, queue: Queue[A]) -> A:
-        thread_data = self.current_thread_data()
-        with self.lock:
+        i = id(queue)
+        if not self.qsize[i]:
+            thread_data = self.current_thread_data()
             thread_data.state = 'blocked'
-            thread_data.blocked_at = queue
-            assert thread_data.sleep_until == float('inf')
-            self.wake_up()
-
-        res = queue.get()
-
-        with self.lock:
-            i = id(queue)
-            self.qsize[i] -= 1
-            thread_data.state = 'busy'
-            thread_data.blocked_at = None
-            assert thread_data.sleep_until == float('inf')
-
-        return res
+            self.blocked[i].append(thread_data)
+            self.hand_over()
+            thread_data.baton.acquire()
+        self.qsize[i] -= 1
+        return queue.get_nowait()
 
     def sleep(self, seconds: float):
         if seconds <= 0:
             return
         thread_data = self.current_thread_data()
-        with self.lock:
-            thread_data.state = 'sleeping'
-            thread_data.sleep_until = self.monotonic() + seconds
-            self.wake_up()
-
+        thread_data.state = 'sleeping'
+        thread_data.sleep_until = self.monotonic() + seconds
+        heapq.heappush(self.wakeups, (thread_data.sleep_until, next(self.seq), thread_data))
         self.log()
-
-        thread_data.inbox.get()
-        assert thread_data.state == 'busy'
-        assert thread_data.sleep_until == float('inf')
-        with self.lock:
-            # take lock to make sure that the wake up procedure is finished
-            # before proceeding (possibly started by some other thread)
-            pass
-
-    def wake_up(self):
-        assert self.lock.locked()
-        # Wake up next thread if all are sleeping or blocked
-        self.log()
-        states = {v.state for v in self.threads.values()}
-        for st in self.threads.values():
-            if st.state == 'blocked' and self.qsize[id(st.blocked_at)]:
-                # will receive a message soon
+        self.hand_over()
+        thread_data.baton.acquire()
+
+    def hand_over(self):
+        '''
+        Lets the next thread run. The calling thread must not touch any state
+        after this until it has its baton back.
+        '''
+        if not self.ready:
+            if not self.wakeups:
+                if self.threads:
+                    raise ValueError(f'Threads blocked indefinitely')
                 return
-        if states == {'blocked'}:
-            raise ValueError(f'Threads blocked indefinitely')
-            return
-        if states <= {'blocked'}:
-            return
-        if 'busy' in states:
-            # there is still a thread busy, we exit here to let it proceed
-            return
-        now = self.monotonic()
-        if 'sleeping' in states:
-            skip_time = min(v.sleep_until for v in self.threads.values()) - now
-            assert skip_time != float('inf')
-            if skip_time > 0:
-                self.skipped_time += skip_time
-                now += skip_time
-            # print(f'... {pp_secs(now)} | skip_time={pp_secs(skip_time)}')
-        for v in self.threads.values():
-            if v.sleep_until - now < 1e-4:
-                v.state = 'busy'
-                v.sleep_until = float('inf')
-                v.inbox.put_nowait(None)
+            now = max(self.monotonic(), self.wakeups[0][0])
+            self.skipped_time = now
+            while self.wakeups and self.wakeups[0][0] - now < 1e-4:
+                _, _, thread_data = heapq.heappop(self.wakeups)
+                thread_data.sleep_until = float('inf')
+                self.ready.append(thread_data)
+        thread_data = self.ready.popleft()
+        thread_data.state = 'busy'
         self.log()
+        thread_data.baton.release()
 
 @dataclass(frozen=True)
 class WallTime(Timelike):
@@ -208,3 +212,32 @@ class WallTime(Timelike):
     def thread_done(self):
         pass
 
+    def spawn(self, f: Callable[[], None]) -> None:
+        threading.Thread(target=f, daemon=True).start()
+
+def test_simulation_is_deterministic():
+    from .cli import Args, args_to_program
+    from .execute import simulate_program
+    program = args_to_program(Args(protocol='cell-paint', batch_sizes='2', interleave=True, two_final_washes=True))
+    assert program
+    a, b = [simulate_program(program, use_cache=False) for _ in range(2)]
+    for table in ['CommandState', 'World']:
+        rows_a = list(a.con.execute(f'select * from {table} order by id'))
+        rows_b = list(b.con.execute(f'select * from {table} order by id'))
+        assert rows_a
+        assert rows_a == rows_b
+
+def test_thread_not_spawned():
+    time = SimulatedTime()
+    time.register_thread('main')
+    errors: list[str] = []
+    def f():
+        try:
+            time.sleep(1)
+        except AssertionError as e:
+            errors.append(str(e))
+    thread = Thread(target=f)
+    thread.start()
+    thread.join()
+    [error] = errors
+    assert error.startswith(f'Thread {thread.name} was not started with spawn')
@@ -1,4 +1,6 @@
 #!/usr/bin/env bash
 set -xeuo pipefail
-scp 'robotlab-ubuntu:/home/pharmbio/robotlab/cellpainter/logs/*.db' logs/
-scp 'pharmbio@mikro-asus:robotlab/cellpainter/logs/*.db' logs/
+# rsync only transfers the logs that are new or have changed
+rsync -t 'robotlab-ubuntu:/home/pharmbio/robotlab/cellpainter/logs/*.db' logs/
+rsync -t 'pharmbio@mikro-asus:robotlab/cellpainter/logs/*.db' logs/
+labrobots --fetch-io-archive logs/io-archive
@@ -7,6 +7,7 @@ requirements = '''
     labrobots
     apsw>=3.39.3
     xarm-python-sdk
+    numpy
 '''
 
 console_scripts = '''
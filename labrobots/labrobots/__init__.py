@@ -11,6 +11,7 @@ from .labeler import Labeler
 from .dlid import DLid
 
 from dataclasses import *
+from pathlib import Path
 
 LHC_CALLER_CLI_PATH = "C:\\Program Files (x86)\\BioTek\\Liquid Handling Control 2.22\\LHC_CallerCLI.exe"
 LHC_PROTOCOLS_ROOT = "C:\\ProgramData\\BioTek\\Liquid Handling Control 2.22\\Protocols\\"
@@ -82,14 +83,29 @@ def main():
     parser.add_argument('--host', type=str, default='default')
     parser.add_argument('--test', action='store_true', default=False)
     parser.add_argument('--node-name', type=str, default=platform.node())
+    parser.add_argument('--threads', type=int, default=0, help='Serve with waitress using this many threads instead of the flask development server')
+    parser.add_argument('--fetch-io-archive', metavar='DIR', type=str, default=None, help='Download the new IO database segments of the lab computers to DIR/<node name> instead of serving')
     args = parser.parse_args(sys.argv[1:])
+
+    if args.fetch_io_archive:
+        from .client import fetch_io_archive
+        for m in Machines.__subclasses__():
+            if m.ip == '127.0.0.1':
+                continue
+            try:
+                for path in fetch_io_archive(f'http://{m.ip}:{args.port}', Path(args.fetch_io_archive) / m.node_name):
+                    print(path)
+            except OSError as e:
+                print(f'{m.node_name}: {e}', file=sys.stderr)
+        return
+
     node_name = args.node_name
     if args.test:
         node_name = 'example'
     print('node_name:', node_name)
 
     machines = Machines.lookup_node_name(node_name)
-    machines.serve(port=args.port, host=machines.ip if args.host == 'default' else args.host)
+    machines.serve(port=args.port, host=machines.ip if args.host == 'default' else args.host, threads=args.threads)
 
 if __name__ == '__main__':
     main()
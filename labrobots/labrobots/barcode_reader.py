@@ -7,7 +7,7 @@ from threading import Thread
 
 from serial import Serial # type: ignore
 
-from .machine import Machine, Cell, Log
+from .machine import Machine, Cell, Log, idempotent
 
 @dataclass(frozen=True)
 class BarcodeReader(Machine):
@@ -36,6 +36,7 @@ class BarcodeReader(Machine):
                 self.current_barcode.value = line
                 self_log(f'barcode.read() = {line!r}', line=line)
 
+    @idempotent
     def read(self):
         return self.current_barcode.value
 
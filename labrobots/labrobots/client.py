@@ -0,0 +1,312 @@
+'''
+Keep-alive http connections to the machines served by Machines.serve.
+
+The remote machines of a host share one pool, so polling a machine reuses
+a connection instead of opening a new one for every call.
+
+Also the progress event streams of the machines, see subscribe, and
+downloads of the archived IO database segments, see fetch_io_archive.
+'''
+from __future__ import annotations
+from typing import *
+from dataclasses import *
+
+from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+import http.client
+import json
+import select
+import shutil
+import threading
+import time
+
+@dataclass
+class Pool:
+    '''
+    Idle connections to one host. A call takes a connection and gives it back
+    when the response has been read, so concurrent calls use separate connections.
+    '''
+    netloc: str
+    max_idle: int = 8
+    idle: list[http.client.HTTPConnection] = field(default_factory=lambda: list[http.client.HTTPConnection]())
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    num_connects: int = 0
+
+    def take(self, timeout: float) -> http.client.HTTPConnection:
+        with self.lock:
+            while self.idle:
+                con = self.idle.pop()
+                if con.sock is not None and not is_dropped(con.sock):
+                    con.sock.settimeout(timeout)
+                    return con
+                con.close()
+        return self.connect(timeout)
+
+    def connect(self, timeout: float) -> http.client.HTTPConnection:
+        with self.lock:
+            self.num_connects += 1
+        return http.client.HTTPConnection(self.netloc, timeout=timeout)
+
+    def give_back(self, con: http.client.HTTPConnection):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(con)
+                return
+        con.close()
+
+    def post_json(self, path: str, data: Any, timeout: float, retries: int=0, backoff: float=0.5) -> Any:
+        '''
+        Posts the data as json and returns the decoded response.
+
+        Failed calls are tried again retries times, waiting backoff seconds
+        before the first retry and twice as long before each next one. Only
+        use retries for calls that can safely be repeated, since a call
+        that failed may still have been run.
+
+        The server can close an idle connection just as it is taken. A call
+        on a reused connection that fails before the response starts was not
+        received, so it is sent once more on a new connection also without retries.
+        '''
+        body = json.dumps(data).encode()
+        def send(con: http.client.HTTPConnection) -> http.client.HTTPResponse:
+            con.request('POST', path, body=body, headers={'Content-type': 'application/json'})
+            return con.getresponse()
+        for attempt in range(retries + 1):
+            con = self.take(timeout)
+            try:
+                reused = con.sock is not None
+                try:
+                    resp = send(con)
+                except (BrokenPipeError, ConnectionResetError):
+                    # includes http.client.RemoteDisconnected
+                    if not reused:
+                        raise
+                    con.close()
+                    con = self.connect(timeout)
+                    resp = send(con)
+                res = resp.read()
+                if resp.status >= 400:
+                    raise OSError(f'HTTP Error {resp.status}: {resp.reason}')
+            except (OSError, http.client.HTTPException) as e:
+                con.close()
+                if attempt < retries:
+                    time.sleep(backoff * 2 ** attempt)
+                    continue
+                if isinstance(e, OSError):
+                    raise
+                else:
+                    raise OSError(f'{e.__class__.__name__}: {e}') from e
+            if resp.will_close:
+                con.close()
+            else:
+                self.give_back(con)
+            return json.loads(res)
+        assert False
+
+def is_dropped(sock: Any) -> bool:
+    '''
+    An idle connection that is readable has been closed by the server, or is broken.
+    '''
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+    except (OSError, ValueError):
+        return True
+
+pools: dict[str, Pool] = {}
+pools_lock = threading.Lock()
+
+def get_pool(url: str) -> Pool:
+    netloc = urlsplit(url).netloc
+    with pools_lock:
+        if netloc not in pools:
+            pools[netloc] = Pool(netloc)
+        return pools[netloc]
+
+def subscribe(url: str, keepalive: float = 15.0) -> Generator[Any, None, None]:
+    '''
+    The values of a server-sent event stream such as /<name>/events. Raises
+    OSError if the stream cannot be opened, or if it is closed or silent for
+    longer than the server's keepalive interval.
+    '''
+    parts = urlsplit(url)
+    con = http.client.HTTPConnection(parts.netloc, timeout=keepalive * 2)
+    try:
+        con.request('GET', parts.path, headers={'Accept': 'text/event-stream'})
+        resp = con.getresponse()
+        if resp.status != 200:
+            raise OSError(f'HTTP Error {resp.status}: {resp.reason}')
+        data: list[str] = []
+        while line := resp.readline():
+            line = line.decode().rstrip('\r\n')
+            if line.startswith('data:'):
+                data += [line.removeprefix('data:').strip()]
+            elif not line and data:
+                yield json.loads('\n'.join(data))
+                data = []
+        raise OSError('Event stream closed')
+    except http.client.HTTPException as e:
+        raise OSError(f'{e.__class__.__name__}: {e}') from e
+    finally:
+        con.close()
+
+def fetch_io_archive(url: str, dest_dir: str | Path, timeout: float = 60) -> list[Path]:
+    '''
+    Downloads the archived segments of the IO database of the server at url
+    that are not already in dest_dir, and the current segment io.db. Archived
+    segments never change so only new ones are transferred, and a download
+    that was interrupted continues where it stopped. Returns the new files.
+    '''
+    dest = Path(dest_dir)
+    dest.mkdir(parents=True, exist_ok=True)
+    url = url.rstrip('/')
+    with urlopen(f'{url}/io-archive', timeout=timeout) as resp:
+        segments = json.loads(resp.read())
+    res: list[Path] = []
+    for segment in segments:
+        path = dest / segment['name']
+        if path.exists() and path.stat().st_size == segment['size']:
+            continue
+        part = path.with_name(path.name + '.part')
+        offset = part.stat().st_size if part.exists() else 0
+        if offset >= segment['size']:
+            offset = 0
+        req = Request(f'{url}/io-archive/{segment["name"]}', headers={'Range': f'bytes={offset}-'})
+        with urlopen(req, timeout=timeout) as resp:
+            mode = 'ab' if resp.status == 206 else 'wb'
+            with open(part, mode) as fp:
+                shutil.copyfileobj(resp, fp, 1024 * 1024)
+        part.replace(path)
+        res += [path]
+    with urlopen(f'{url}/io.db', timeout=timeout) as resp:
+        path = dest / 'io.db'
+        with open(path.with_name('io.db.part'), 'wb') as fp:
+            shutil.copyfileobj(resp, fp, 1024 * 1024)
+        path.with_name('io.db.part').replace(path)
+        res += [path]
+    return res
+
+def test_pool():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        def do_POST(self):
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            body = json.dumps({'value': data, 'port': self.client_address[1]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format: str, *args: Any):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        pool = get_pool(f'http://127.0.0.1:{server.server_port}/')
+        ress = [pool.post_json('/echo', i, timeout=10) for i in range(5)]
+        assert [res['value'] for res in ress] == list(range(5))
+        assert len({res['port'] for res in ress}) == 1
+        assert pool.num_connects == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+    try:
+        # nothing listens on port 1
+        Pool('127.0.0.1:1').post_json('/echo', {}, timeout=1, retries=2, backoff=0.01)
+        raise AssertionError('expected error')
+    except OSError:
+        pass
+
+def test_pool_closed_by_server(monkeypatch: Any):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    calls: list[Any] = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        def do_POST(self):
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            calls.append(data)
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            # closes the connection without telling the client
+            self.close_connection = True
+        def log_message(self, format: str, *args: Any):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # as if the server closes each connection right after it was checked
+        def is_dropped(sock: Any) -> bool:
+            return False
+        monkeypatch.setattr(f'{__name__}.is_dropped', is_dropped)
+        pool = Pool(f'127.0.0.1:{server.server_port}')
+        assert [pool.post_json('/echo', i, timeout=10) for i in range(3)] == [0, 1, 2]
+        assert calls == [0, 1, 2]
+        assert pool.num_connects == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_remote():
+    from flask import Flask
+    from werkzeug.serving import make_server
+    from .machine import Echo
+
+    app = Flask(__name__)
+    Echo().routes('echo', app)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        echo = Echo.remote('echo', f'http://127.0.0.1:{server.server_port}', skip_up_check=False, timeout_secs=10)
+        for i in range(3):
+            assert echo.echo(str(i)) == f"echo ('{i}',) {{}}"
+        assert echo.lock_status()['ready']
+        try:
+            echo.error('x')
+            raise AssertionError('expected error')
+        except ValueError as e:
+            assert 'error' in str(e)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_progress_events():
+    from flask import Flask
+    from werkzeug.serving import make_server
+    from .machine import Machine, Cell, progress_events
+
+    @dataclass(frozen=True)
+    class Counter(Machine):
+        count: Cell[int] = field(default_factory=lambda: Cell(0))
+        def progress(self) -> dict[str, int]:
+            return {'count': self.count.value}
+
+    counter = Counter()
+    counter.progress_feed.interval = 60
+    app = Flask(__name__)
+    counter.routes('counter', app)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        remote = Counter.remote('counter', f'http://127.0.0.1:{server.server_port}', skip_up_check=False, timeout_secs=10)
+        events = progress_events(remote, keepalive=1)
+        assert next(events) == {'count': 0}
+        counter.count.value = 1
+        counter.publish_progress()
+        assert next(events) == {'count': 1}
+        # nothing is sent when it has not changed
+        counter.publish_progress({'count': 1})
+        counter.publish_progress({'count': 2})
+        assert next(events) == {'count': 2}
+        events.close()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -4,7 +4,7 @@ from datetime import datetime
 # from hashlib import sha256
 from typing import *
 import typing_extensions as tx
-from .machine import Machine
+from .machine import Machine, idempotent
 from dataclasses import *
 import base64
 
@@ -50,6 +50,7 @@ class DirList(Machine):
     def root(self) -> Path:
         return Path(self.root_dir)
 
+    @idempotent
     def list(self) -> List[PathInfo]:
         value: List[PathInfo] = []
         for ext in self.exts:
@@ -67,6 +68,7 @@ class DirList(Machine):
                 ]
         return value
 
+    @idempotent
     def read_files(self, subdir: str) -> List[ReadFile]:
         value: List[ReadFile] = []
         for ext in self.exts:
@@ -11,7 +11,7 @@ from threading import Thread, RLock
 
 import time
 
-from .machine import Machine, Cell
+from .machine import Machine, Cell, idempotent
 from .sqlitecell import SqliteCell
 from .log import Log
 
@@ -83,6 +83,7 @@ class STX(Machine):
                 log(str(e))
             time.sleep(60.0)
 
+    @idempotent
     def get_climate(self):
         '''
         Gets the current climate without blocking the device.
@@ -95,6 +96,7 @@ class STX(Machine):
         '''
         return self.current_climate.value
 
+    @idempotent
     def get_target_climate(self) -> dict[str, float]:
         '''
         temp:  target temperature in °C.
@@ -148,6 +150,7 @@ class STX(Machine):
         level = int(pos[1:])
         return slot, level
 
+    @idempotent
     def get_status(self) -> dict[str, bool]:
         response = self.call("STX2GetSysStatus")
         response = int(response)
@@ -271,6 +274,7 @@ class Fridge(STX):
             with db.exclusive():
                 yield db
 
+    @idempotent
     def contents(self) -> FridgeSlots:
         '''
         Returns a listing of the fridge contents.
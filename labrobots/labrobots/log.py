@@ -1,10 +1,32 @@
+'''
+The IO log io.db.
+
+Messages are put on a queue and written by one background thread with its
+own connection, in one transaction per group of queued messages. Logging
+never waits for the database, so the threads talking to the instruments
+are not held up by it. If the queue is full the message is still printed
+but it is not written to io.db, and the number of dropped messages is logged
+when there is room again.
+
+io.db only holds the recent messages, older ones are in the compressed
+segments in io-archive, see LogWriter.
+'''
 from __future__ import annotations
 from typing import *
 from dataclasses import *
 
-import sqlite3
-import json
+from datetime import datetime
+from pathlib import Path
+import atexit
 import contextlib
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import threading
 
 def try_json_dumps(s: Any) -> str:
     try:
@@ -12,6 +34,314 @@ def try_json_dumps(s: Any) -> str:
     except:
         return json.dumps({'repr': repr(s)})
 
+@dataclass
+class LogId:
+    '''
+    The id of the messages of one Log in io.db. It is assigned by the writer
+    thread when the first message is written, from the io_next_id table in the
+    same transaction as the message, since several processes can write to io.db.
+    '''
+    name: str
+    id: int | None = None
+
+@dataclass
+class LogWriter:
+    '''
+    The log is written to the current segment io.db. When it grows larger
+    than max_size, or its first message is older than max_age_secs, it is
+    moved to the archive directory and compressed, and a new io.db is
+    started. Archived segments are named by the times of their first and
+    last message and never change after that.
+
+    Several processes can write to io.db. Each write holds the rotation lock
+    shared and rotation holds it exclusively, so that no process writes to a
+    segment that is being archived. A writer that finds that io.db has been
+    replaced by another process reconnects to the new one.
+    '''
+    path: str = 'io.db'
+    archive_dir: str = 'io-archive'
+    max_size: int = 64 * 1024 * 1024
+    max_age_secs: float = 7 * 24 * 3600
+    max_queued: int = 10000
+    max_group: int = 1000
+
+    queue: queue.Queue[tuple[str, LogId, str] | threading.Event | None] = field(init=False)
+    segment_start: str | None = None
+    ino: int | None = None
+    num_dropped: int = 0
+    thread: threading.Thread | None = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self):
+        self.queue = queue.Queue(self.max_queued)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                # the paths are fixed now in case the working directory changes later
+                self.path = str(Path(self.path).resolve())
+                self.archive_dir = str(Path(self.path).parent / self.archive_dir)
+                Path(self.archive_dir).mkdir(parents=True, exist_ok=True)
+                lock = self.connect_lock('rotate.lock')
+                with locked(lock):
+                    con = self.connect()
+                self.thread = threading.Thread(target=self.run, args=(con, lock), name='io.db writer', daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+                # segments left uncompressed when the previous process stopped
+                threading.Thread(target=self.compress_segments, daemon=True).start()
+
+    def connect_lock(self, name: str, timeout: float = 60.0) -> sqlite3.Connection:
+        '''
+        A lock shared between processes, see locked.
+        '''
+        lock = sqlite3.connect(Path(self.archive_dir) / name, timeout=timeout, isolation_level=None, check_same_thread=False)
+        lock.execute('create table if not exists lock (x)')
+        return lock
+
+    def connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        con.executescript('''
+            pragma synchronous=OFF;
+            pragma journal_mode=WAL;
+            create table if not exists io (
+                t     timestamp default (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+                name  text,
+                id    int,
+                data  json
+            );
+            create index if not exists io_name_id on io(name, id);
+            create index if not exists io_t on io(t);
+            create table if not exists io_next_id (
+                name  text primary key,
+                id    int
+            );
+        ''')
+        [self.segment_start] = con.execute('select min(t) from io').fetchone()
+        self.ino = os.stat(self.path).st_ino
+        return con
+
+    def replaced(self) -> bool:
+        '''
+        True if io.db has been archived by another process since it was connected to.
+        '''
+        try:
+            return os.stat(self.path).st_ino != self.ino
+        except FileNotFoundError:
+            return True
+
+    def put(self, log_id: LogId, data: str):
+        if self.thread is None:
+            self.start()
+        t = datetime.now().isoformat(sep=' ', timespec='milliseconds')
+        try:
+            self.queue.put_nowait((t, log_id, data))
+        except queue.Full:
+            with self.lock:
+                self.num_dropped += 1
+
+    def flush(self, timeout: float = 10.0):
+        '''
+        Waits until the messages logged so far have been written.
+        '''
+        if self.thread is None:
+            return
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self, timeout: float = 10.0):
+        '''
+        Writes the remaining messages and closes the connection.
+        '''
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        atexit.unregister(self.close)
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def allocate_id(self, con: sqlite3.Connection, log_id: LogId, allocated: list[LogId]) -> int:
+        '''
+        Must be called in the write transaction. The ids allocated are added
+        to allocated so that they can be cleared if the transaction is rolled back.
+        '''
+        if log_id.id is not None:
+            return log_id.id
+        name = log_id.name
+        [id] = con.execute('''
+            select max(
+                ifnull((select max(id) + 1 from io where name = ?), 0),
+                ifnull((select id from io_next_id where name = ?), 0)
+            )
+        ''', [name, name]).fetchone()
+        con.execute('insert or replace into io_next_id (name, id) values (?, ?)', [name, id + 1])
+        log_id.id = id
+        allocated.append(log_id)
+        return id
+
+    def should_rotate(self, con: sqlite3.Connection) -> bool:
+        if self.segment_start is None:
+            return False
+        [[page_count]] = con.execute('pragma page_count')
+        [[page_size]] = con.execute('pragma page_size')
+        if page_count * page_size > self.max_size:
+            return True
+        age = datetime.now() - datetime.fromisoformat(self.segment_start)
+        return age.total_seconds() > self.max_age_secs
+
+    def rotate(self, con: sqlite3.Connection, lock: sqlite3.Connection) -> sqlite3.Connection:
+        '''
+        Archives the current segment and returns a connection to a new one.
+        The next ids are carried over so that ids are not reused.
+        '''
+        with locked(lock, exclusive=True):
+            if self.replaced():
+                # already archived by another process
+                con.close()
+                return self.connect()
+            con = self.archive(con)
+        threading.Thread(target=self.compress_segments, daemon=True).start()
+        return con
+
+    def archive(self, con: sqlite3.Connection) -> sqlite3.Connection:
+        [(first, last)] = con.execute('select min(t), max(t) from io')
+        next_ids = con.execute('''
+            select name, max(id) from (
+                select name, max(id) + 1 as id from io group by name
+                union all
+                select name, id from io_next_id
+            ) group by name
+        ''').fetchall()
+        con.execute('pragma wal_checkpoint(truncate)')
+        con.close()
+        name = f'io-{segment_stamp(first)}-{segment_stamp(last)}'
+        archived = Path(self.archive_dir) / f'{name}.db'
+        i = 0
+        while archived.exists() or archived.with_name(archived.name + '.gz').exists():
+            i += 1
+            archived = Path(self.archive_dir) / f'{name}_{i}.db'
+        archived.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(self.path, archived)
+        except OSError as e:
+            # on windows this fails while a reader has the file open, it is tried again after the next write
+            print(f'io.db writer: could not archive segment: {e!r}')
+            return self.connect()
+        con = self.connect()
+        con.executemany('insert or replace into io_next_id (name, id) values (?, ?)', next_ids)
+        return con
+
+    def compress_segments(self):
+        '''
+        Compresses the archived segments that are not compressed yet. One
+        process at a time does this, under its own lock so that writing
+        is not held up meanwhile.
+        '''
+        with contextlib.closing(self.connect_lock('compress.lock', timeout=600.0)) as lock:
+            with locked(lock, exclusive=True):
+                for p in sorted(Path(self.archive_dir).glob('io-*.db')):
+                    compress_segment(p)
+
+    def segments(self, since: str = '') -> list[dict[str, Any]]:
+        '''
+        The compressed archived segments with messages from since or later, oldest first.
+        '''
+        res: list[dict[str, Any]] = []
+        for p in sorted(Path(self.archive_dir).glob('io-*.db.gz')):
+            _, first, last = p.name.removesuffix('.db.gz').split('-')
+            if last >= segment_stamp(since):
+                res.append({'name': p.name, 'size': p.stat().st_size, 'first': first, 'last': last})
+        return res
+
+    def run(self, con: sqlite3.Connection, lock: sqlite3.Connection):
+        while True:
+            group = [self.queue.get()]
+            while len(group) < self.max_group and group[-1] is not None:
+                try:
+                    group.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in group if isinstance(item, tuple)]
+            with self.lock:
+                num_dropped, self.num_dropped = self.num_dropped, 0
+            if num_dropped:
+                t = datetime.now().isoformat(sep=' ', timespec='milliseconds')
+                msg = f'io.db writer: dropped {num_dropped} messages since the queue was full'
+                items.append((t, LogId('system'), try_json_dumps({'msg': msg, 'num_dropped': num_dropped})))
+            allocated: list[LogId] = []
+            try:
+                if items:
+                    with locked(lock):
+                        if self.replaced():
+                            con.close()
+                            con = self.connect()
+                        # immediate takes the write lock before the ids are read
+                        con.execute('begin immediate')
+                        rows = [
+                            (t, log_id.name, self.allocate_id(con, log_id, allocated), data)
+                            for t, log_id, data in items
+                        ]
+                        con.executemany('insert into io (t, name, id, data) values (?, ?, ?, json(?));', rows)
+                        con.execute('commit')
+                    if self.segment_start is None:
+                        self.segment_start = rows[0][0]
+                if self.should_rotate(con):
+                    con = self.rotate(con, lock)
+            except Exception as e:
+                print(f'io.db writer: {e!r}, {len(items)} messages not written')
+                if con.in_transaction:
+                    con.execute('rollback')
+                for log_id in allocated:
+                    log_id.id = None
+            for item in group:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if group[-1] is None:
+                con.close()
+                lock.close()
+                return
+
+def segment_stamp(t: str) -> str:
+    '''
+    The digits of a timestamp: 2023-05-01 12:34:56.789 becomes 20230501123456789.
+    '''
+    return re.sub(r'\D', '', t)
+
+@contextlib.contextmanager
+def locked(lock: sqlite3.Connection, exclusive: bool = False) -> Generator[None, None, None]:
+    '''
+    Holds the lock of a sqlite database used only for locking, which works
+    between processes on all platforms. Shared holders exclude an exclusive
+    holder, and the lock is released if the process dies.
+    '''
+    if exclusive:
+        lock.execute('begin exclusive')
+    else:
+        lock.execute('begin')
+        lock.execute('select count(*) from lock').fetchone()
+    try:
+        yield
+    finally:
+        lock.execute('commit')
+
+def compress_segment(path: Path):
+    gz = path.with_name(path.name + '.gz')
+    tmp = path.with_name(path.name + '.gz.tmp')
+    with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, gz)
+    path.unlink()
+
+default_writer = LogWriter()
+
 @dataclass(frozen=True)
 class Log:
     _log: Callable[..., None]
@@ -26,50 +356,103 @@ class Log:
             return Log(lambda *args, **kws: None)
 
     @classmethod
-    def make(cls, name: str, xs: List[str] | None = None, stdout: bool=True) -> Log:
-        with contextlib.closing(sqlite3.connect('io.db')) as con:
-            con.executescript('''
-                pragma synchronous=OFF;
-                pragma journal_mode=WAL;
-                create table if not exists io (
-                    t     timestamp default (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
-                    name  text,
-                    id    int,
-                    data  json
-                );
-                create index if not exists io_name_id on io(name, id);
-            ''')
-        id: None | int = None
+    def make(cls, name: str, xs: List[str] | None = None, stdout: bool=True, writer: LogWriter=default_writer) -> Log:
+        log_id = LogId(name)
         def log(*args: Any, **kwargs: Any):
-            nonlocal id
             msg = ' '.join(map(str, args))
             if msg:
                 if stdout:
                     print(f'{name}:', msg)
                 if xs is not None:
                     xs.append(msg)
-            with contextlib.closing(sqlite3.connect('io.db', isolation_level=None)) as con:
-                con.executescript('''
-                    pragma synchronous=OFF;
-                    pragma journal_mode=WAL;
-                ''')
-                if msg:
-                    data = {'msg': msg, **kwargs}
-                else:
-                    data = kwargs
-                needs_commit = False
-                if id is None:
-                    con.execute('begin exclusive')
-                    [id] = con.execute('select ifnull(max(id) + 1, 0) from io where name = ?', [name]).fetchone()
-                    needs_commit = True
-                con.execute(
-                    'insert into io (name, id, data) values (?, ?, json(?));',
-                    [name, id, try_json_dumps(data)],
-                )
-                if needs_commit:
-                    con.execute('commit')
+                data = {'msg': msg, **kwargs}
+            else:
+                data = kwargs
+            writer.put(log_id, try_json_dumps(data))
         return Log(log)
 
 system_default_log = Log.make('system')
 
+def test_log_writer(tmp_path: Any):
+    path = tmp_path / 'io.db'
+    writer = LogWriter(str(path))
+    a = Log.make('a', stdout=False, writer=writer)
+    b = Log.make('b', stdout=False, writer=writer)
+    a('x', k=1)
+    b('y')
+    writer.flush()
+    a2 = Log.make('a', stdout=False, writer=writer)
+    a2('z')
+    a('w')
+    writer.close()
+    with contextlib.closing(sqlite3.connect(path)) as con:
+        rows = con.execute("select name, id, json_extract(data, '$.msg') from io order by rowid").fetchall()
+    assert rows == [('a', 0, 'x'), ('b', 0, 'y'), ('a', 1, 'z'), ('a', 0, 'w')]
+
+    # a new writer continues from the ids in the database
+    writer = LogWriter(str(path))
+    Log.make('a', stdout=False, writer=writer)('v')
+    writer.close()
+    assert not Path(str(path) + '-wal').exists()
+    with contextlib.closing(sqlite3.connect(path)) as con:
+        [id] = con.execute("select id from io where json_extract(data, '$.msg') = 'v'").fetchone()
+    assert id == 2
+
+def test_log_writer_processes(tmp_path: Any):
+    # writers of different processes share io.db
+    path = str(tmp_path / 'io.db')
+    w1 = LogWriter(path)
+    w2 = LogWriter(path)
+    ids: list[int | None] = []
+    for writer in [w1, w2, w1, w2]:
+        log_id = LogId('a')
+        writer.put(log_id, '{}')
+        writer.flush()
+        ids.append(log_id.id)
+    w1.close()
+    w2.close()
+    assert ids == [0, 1, 2, 3]
+
+def test_log_rotation(tmp_path: Any):
+    import time
+    writer = LogWriter(str(tmp_path / 'io.db'), max_size=0)
+    a = Log.make('a', stdout=False, writer=writer)
+    for msg in ['x', 'y']:
+        a(msg)
+        writer.flush()
+    Log.make('a', stdout=False, writer=writer)('z')
+    writer.close()
+    segments: list[dict[str, Any]] = []
+    for _ in range(100):
+        if len(segments := writer.segments()) == 3:
+            break
+        time.sleep(0.05)
+    assert len(segments) == 3
+    assert writer.segments(since='9999') == []
+    rows: list[tuple[int, str]] = []
+    for segment in segments:
+        db = tmp_path / 'segment.db'
+        db.write_bytes(gzip.decompress((tmp_path / 'io-archive' / segment['name']).read_bytes()))
+        with contextlib.closing(sqlite3.connect(db)) as con:
+            rows += con.execute("select id, json_extract(data, '$.msg') from io").fetchall()
+    assert rows == [(0, 'x'), (0, 'y'), (1, 'z')]
 
+def test_log_rotation_processes(tmp_path: Any):
+    # writers of different processes rotate the io.db they share
+    w1 = LogWriter(str(tmp_path / 'io.db'), max_size=0)
+    w2 = LogWriter(str(tmp_path / 'io.db'), max_size=0)
+    for i in range(5):
+        for w in [w1, w2]:
+            Log.make('a', stdout=False, writer=w)(str(i))
+            w.flush()
+    w1.close()
+    w2.close()
+    w1.compress_segments()
+    msgs: list[str] = []
+    for segment in w1.segments():
+        db = tmp_path / 'segment.db'
+        db.write_bytes(gzip.decompress((tmp_path / 'io-archive' / segment['name']).read_bytes()))
+        with contextlib.closing(sqlite3.connect(db)) as con:
+            msgs += [msg for [msg] in con.execute("select json_extract(data, '$.msg') from io")]
+    assert sorted(msgs) == sorted(str(i) for i in range(5) for _ in [w1, w2])
+    assert list(Path(w1.archive_dir).glob('io-*.db')) == []
@@ -4,7 +4,6 @@ from dataclasses import *
 
 from datetime import datetime
 from threading import RLock
-from urllib.request import urlopen, Request
 import contextlib
 import inspect
 import json
@@ -12,14 +11,28 @@ import textwrap
 import time
 import traceback as tb
 import threading
+from urllib.parse import urlsplit
 
 from flask import jsonify, request
 import flask
 
 from .log import Log, try_json_dumps, system_default_log
+from .client import get_pool, subscribe
 
 R = TypeVar('R')
 A = TypeVar('A')
+F = TypeVar('F', bound=Callable[..., Any])
+
+def idempotent(fn: F) -> F:
+    '''
+    Marks a command that only reads the state of the machine. Remote calls to
+    it are retried if they fail since it does not matter if it was run twice.
+    '''
+    fn.idempotent = True # type: ignore
+    return fn
+
+def is_idempotent(cls: Type[Machine], cmd: str) -> bool:
+    return cmd == 'up?' or getattr(getattr(cls, cmd, None), 'idempotent', False)
 
 def try_json_loads(s: str) -> Any:
     try:
@@ -51,6 +64,8 @@ class Proxy(Generic[R]):
     wrapped: Callable[..., R]
     call: Callable[..., Any]
     attr_path: list[str] = field(default_factory=list)
+    host: str = ''
+    name: str = ''
 
     def __getattr__(self, name: str) -> Proxy[R]:
         return replace(self, attr_path=[*self.attr_path, name])
@@ -58,6 +73,25 @@ class Proxy(Generic[R]):
     def __call__(self, *args: Any, **kwargs: Any) -> Proxy[R]:
         return self.call(self.attr_path, *args, **kwargs)
 
+def has_progress(machine: Any) -> bool:
+    '''
+    If machine is a remote machine whose class overrides Machine.progress.
+    Machines served by other programs, such as squid, have no event stream.
+    '''
+    return (
+        isinstance(machine, Proxy)
+        and bool(machine.name)
+        and getattr(machine.wrapped, 'progress', Machine.progress) is not Machine.progress
+    )
+
+def progress_events(machine: Any, keepalive: float = 15.0) -> Generator[Any, None, None]:
+    '''
+    The progress of a remote machine each time it changes, see Machine.progress.
+    '''
+    if not has_progress(machine):
+        raise ValueError(f'Only remote machines that override progress have progress events, not {machine!r}')
+    return subscribe(f'{machine.host.rstrip("/")}/{machine.name}/events', keepalive=keepalive)
+
 @dataclass(frozen=False)
 class ExclusiveLock:
     '''
@@ -97,6 +131,74 @@ class Cell(Generic[A]):
     '''
     value: A
 
+@dataclass
+class Feed:
+    '''
+    The latest value of a changing status, such as the progress of a machine.
+    Subscribers get the current value and then every change to it. While there
+    are subscribers the value is read with get every interval seconds, and
+    publish can be used to send a change right away.
+    '''
+    get: Callable[[], Any]
+    interval: float = 0.5
+    cond: threading.Condition = field(default_factory=threading.Condition)
+    value: Any = None
+    version: int = 0
+    num_subscribers: int = 0
+    polling: bool = False
+
+    def publish(self, value: Any):
+        with self.cond:
+            if self.version == 0 or value != self.value:
+                self.value = value
+                self.version += 1
+                self.cond.notify_all()
+
+    def read(self):
+        try:
+            value = self.get()
+        except Exception as e:
+            # the subscribers keep the last value
+            print(f'Feed: {e!r}')
+            return
+        self.publish(value)
+
+    def poll(self):
+        while True:
+            time.sleep(self.interval)
+            with self.cond:
+                if self.num_subscribers == 0:
+                    self.polling = False
+                    return
+            self.read()
+
+    def subscribe(self, keepalive: float = 15.0) -> Generator[str, None, None]:
+        '''
+        The values as server-sent events. A comment is sent when nothing has
+        changed in keepalive seconds so that closed connections are noticed.
+        '''
+        with self.cond:
+            self.num_subscribers += 1
+            start = not self.polling
+            self.polling = True
+        try:
+            if start:
+                self.read()
+                threading.Thread(target=self.poll, daemon=True).start()
+            version = 0
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.version != version, timeout=keepalive)
+                    changed = self.version != version
+                    version, value = self.version, self.value
+                if changed:
+                    yield f'data: {try_json_dumps(value)}\n\n'
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            with self.cond:
+                self.num_subscribers -= 1
+
 T = TypeVar('T', bound='Machine')
 
 class Status(TypedDict):
@@ -107,10 +209,32 @@ class Status(TypedDict):
 class Machine:
     log_cell: Cell[Log] = field(default_factory=lambda: Cell(Machine.default_log), repr=False)
     exclusive_lock: ExclusiveLock = field(default_factory=ExclusiveLock, repr=False)
+    progress_feed: Feed = field(default_factory=lambda: Feed(lambda: None), repr=False)
+
+    def __post_init__(self):
+        self.progress_feed.get = self.progress
 
     def init(self):
         pass
 
+    def progress(self) -> Any:
+        '''
+        The progress of what the machine is doing, served as a stream of
+        changes on /<name>/events. Machines with long running jobs override
+        this, and can call publish_progress to send a change right away.
+        '''
+        return None
+
+    def publish_progress(self, value: Any | None = None):
+        '''
+        Sends the progress to subscribers now if it has changed. Without a value it is read with progress.
+        '''
+        if value is None:
+            self.progress_feed.read()
+        else:
+            self.progress_feed.publish(value)
+
+    @idempotent
     def lock_status(self) -> Status:
         return {
             'ready': not self.exclusive_lock.is_taken(),
@@ -169,7 +293,7 @@ class Machine:
                 continue
             if name.startswith('_'):
                 continue
-            if name in 'init help remote routes timeit default_log log exclusive'.split():
+            if name in 'init help remote routes handle_call timeit default_log log exclusive progress publish_progress'.split():
                 continue
             sig = inspect.signature(fn)
             doc = fn.__doc__ or ""
@@ -188,6 +312,46 @@ class Machine:
             self.log(f'{T/1e6:.1f}ms {desc}', secs=T/1e9)
         return worker()
 
+    def handle_call(self, name: str, cmd: str, *args: Any, **kwargs: Any) -> dict[str, Any]:
+        '''
+        Runs a command called remotely on this machine, which is served as name.
+        Needs a flask app context for the log.
+        '''
+        xs: List[str] = []
+        flask.g.log = Log.make(name, xs)
+        data = dict(cmd=cmd, args=args) | kwargs
+        sig = make_sig(cmd, *args, **kwargs)
+        self.log(sig, **data, type='call')
+        try:
+            if cmd == 'lock_status':
+                # ok to call remotely
+                pass
+            elif cmd in Machine.__dict__.keys() or cmd.startswith('_') or cmd == 'init':
+                raise ValueError(f'Cannot call {cmd!r} on {name} remotely')
+            if cmd == 'up?':
+                return {'value': True}
+            fn = getattr(self, cmd, None)
+            if fn is None:
+                raise ValueError(f'No such command {cmd} on {name}')
+            with self.timeit(sig):
+                value = fn(*args, **kwargs)
+            if value is None:
+                self.log('return', **data, type='return', value=small(value))
+            else:
+                self.log('return', repr(small(value)), **data, type='return', value=small(value))
+            return {
+                'value': value,
+                'log': xs,
+            }
+        except Exception as e:
+            for line in tb.format_exc().splitlines():
+                self.log(line)
+            self.log(**data, type='error', error=repr(e))
+            return {
+                'error': repr(e),
+                'log': xs,
+            }
+
     def routes(self, name: str, app: Any):
         from itertools import count
         unique = count(1).__next__
@@ -195,40 +359,7 @@ class Machine:
             return f'{name}{unique()}'
 
         def call(cmd: str, *args: Any, **kwargs: Any):
-            xs: List[str] = []
-            flask.g.log = Log.make(name, xs)
-            data = dict(cmd=cmd, args=args) | kwargs
-            sig = make_sig(cmd, *args, **kwargs)
-            self.log(sig, **data, type='call')
-            try:
-                if cmd == 'lock_status':
-                    # ok to call remotely
-                    pass
-                elif cmd in Machine.__dict__.keys() or cmd.startswith('_') or cmd == 'init':
-                    raise ValueError(f'Cannot call {cmd!r} on {name} remotely')
-                if cmd == 'up?':
-                    return {'value': True}
-                fn = getattr(self, cmd, None)
-                if fn is None:
-                    raise ValueError(f'No such command {cmd} on {name}')
-                with self.timeit(sig):
-                    value = fn(*args, **kwargs)
-                if value is None:
-                    self.log('return', **data, type='return', value=small(value))
-                else:
-                    self.log('return', repr(small(value)), **data, type='return', value=small(value))
-                return {
-                    'value': value,
-                    'log': xs,
-                }
-            except Exception as e:
-                for line in tb.format_exc().splitlines():
-                    self.log(line)
-                self.log(**data, type='error', error=repr(e))
-                return {
-                    'error': repr(e),
-                    'log': xs,
-                }
+            return self.handle_call(name, cmd, *args, **kwargs)
 
         @app.get(f'/{name}/', endpoint=make_endpoint_name()) # type: ignore
         @app.get(f'/{name}', endpoint=make_endpoint_name()) # type: ignore
@@ -243,6 +374,14 @@ class Machine:
                     url = url[:-1]
                 return jsonify({url + '/' + name: doc for name, doc in self.help().items()})
 
+        @app.get(f'/{name}/events', endpoint=make_endpoint_name()) # type: ignore
+        def events():
+            return flask.Response(
+                self.progress_feed.subscribe(),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache'},
+            )
+
         @app.get(f'/{name}/<string:cmd>', endpoint=make_endpoint_name()) # type: ignore
         def get0(cmd: str):
             return jsonify(call(cmd, **json_request_args()))
@@ -272,26 +411,26 @@ class Machine:
             return jsonify(call(cmd, **req))
 
     @classmethod
-    def remote(cls: Type[T], name: str, host: str, skip_up_check: bool, timeout_secs: int=10 * 60) -> T:
+    def remote(cls: Type[T], name: str, host: str, skip_up_check: bool, timeout_secs: int=10 * 60, retries: int=3) -> T:
+        '''
+        A proxy that calls the machine served at host. The calls use keep-alive
+        connections shared by all machines at the host. Calls to idempotent
+        commands are retried this many times if they fail.
+        '''
+        pool = get_pool(host)
         def call(attr_path: list[str], *args: Any, **kwargs: Any) -> Any:
             assert len(attr_path) == 1
             cmd = attr_path[0]
-            url = host.rstrip('/') + '/' + name
+            path = urlsplit(host).path.rstrip('/') + '/' + name
             data = {
                 'cmd': cmd,
                 'args': list(args),
                 'kwargs': kwargs,
             }
-            # print(url)
-            req = Request(
-                url,
-                data=json.dumps(data).encode(),
-                headers={'Content-type': 'application/json'},
-            )
             # from pprint import pp
-            # pp((url, data, '...'))
+            # pp((host, path, data, '...'))
             try:
-                res = json.loads(urlopen(req, timeout=timeout_secs).read())
+                res = pool.post_json(path, data, timeout=timeout_secs, retries=retries if is_idempotent(cls, cmd) else 0)
             except OSError as e:
                 raise OSError(f'{name}: Communication error. {getattr(e, "reason", str(e))}')
             # pp((url, data, '=', res))
@@ -303,7 +442,7 @@ class Machine:
                 raise ValueError(f'{name}: Communication error. {res}')
         if not skip_up_check:
             assert call(['up?'])
-        return Proxy(cls, call) # type: ignore
+        return Proxy(cls, call, host=host, name=name) # type: ignore
 
 @dataclass(frozen=True)
 class Echo(Machine):
@@ -2,15 +2,21 @@ from __future__ import annotations
 from typing import *
 from dataclasses import *
 
+from concurrent.futures import Future
 from pathlib import Path
+from urllib.parse import urlsplit
 import contextlib
+import json
 import sqlite3
 import platform
+import threading
 
 from flask import Flask, jsonify, request
 import flask
 
-from .machine import Machine, Echo, json_request_args
+from .machine import Machine, Echo, Proxy, json_request_args, is_idempotent
+from .client import get_pool
+from .log import default_writer
 from .git import Git
 
 T = TypeVar('T', bound='Machines')
@@ -53,11 +59,90 @@ class Machines:
     def items(self) -> list[tuple[str, Machine]]:
         return list(self.__dict__.items())
 
-    def serve(self, host: str | None = None, port: int = 5050):
+    @contextlib.contextmanager
+    def batch(self, timeout_secs: int=10 * 60, sequential: bool=False) -> Generator[Any, None, None]:
+        '''
+        Collects the calls to these remote machines in the with block and sends
+        them in one request when it ends. The calls return futures with their results.
+
+            with WindowsNUC.remote().batch() as nuc:
+                paths = nuc.dir_list.list()
+                status = nuc.incu.get_status()
+            print(paths.result(), status.result())
+
+        The server runs the calls to each machine in order and the calls to
+        different machines concurrently, or all of them in order if sequential.
+        '''
+        hosts = {m.host for _, m in self.items() if isinstance(m, Proxy)}
+        if len(hosts) != 1:
+            raise ValueError('Only calls to remote machines can be batched')
+        [host] = hosts
+        calls: list[tuple[dict[str, Any], Future[Any]]] = []
+        retry = True
+        def collect(name: str, cls: Type[Machine]):
+            def call(attr_path: list[str], *args: Any, **kwargs: Any) -> Future[Any]:
+                nonlocal retry
+                assert len(attr_path) == 1
+                cmd = attr_path[0]
+                retry = retry and is_idempotent(cls, cmd)
+                future = Future[Any]()
+                calls.append(({'machine': name, 'cmd': cmd, 'args': list(args), 'kwargs': kwargs}, future))
+                return future
+            return Proxy(cls, call, host=host)
+        d = {
+            f.name: collect(f.name, f.default.__class__) # type: ignore
+            for f in fields(self)
+        }
+        try:
+            yield cast(Any, self.__class__)(**d)
+        except:
+            for _, future in calls:
+                future.cancel()
+            raise
+        if not calls:
+            return
+        path = urlsplit(host).path.rstrip('/') + '/batch'
+        data = {'calls': [c for c, _ in calls], 'sequential': sequential}
+        try:
+            results = get_pool(host).post_json(path, data, timeout=timeout_secs, retries=3 if retry else 0)
+        except OSError as e:
+            error = OSError(f'batch: Communication error. {getattr(e, "reason", str(e))}')
+            for _, future in calls:
+                future.set_exception(error)
+            raise error
+        for (c, future), res in zip(calls, results):
+            if 'value' in res:
+                future.set_result(res['value'])
+            elif 'error' in res:
+                future.set_exception(ValueError(f'{c["machine"]}: Error. {res["error"]}'))
+            else:
+                future.set_exception(ValueError(f'{c["machine"]}: Communication error. {res}'))
+
+    def serve(self, host: str | None = None, port: int = 5050, threads: int = 0):
+        '''
+        Serves the machines with the flask development server, or with waitress
+        using this many threads if threads is positive. It runs in one process
+        since the machines own their connections to the instruments.
+        '''
         print('machines:')
         for k, v in self.items():
             print('    ' + k + ':', v)
 
+        app = self.make_app()
+
+        if host is None:
+            host = self.ip
+        if threads > 0:
+            try:
+                import waitress # type: ignore
+            except Exception as e:
+                print('Not using waitress:', str(e))
+            else:
+                waitress.serve(app, host=host, port=port, threads=threads)
+                return
+        app.run(host=host, port=port, threaded=True, processes=1)
+
+    def make_app(self) -> Flask:
         app = Flask(__name__)
         try:
             app.json.compact = False    # type: ignore
@@ -70,10 +155,42 @@ class Machines:
             m.init()
             m.routes(name, app)
 
+        @app.post('/batch') # type: ignore
+        def batch():
+            req = json.loads(request.data.decode())
+            calls: list[dict[str, Any]] = req['calls']
+            machines = dict(self.items())
+            results: list[dict[str, Any]] = [{} for _ in calls]
+            def run(indexes: list[int]):
+                # each thread needs its own app context for the log of the calls
+                with app.app_context():
+                    for i in indexes:
+                        c = calls[i]
+                        m = machines.get(c['machine'])
+                        if m is None:
+                            results[i] = {'error': repr(ValueError(f'No such machine {c["machine"]}')), 'log': []}
+                        else:
+                            results[i] = m.handle_call(c['machine'], c['cmd'], *c.get('args', []), **c.get('kwargs', {}))
+            groups: dict[str, list[int]] = {}
+            for i, c in enumerate(calls):
+                key = '' if req.get('sequential') else c['machine']
+                groups.setdefault(key, []).append(i)
+            threads = [
+                threading.Thread(target=run, args=(indexes,))
+                for indexes in groups.values()
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return jsonify(results)
+
         @app.route('/<string:name>.db')
         def get_db(name: str):
             assert name.isascii() and name.isidentifier()
             name_db = f'{name}.db'
+            if name == 'io':
+                default_writer.flush()
             with contextlib.closing(sqlite3.connect(name_db)) as con:
                 con.execute('pragma wal_checkpoint(full);')
                 return flask.send_file( # type: ignore
@@ -82,9 +199,28 @@ class Machines:
                     as_attachment=True
                 )
 
+        @app.get('/io-archive') # type: ignore
+        def io_archive():
+            since = str(json_request_args().get('since', ''))
+            return jsonify(default_writer.segments(since=since))
+
+        @app.get('/io-archive/<string:name>') # type: ignore
+        def io_archive_segment(name: str):
+            if not any(name == segment['name'] for segment in default_writer.segments()):
+                return f'No segment {name}\n', 404
+            # conditional responses support range requests so interrupted downloads can be resumed
+            return flask.send_file( # type: ignore
+                Path(default_writer.archive_dir).resolve() / name,
+                download_name=name,
+                as_attachment=True,
+                conditional=True,
+            )
+
         @app.route('/<string:name>.sql')
         def get_sql(name: str):
             assert name.isascii() and name.isidentifier()
+            if name == 'io':
+                default_writer.flush()
             with contextlib.closing(sqlite3.connect(f'{name}.db')) as con:
                 return '\n'.join(con.iterdump()) + '\n'
 
@@ -110,6 +246,7 @@ class Machines:
                     {select} from io {where} order by t desc limit {n}
                 ) order by t asc
             '''
+            default_writer.flush()
             with contextlib.closing(sqlite3.connect('io.db')) as con:
                 rows = ['row t name id data'.split()] + [
                     [str(x) for x in row]
@@ -134,12 +271,87 @@ class Machines:
             d: dict[str, str] = {}
             for name, m in self.items():
                 d[url + '/' + name] = str(m)
-            d[url + '/io.sql'] = 'Download the IO database as sqlite dump'
-            d[url + '/io.db'] = 'Download the IO database in binary sqlite'
+            d[url + '/io.sql'] = 'Download the recent IO database as sqlite dump'
+            d[url + '/io.db'] = 'Download the recent IO database in binary sqlite'
+            d[url + '/io-archive'] = 'List the archived segments of the IO database, optionally ?since=<time>'
+            d[url + '/io-archive/<name>'] = 'Download an archived segment of the IO database, gzipped sqlite'
             d[url + '/tail'] = 'Show last 10 lines from the IO database'
             d[url + '/tail/<N>'] = 'Show last N lines from the IO database'
+            d[url + '/batch'] = 'POST {"calls": [{"machine", "cmd", "args", "kwargs"}, ...]} to make many calls in one request'
             return jsonify(d)
 
-        if host is None:
-            host = self.ip
-        app.run(host=host, port=port, threaded=True, processes=1)
+        return app
+
+def test_batch():
+    from werkzeug.serving import make_server
+
+    @dataclass
+    class TestMachines(Machines):
+        ip = '127.0.0.1'
+        node_name = 'test-batch'
+        echo2: Echo = Echo()
+
+    server = make_server('127.0.0.1', 0, TestMachines().make_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        remote = TestMachines.remote(port=server.server_port, timeout_secs=10)
+        with remote.batch() as b:
+            a = b.echo.echo('a')
+            e = b.echo.error('e')
+            c = b.echo2.echo('c', k=1)
+            t = b.echo.sleep(0.1)
+            assert not a.done()
+        assert a.result() == "echo ('a',) {}"
+        assert c.result() == "echo ('c',) {'k': 1}"
+        assert t.result() is None
+        try:
+            e.result()
+            raise AssertionError('expected error')
+        except ValueError as err:
+            assert 'error' in str(err)
+        with remote.batch(sequential=True) as b:
+            xs = [b.echo2.echo(str(i)) for i in range(3)]
+        assert [x.result() for x in xs] == [f"echo ('{i}',) {{}}" for i in range(3)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_io_archive(tmp_path: Any, monkeypatch: Any):
+    import time
+    from werkzeug.serving import make_server
+    from . import machines
+    from .log import Log, LogWriter
+    from .client import fetch_io_archive
+
+    monkeypatch.chdir(tmp_path)
+    writer = LogWriter(max_size=0)
+    monkeypatch.setattr(machines, 'default_writer', writer)
+    log = Log.make('test', stdout=False, writer=writer)
+    for i in range(3):
+        log(str(i) * 1000)
+        writer.flush()
+    for _ in range(100):
+        if len(writer.segments()) == 3:
+            break
+        time.sleep(0.05)
+
+    server = make_server('127.0.0.1', 0, Machines().make_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{server.server_port}'
+        got = fetch_io_archive(url, tmp_path / 'fetched')
+        assert sorted(p.name for p in got) == sorted(['io.db', *(s['name'] for s in writer.segments())])
+        got = fetch_io_archive(url, tmp_path / 'fetched')
+        assert [p.name for p in got] == ['io.db']
+        # an interrupted download continues from where it stopped
+        first = tmp_path / 'fetched' / writer.segments()[0]['name']
+        data = first.read_bytes()
+        first.unlink()
+        first.with_name(first.name + '.part').write_bytes(data[:100])
+        got = fetch_io_archive(url, tmp_path / 'fetched')
+        assert [p.name for p in got] == [first.name, 'io.db']
+        assert first.read_bytes() == data
+    finally:
+        server.shutdown()
+        server.server_close()
+        writer.close()
@@ -10,7 +10,7 @@ import contextlib
 
 from subprocess import Popen
 
-from .machine import Machine, Cell
+from .machine import Machine, Cell, idempotent
 
 from hashlib import sha256
 from pathlib import Path
@@ -63,6 +63,7 @@ class NikonNIS(Machine):
             t.start()
             while self.current_process.value is None:
                 time.sleep(0.1)
+        self.publish_progress()
 
     def StgMoveZ(self, z_um: float | int):
         '''Absolute move of stage in Z direction. Unit: micrometers, range: [0, 10000]'''
@@ -114,6 +115,7 @@ class NikonNIS(Machine):
         prefix = prefix.replace(' ', '_')
         return self.run_macro(macro, prefix)
 
+    @idempotent
     def status(self) -> Status:
         with self.lock:
             p = self.current_process.value
@@ -123,6 +125,7 @@ class NikonNIS(Machine):
                 returncode = p.poll()
                 return {'running': returncode is None, 'returncode': returncode}
 
+    @idempotent
     def is_running(self) -> bool:
         return self.status()['running']
 
@@ -145,6 +148,17 @@ class NikonNIS(Machine):
             data['t'] = t
             return data
 
+    def progress(self) -> dict[str, Any]:
+        '''
+        Whether a macro is running and what the screen scraper last read, see screen_scraper_status.
+        '''
+        try:
+            scraped = self.screen_scraper_status()
+        except Exception:
+            scraped = {}
+        return {**scraped, 'running': self.is_running()}
+
+    @idempotent
     def list_protocols(self) -> list[JobNameDict]:
         uri_path = 'file:///' + self.jobsdb_path.replace('\\', '/') + '?mode=ro'
         with contextlib.closing(sqlite3.connect(uri_path, uri=True)) as con:
@@ -2,7 +2,7 @@ from __future__ import annotations
 from dataclasses import *
 from typing import *
 
-from .machine import Machine
+from .machine import Machine, idempotent
 
 import atexit
 import time
@@ -49,15 +49,18 @@ class NikonStage(Machine):
     def delay(self):
         time.sleep(0.20)
 
+    @idempotent
     def status(self) -> StageStatus:
         return StageStatus(
             busy = bool(not GPIO.input(Blue)),
             plate = bool(GPIO.input(Orange)),
         )
 
+    @idempotent
     def is_busy(self) -> bool:
         return self.status()['busy']
 
+    @idempotent
     def has_plate(self) -> bool:
         return self.status()['plate']
 
@@ -1,4 +1,4 @@
-from .machine import Machine
+from .machine import Machine, idempotent
 from dataclasses import *
 from typing import *
 
@@ -16,8 +16,10 @@ class Squid(Machine):
     def acquire(self) -> bool:
         raise
 
+    @idempotent
     def status(self) -> dict[str, Any]:
         raise
 
+    @idempotent
     def list_protocols(self) -> list[str]:
         raise
@@ -15,7 +15,6 @@ from .profiling import timeit, memit # type: ignore
 from .args import doc_header # type: ignore
 
 import json
-from urllib.request import urlopen, Request
 import time
 
 import functools
@@ -68,11 +67,13 @@ def test_cache_by():
     assert log == [1]
 
 def curl(url: str) -> Any:
+    from urllib.request import urlopen
     ten_minutes = 60 * 10
     res = json.loads(urlopen(url, timeout=ten_minutes).read())
     return res
 
 def post_json(url: str, data: dict[str, Any]) -> dict[str, Any]:
+    from urllib.request import urlopen, Request
     ten_minutes = 60 * 10
     req = Request(
         url,
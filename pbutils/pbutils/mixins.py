@@ -23,6 +23,8 @@ def collect_fields(cls: Any, args: tuple[Any], kws: dict[str, Any]) -> dict[str,
     return kws
 
 class ReplaceMixin:
+    __slots__ = ()
+
     @property
     def replace(self) -> Type[Self]:
         def replacer(*args: Any, **kws: Any) -> Self:
@@ -68,38 +70,32 @@ class Select(Generic[R], PrivateReplaceMixin):
                 syntax = Syntax('or', [syntax, c], binop=True)
         return self._replace(_where=[*self._where, syntax]) # type: ignore
 
-    def sql(self) -> str:
-        def join(none: str, sep: str, values: list[Any]):
-            if not values:
-                return none
-            else:
-                return sep.join(values)
-        columns: set[str] = {
-            col
-            for col, in self._db.con.execute(
-                'select name from pragma_table_info(?)',
-                (self._table.table_name(),)
-            )
-        }
+    def sql(self, params: list[SQLType] | None = None) -> str:
+        '''
+        The statement with literals appended to params as bound parameters,
+        or inlined if params is None.
+        '''
+        columns = self._db.table_columns(self._table.table_name())
+        var_name = self._table.var_name()
         selects: list[str] = []
         for conv in self._focus._follow().sql_columns_converters():
             c = conv.key
             if c in columns:
                 selects += [
-                    f'{self._table.var_name()}.{c}'
+                    f'{var_name}.{c}'
                 ]
             else:
                 print(f'Adding default {c}: {conv.default!r}')
                 selects += [
-                    to_sql(conv.conv_to_sql(conv.default))
+                    to_sql(conv.conv_to_sql(conv.default), params)
                 ]
         select = ', '.join(selects)
         if self._distinct:
             select = f'distinct {select}'
-        where = [to_sql(w) for w in self._where]
+        where = [to_sql(w, params, columns) for w in self._where]
         stmt = {
             'select': select,
-            'from': f'{self._table.table_name()} {self._table.var_name()}',
+            'from': f'{self._table.table_name()} {var_name}',
         }
         if where:
             stmt['where'] = '\n  and '.join(where)
@@ -108,7 +104,7 @@ class Select(Generic[R], PrivateReplaceMixin):
         else:
             order, dir = self._order
         assert dir.lower() in ('desc', 'asc', 'desc nulls last', 'asc nulls first')
-        stmt['order by'] = to_sql(order) + ' ' + dir
+        stmt['order by'] = to_sql(order, params, columns) + ' ' + dir
         if self._limit:
             stmt['limit'] = str(self._limit)
         if self._offset:
@@ -162,10 +158,12 @@ class Select(Generic[R], PrivateReplaceMixin):
             return default
 
     def list(self) -> list[R]:
-        stmt = self.sql()
-        def throw(e: Exception):
-            raise e
-        rows = self._db.con.execute(stmt).fetchall()
+        if not self._db.table_columns(self._table.table_name()):
+            # only on read-only connections, see DB.get_desc
+            return []
+        params: list[SQLType] = []
+        stmt = self.sql(params)
+        rows = self._db.con.execute(stmt, params).fetchall()
         return self._focus._follow().from_sql_tuples(rows)
 
     def limit(self, bound: int | None = None, offset: int | None = None) -> Select[R]:
@@ -182,23 +180,19 @@ class Group(Generic[K, V], PrivateReplaceMixin):
     _select: Select[Any]
     _by: K = cast(Any, None)
 
-    def sql(self) -> str:
-        def join(none: str, sep: str, values: list[Any]):
-            if not values:
-                return none
-            else:
-                return sep.join(values)
+    def sql(self, params: list[SQLType] | None = None) -> str:
         k = self._by
         v = self._select._focus
         select = Syntax.json_array(k, v)
-        where = [to_sql(w) for w in self._select._where]
+        columns = self._select._db.table_columns(self._select._table.table_name())
+        where = [to_sql(w, params, columns) for w in self._select._where]
         stmt = {
-            'select': to_sql(select),
-            'from': f'{self._select._table} {self._select._var._head}',
+            'select': to_sql(select, params, columns),
+            'from': f'{self._select._table.table_name()} {self._select._table.var_name()}',
         }
         if where:
             stmt['where'] = '\n  and '.join(where)
-        stmt['group by'] = to_sql(self._by)
+        stmt['group by'] = to_sql(self._by, params, columns)
         if self._select._limit:
             stmt['limit'] = str(self._select._limit)
         if self._select._offset:
@@ -206,21 +200,21 @@ class Group(Generic[K, V], PrivateReplaceMixin):
         return '\n'.join(k + '\n  ' + v for k, v in stmt.items()) + ';'
 
     def dict(self) -> dict[K, V]:
-        stmt = self.sql()
-        def throw(e: Exception):
-            raise e
         return dict(self.list())
 
     def items(self) -> list[tuple[K, V]]:
         return self.list()
 
     def list(self) -> list[tuple[K, V]]:
-        stmt = self.sql()
+        if not self._select._db.table_columns(self._select._table.table_name()):
+            return []
+        params: list[SQLType] = []
+        stmt = self.sql(params)
         def throw(e: Exception):
             raise e
         res = [
             serializer.loads(v) if isinstance(v, str) else throw(ValueError(f'{v} is not string'))
-            for v, in self._select._db.con.execute(stmt).fetchall()
+            for v, in self._select._db.con.execute(stmt, params).fetchall()
         ]
         return [(k, v) for k, v in res]
 
@@ -251,6 +245,7 @@ class Group(Generic[K, V], PrivateReplaceMixin):
     def total(self, v: A) -> Group[K, A]: return self._agg('total', v)
     def json_group_array(self, v: A) -> Group[K, list[A]]: return self._agg('json_group_array', v)
     def group_concat(self, v: Any, sep: str=',') -> Group[K, str]: return self._agg('group_concat', v, sep)
+    def json_array(self, *vs: Any) -> Group[K, list[Any]]: return self._agg('json_array', *vs)
 
     def limit(self, bound: int | None = None, offset: int | None = None) -> Group[K, V]:
         return self._replace(_select=self._select.limit(bound, offset))
@@ -311,7 +306,8 @@ class Var(PrivateReplaceMixin):
             path += [attr]
             if not isinstance(desc, DataClassDesc):
                 raise ValueError(f'Refusing to go into opaque {path} in var {self._head}.{self._attrs}')
-            desc = desc.fields['$'.join(path)]
+            k = '$'.join(path)
+            desc = desc.fields[k] if k in desc.fields else desc.generated[k]
         return desc
 
     def __getattr__(self, attr: str):
@@ -333,27 +329,39 @@ class Var(PrivateReplaceMixin):
 class sql:
     @staticmethod
     def glob(v: str, pattern: str) -> bool:
-        return Syntax('GLOB', [v, pattern], binop=True)
+        return cast(bool, Syntax('GLOB', [v, pattern], binop=True))
 
     @staticmethod
     def like(v: str, pattern: str) -> bool:
-        return Syntax('LIKE', [v, pattern], binop=True)
+        return cast(bool, Syntax('LIKE', [v, pattern], binop=True))
 
     @staticmethod
     def either(x: bool, y: bool) -> bool:
-        return Syntax('or', [x, y], binop=True)
+        return cast(bool, Syntax('or', [x, y], binop=True))
 
     @staticmethod
     def both(x: bool, y: bool) -> bool:
-        return Syntax('and', [x, y], binop=True)
+        return cast(bool, Syntax('and', [x, y], binop=True))
 
     @staticmethod
     def nt(x: bool) -> bool:
-        return Syntax('not', [x])
+        return cast(bool, Syntax('not', [x]))
 
     @staticmethod
     def iif(c: bool, t: bool, f: bool) -> bool:
-        return Syntax('iif', [c, t, f])
+        return cast(bool, Syntax('iif', [c, t, f]))
+
+    @staticmethod
+    def isin(v: A, values: Iterable[A]) -> bool:
+        return cast(bool, Syntax('in', [v, Syntax(',', list(values))], binop=True))
+
+    @staticmethod
+    def min(v: A) -> A:
+        return cast(A, Syntax('min', [v]))
+
+    @staticmethod
+    def max(v: A) -> A:
+        return cast(A, Syntax('max', [v]))
 
 @dataclass(frozen=True)
 class Syntax(PrivateReplaceMixin):
@@ -377,20 +385,33 @@ class Syntax(PrivateReplaceMixin):
 def call_str(head: str, *args: str):
     return head + '(' + ', '.join(args) + ')'
 
-def to_sql(v: Var | Syntax | Any) -> str:
+def to_sql(v: Var | Syntax | Any, params: list[SQLType] | None = None, columns: Container[str] | None = None) -> str:
+    '''
+    Literals are appended to params and replaced by ? if params is given.
+
+    Generated columns that are not among the columns of the table are
+    replaced by their expression.
+    '''
     match v:
         case Var():
-            return v._head + '.' + '$'.join(v._attrs)
+            k = '$'.join(v._attrs)
+            if columns is not None and k not in columns and k in v._desc.meta.generated:
+                _, expr = v._desc.meta.generated[k]
+                return f'({expr})'
+            return v._head + '.' + k
             # return '.'.join([v._head, *v._attrs])
         case Syntax(',', args):
             # tuple (sqlite row value)
-            return call_str('', *map(to_sql, args))
+            return call_str('', *(to_sql(arg, params, columns) for arg in args))
         case Syntax('*', []):
             return '*'
         case Syntax(op, [lhs, rhs]) if v.binop:
-            return f'({to_sql(lhs)} {op} {to_sql(rhs)})'
+            return f'({to_sql(lhs, params, columns)} {op} {to_sql(rhs, params, columns)})'
         case Syntax(op, args):
-            return call_str(op, *map(to_sql, args))
+            return call_str(op, *(to_sql(arg, params, columns) for arg in args))
+        case str() | float() | int() | bytes() | None if params is not None:
+            params.append(v)
+            return '?'
         case str():
             return sqlquote(v)
         case float() | int():
@@ -434,6 +455,8 @@ class Con:
 class DB:
     _con: apsw.Connection
     transaction_depth: int = 0
+    read_only: bool = False
+    _table_columns: dict[str, set[str]] = field(default_factory=dict, repr=False)
 
     @property
     def con(self) -> Con:
@@ -469,76 +492,119 @@ class DB:
         )
 
     def get_desc(self, t: Type[Any]) -> tuple[str, DataClassDesc]:
+        '''
+        Creates the table with its indexes and change triggers if it does not
+        exist. Existing tables are not altered, generated columns they lack are
+        replaced by their expressions in queries, see to_sql. Read-only
+        connections never create tables and read missing ones as empty.
+        '''
         d = DataClassDesc.get(t)
         Table = d.table_name()
-        if not self.has_table(Table):
-            self.con.execute(d.schema())
+        if Table not in self._table_columns:
+            if not self.read_only and not self.has_table(Table):
+                with self.transaction:
+                    self.con.execute(d.schema())
+                    for stmt in d.index_sql():
+                        self.con.execute(stmt)
+                    if self.con.filename:
+                        # an in-memory database has no other connections to read the changes
+                        for stmt in d.changes_sql():
+                            self.con.execute(stmt)
+            self.table_columns(Table)
         return Table, d
 
+    def changes(self, since: int = 0) -> tuple[int, dict[str, set[int]]]:
+        '''
+        The ids of rows written after the cursor since, per table, and the next cursor.
+        Only tables declared with Meta(changes=True) are recorded.
+        '''
+        out: DefaultDict[str, set[int]] = DefaultDict(set)
+        if not self.has_table('Changes'):
+            return since, {}
+        for seq, tbl, row_id in self.con.execute('select seq, tbl, row_id from Changes where seq > ? order by seq', [since]):
+            out[tbl].add(row_id)
+            since = seq
+        return since, dict(out)
+
+    def table_columns(self, name: str) -> set[str]:
+        '''
+        The columns of a table, cached on this connection once the table exists.
+        '''
+        if (columns := self._table_columns.get(name)) is not None:
+            return columns
+        columns = {
+            col
+            for col, in self.con.execute('select name from pragma_table_xinfo(?)', (name,))
+        }
+        if columns:
+            self._table_columns[name] = columns
+        return columns
+
     def get(self, t: Type[R]) -> Select[R]:
         _, d = self.get_desc(t)
         return Select(self, d.var(), d)
 
     def __post_init__(self):
-        self.con.execute('pragma journal_mode=WAL')
+        if not self.read_only:
+            self.con.execute('pragma journal_mode=WAL')
+
+    def close(self):
+        self._con.close()
 
     @contextmanager
     @staticmethod
-    def open(path: str | Path):
-        db = DB.connect(path)
+    def open(path: str | Path, read_only: bool = False):
+        db = DB.connect(path, read_only=read_only)
         yield db
         db.con.close()
 
     @staticmethod
-    def connect(path: str | Path):
-        con = apsw.Connection(str(path))
+    def connect(path: str | Path, read_only: bool = False):
+        '''
+        Read-only connections are for viewing a database that another
+        process writes to, or that should stay as it is.
+        '''
+        if read_only:
+            con = apsw.Connection(str(path), flags=apsw.SQLITE_OPEN_READONLY)
+        else:
+            con = apsw.Connection(str(path))
         con.setbusytimeout(2000)
+        return DB(con, read_only=read_only)
+
+    def serialize(self) -> bytes:
+        '''
+        The main database as bytes, see DB.deserialize.
+        '''
+        return self._con.serialize('main')
+
+    @staticmethod
+    def deserialize(data: bytes) -> DB:
+        '''
+        An in-memory copy of a database from DB.serialize.
+        '''
+        con = apsw.Connection(':memory:')
+        deserialize: Any = con.deserialize # type: ignore
+        deserialize('main', data)
         return DB(con)
 
 class DBMixin(ReplaceMixin):
     id: int
 
     def save(self, db: DB) -> Self:
-        with db.transaction:
-            Table, d = db.get_desc(self.__class__)
-            if self.id == -1:
-                exists = False
-            else:
-                exists = any(
-                    db.con.execute(f'''
-                        select 1 from {Table} where id = ?
-                    ''', [self.id])
-                )
-            if exists:
-                pairs = dict(zip(d.sql_columns(), d.to_sql_tuple(self)))
-                pairs.pop('id')
-                rows = [f'{c} = ?' for c, v in pairs.items()]
-                vals = [v          for c, v in pairs.items()]
-                db.con.execute(
-                    f'update {Table} set {", ".join(rows)} where id = ?',
-                    [*vals, self.id]
-                )
-                return self
-            else:
-                res: Self
-                if self.id == -1:
-                    reply = db.con.execute(f'''
-                        select ifnull(max(id) + 1, 0) from {Table};
-                    ''').fetchone()
-                    assert reply is not None
-                    id, = reply
-                    res = replace(self, id=id) # type: ignore
-                else:
-                    id = self.id
-                    res = self
-
-                vals = d.to_sql_tuple(res)
-                qs = ','.join('?' for _ in vals)
-                db.con.execute(
-                    f'insert into {Table} values ({qs})',
-                    vals
-                )
-                return res
+        '''
+        Inserts or updates this row. A row with id -1 is inserted with the next free id.
+        '''
+        _, d = db.get_desc(self.__class__)
+        vals = d.to_sql_tuple(self)
+        if self.id == -1:
+            vals.pop(d.id_index)
+            reply = db.con.execute(d.insert_next_id_sql, vals).fetchone()
+            assert reply is not None
+            id, = reply
+            return replace(self, id=id) # type: ignore
+        else:
+            db.con.execute(d.upsert_sql, vals)
+            return self
 
     def delete(self, db: DB):
         Table = self.__class__.__name__
@@ -550,13 +616,32 @@ class DBMixin(ReplaceMixin):
         cls = self.__class__
         return db.get(cls).where(cls.id == self.id).one()
 
+changes_schema = '''
+    create table if not exists Changes (
+        seq integer primary key autoincrement,
+        tbl text not null,
+        row_id integer not null,
+        unique (tbl, row_id)
+    );
+'''
+
 @dataclass(frozen=True)
 class Meta:
-    pass
-    # log: bool = False
-    # log_table: None | str = None
-    # views: dict[str, str] = field(default_factory=dict)
-    # indexes: dict[str, str] = field(default_factory=dict)
+    '''
+    Extra schema for a table, set as the __meta__ class attribute of its dataclass.
+
+    generated: column name to its type and sql expression. The columns are
+    virtual so they can be added to existing tables. They can be used in
+    queries and indexes, but are not read back into the dataclass.
+
+    indexes: index name to its columns.
+
+    changes: record the ids of inserted, updated and deleted rows in the
+    Changes table of database files, see DB.changes.
+    '''
+    generated: dict[str, tuple[Any, str]] = field(default_factory=dict)
+    indexes: dict[str, list[str]] = field(default_factory=dict)
+    changes: bool = False
 
 import sys, functools, inspect
 
@@ -651,6 +736,29 @@ class Converters:
                 return conv.to_py(val) if conv.to_py else val
         raise ValueError(f'Cannot convert {val=} {self=}')
 
+    @functools.cached_property
+    def decoder(self) -> Callable[[SQLType], Any]:
+        '''
+        conv_to_py without the converter search when no converter changes
+        the value or when there is only one converter.
+        '''
+        if all(conv.to_py is None for conv in self.xs):
+            sql_types = tuple(conv.sql_type for conv in self.xs)
+            def check(val: SQLType) -> Any:
+                if isinstance(val, sql_types):
+                    return val
+                raise ValueError(f'Cannot convert {val=} {self=}')
+            return check
+        elif len(self.xs) == 1 and (to_py := self.xs[0].to_py):
+            sql_type = self.xs[0].sql_type
+            def convert(val: SQLType) -> Any:
+                if isinstance(val, sql_type):
+                    return to_py(val)
+                raise ValueError(f'Cannot convert {val=} {self=}')
+            return convert
+        else:
+            return self.conv_to_py
+
     def conv_to_sql(self, val: Any):
         for conv in self.xs:
             if isinstance(val, conv.py_type):
@@ -659,16 +767,19 @@ class Converters:
 
     def from_sql_tuple(self, row: tuple[SQLType, ...]) -> Any:
         assert len(row) == 1
-        return self.conv_to_py(row[0])
+        return self.decoder(row[0])
 
     def from_sql_tuples(self, rows: list[tuple[SQLType, ...]]) -> list[Any]:
-        return [self.from_sql_tuple(row) for row in rows]
+        decoder = self.decoder
+        return [decoder(v) for v, in rows]
 
 @dataclass
 class DataClassDesc:
     con: Any
     fields: dict[str, DataClassDesc | Converters]
     flat: dict[str, Converters] = field(default_factory=dict, repr=False)
+    meta: Meta = field(default_factory=Meta, repr=False)
+    generated: dict[str, Converters] = field(default_factory=dict, repr=False)
 
     def sql_columns(self) -> list[str]:
         return list(self.flat.keys())
@@ -691,14 +802,69 @@ class DataClassDesc:
     def var(self) -> Var:
         return Var(self.table_name().lower(), self, [])
 
+    @functools.cached_property
+    def id_index(self) -> int:
+        return self.sql_columns().index('id')
+
+    @functools.cached_property
+    def upsert_sql(self) -> str:
+        Table = self.table_name()
+        columns = self.sql_columns()
+        qs = ','.join('?' for _ in columns)
+        updates = ', '.join(f'{c} = excluded.{c}' for c in columns if c != 'id')
+        if updates:
+            return f'insert into {Table} values ({qs}) on conflict (id) do update set {updates}'
+        else:
+            return f'insert into {Table} values ({qs}) on conflict (id) do nothing'
+
+    @functools.cached_property
+    def insert_next_id_sql(self) -> str:
+        Table = self.table_name()
+        qs = [
+            f'(select ifnull(max(id) + 1, 0) from {Table})' if c == 'id' else '?'
+            for c in self.sql_columns()
+        ]
+        return f'insert into {Table} values ({",".join(qs)}) returning id'
+
     def schema(self):
         rows: list[str] = []
         for k, t in self.sql_columns_with_type():
             rows += [f'{k} {t}']
+        for k in self.generated:
+            rows += [self.generated_column_sql(k)]
         rows += ['check (id >= 0)']
         body = ','.join('\n    ' + row for row in rows)
         return f'create table if not exists {self.table_name()} ({body}) strict;'
 
+    def generated_column_sql(self, k: str) -> str:
+        t = type_as_sql(self.generated[k]).removesuffix(' not null')
+        _, expr = self.meta.generated[k]
+        return f'{k} {t} as ({expr}) virtual'
+
+    def index_sql(self) -> list[str]:
+        Table = self.table_name()
+        return [
+            f'create index if not exists {Table}_{name} on {Table} ({", ".join(columns)});'
+            for name, columns in self.meta.indexes.items()
+        ]
+
+    def changes_sql(self) -> list[str]:
+        if not self.meta.changes:
+            return []
+        Table = self.table_name()
+        return [
+            changes_schema,
+            *[
+                textwrap.dedent(f'''
+                    create trigger if not exists {Table}_{event}_changes after {event} on {Table} begin
+                        delete from Changes where tbl = '{Table}' and row_id = {row}.id;
+                        insert into Changes (tbl, row_id) values ('{Table}', {row}.id);
+                    end;
+                ''')
+                for event, row in [('insert', 'new'), ('update', 'new'), ('delete', 'old')]
+            ]
+        ]
+
     def to_sql_tuple(self, value: Any) -> list[SQLType]:
         out: list[SQLType] = []
         for k, f in self.fields.items():
@@ -709,23 +875,34 @@ class DataClassDesc:
                 out += [f.conv_to_sql(v)]
         return out
 
-    def from_sql_tuple(self, row: tuple[SQLType, ...]) -> Any:
-        kv = {
-            k: convs.conv_to_py(v)
-            for v, (k, convs) in zip(row, self.flat.items())
-        }
-        def unflatten(d: DataClassDesc):
-            args: list[Any] = []
+    @functools.cached_property
+    def decoder(self) -> Callable[[Sequence[SQLType]], Any]:
+        '''
+        Makes the value from a row with the columns in the order of flat.
+        '''
+        index = {k: i for i, k in enumerate(self.flat)}
+        def compile(d: DataClassDesc) -> Callable[[Sequence[SQLType]], Any]:
+            parts: list[tuple[int, Callable[[Any], Any]]] = []
             for k, f in d.fields.items():
                 if isinstance(f, Converters):
-                    args += [kv.get(k)]
+                    parts += [(index[k], f.decoder)]
                 else:
-                    args += [unflatten(f)]
-            return d.con(*args)
-        return unflatten(self)
+                    parts += [(-1, compile(f))]
+            con = d.con
+            def decode(row: Sequence[SQLType]) -> Any:
+                return con(*[
+                    dec(row) if i == -1 else dec(row[i])
+                    for i, dec in parts
+                ])
+            return decode
+        return compile(self)
+
+    def from_sql_tuple(self, row: tuple[SQLType, ...]) -> Any:
+        return self.decoder(row)
 
     def from_sql_tuples(self, rows: list[tuple[SQLType, ...]]) -> list[Any]:
-        return [self.from_sql_tuple(row) for row in rows]
+        decoder = self.decoder
+        return [decoder(row) for row in rows]
 
     def __post_init__(self):
         def flatten(d: DataClassDesc):
@@ -757,7 +934,12 @@ class DataClassDesc:
                 )
         scoped = scope_names(ret, [])
         assert isinstance(scoped, DataClassDesc)
-        for k, _ in scoped.fields.items():
+        scoped.meta = getattr(dc, '__meta__', Meta())
+        scoped.generated = {
+            k: Converters(make_converter(t), k, None)
+            for k, (t, _expr) in scoped.meta.generated.items()
+        }
+        for k in [*scoped.fields, *scoped.generated]:
             setattr(dc, k, getattr(scoped.var(), k))
         return scoped
 
@@ -974,5 +1156,106 @@ def te_st():
             ], encoding='utf8')
             print(out)
 
+def test_changes(tmp_path: Any):
+    @dataclass
+    class Row(DBMixin):
+        x: int = 0
+        id: int = -1
+        __meta__ = Meta(changes=True)
+
+    db = DB.connect(tmp_path / 'changes.db')
+    assert db.changes() == (0, {})
+    a = Row(1).save(db)
+    b = Row(2).save(db)
+    cursor, changed = db.changes()
+    assert changed == {'Row': {a.id, b.id}}
+    assert db.changes(cursor) == (cursor, {})
+    a.replace(x=3).save(db)
+    cursor, changed = db.changes(cursor)
+    assert changed == {'Row': {a.id}}
+    b.delete(db)
+    assert db.changes(cursor)[1] == {'Row': {b.id}}
+
+    # triggers are only added when the table is created
+    old = DB.connect(tmp_path / 'old.db')
+    old.con.execute(DataClassDesc.get(Row).schema())
+    Row(4).save(old)
+    assert not old.has_table('Changes')
+    assert old.changes() == (0, {})
+
+def test_save(tmp_path: Any):
+    @dataclass
+    class Row(DBMixin):
+        x: int = 0
+        id: int = -1
+
+    db = DB.connect(tmp_path / 'save.db')
+    assert Row(1).save(db).id == 0
+    db.con.execute('delete from Row')
+    assert Row(1, id=5).save(db).id == 5
+    assert Row(2).save(db).id == 6
+    Row(3, id=5).save(db)
+    assert [(r.id, r.x) for r in db.get(Row)] == [(5, 3), (6, 2)]
+
+def test_decode(tmp_path: Any):
+    @dataclass
+    class Row(DBMixin):
+        x: int = 0
+        t: datetime = datetime(2000, 1, 1)
+        id: int = -1
+
+    import pytest
+    db = DB.connect(tmp_path / 'decode.db')
+    # not strict, so the columns can have values of other types
+    db.con.execute('create table Row (x integer not null, t text not null, id integer primary key)')
+    Row(1).save(db)
+    assert db.get(Row).one() == Row(1, id=0)
+    db.con.execute('update Row set x = "one"')
+    with pytest.raises(ValueError):
+        db.get(Row).one()
+    db.con.execute('update Row set x = 1, t = 2000')
+    with pytest.raises(ValueError):
+        db.get(Row).one()
+
+def test_read_only(tmp_path: Any):
+    @dataclass
+    class Item(DBMixin):
+        x: int = 0
+        id: int = -1
+
+    @dataclass
+    class Item2(DBMixin):
+        x: int = 0
+        id: int = -1
+        __meta__ = Meta(generated={'big': (bool, 'x > 1')}, indexes={'big': ['big']})
+
+    @dataclass
+    class Missing(DBMixin):
+        id: int = -1
+
+    path = tmp_path / 'items.db'
+    db = DB.connect(path)
+    db.con.execute('create table Item2 (x integer not null, id integer primary key) strict')
+    Item(1).save(db)
+    Item2(1).save(db)
+    Item2(2).save(db)
+    db.close()
+
+    before = path.read_bytes()
+    ro = DB.connect(path, read_only=True)
+    assert [i.x for i in ro.get(Item)] == [1]
+    # the table was made without the generated column, which is then replaced by its expression
+    assert 'big' not in ro.table_columns('Item2')
+    assert [i.x for i in ro.get(Item2).where(Item2.big == True)] == [2] # type: ignore
+    # a missing table reads as empty and is not created
+    assert ro.get(Missing).list() == []
+    assert not ro.has_table('Missing')
+    ro.close()
+    assert path.read_bytes() == before
+
+    db = DB.connect(path)
+    assert [i.x for i in db.get(Item2).where(Item2.big == True)] == [2] # type: ignore
+    assert not db.has_table('Item2_big', 'index')
+
 if __name__ == '__main__':
     te_st()
@@ -6,6 +6,16 @@ requirements = '''
     pbutils
 '''
 
+# Serve.run_workers uses gunicorn, or waitress where gunicorn does not run.
+# Responses are compressed with brotli when it is installed, otherwise with gzip.
+extras_require = {
+    'workers': [
+        'gunicorn; platform_system != "Windows"',
+        'waitress; platform_system == "Windows"',
+    ],
+    'brotli': ['brotli'],
+}
+
 name='viable'
 
 console_scripts = f'''
@@ -26,5 +36,6 @@ setup(
     python_requires='>=3.10',
     license='MIT',
     install_requires=requirements.split(),
+    extras_require=extras_require,
     entry_points={'console_scripts': console_scripts.split()}
 )
@@ -3,6 +3,7 @@ from __future__ import annotations
 from .core import (
     Serve,   # type: ignore
     call,    # type: ignore
+    live,    # type: ignore
 )
 from .call_js import (
     JS,      # type: ignore
@@ -24,7 +25,49 @@ from .tags import *
 import flask
 Flask = flask.Flask # reexport
 
+import json
+from typing import Literal
+
 def queue_refresh(after_ms: float=100):
     assert str(after_ms).isdigit()
     return script(f'queue_refresh({after_ms})', eval=True)
 
+
+def scroll_window(var: Str, id: str, axis: Literal['x', 'y'] = 'y', default_size: int = 1080) -> tuple[tuple[int, int], Tag]:
+    '''
+    The part of the element with this id to render along the axis, in pixels
+    from its start, and a script that updates var when the viewport is
+    scrolled to another block of it. A block is one viewport long and the
+    part is the viewport's block with one block of margin on each side.
+    Until the client has reported its viewport the part is at the start.
+
+    The script is run again when the page is updated, so it replaces its
+    listeners from the previous run instead of adding more.
+    '''
+    try:
+        block, size = map(int, var.value.split())
+    except ValueError:
+        block, size = 0, default_size
+    size_prop, start_prop = ('innerWidth', 'left') if axis == 'x' else ('innerHeight', 'top')
+    code = f'''
+        const listeners = window.scroll_window_listeners ??= {{}}
+        const prev = listeners[{json.dumps(id)}]
+        if (prev) {{
+            window.removeEventListener('scroll', prev)
+            window.removeEventListener('resize', prev)
+        }}
+        const listener = listeners[{json.dumps(id)}] = () => {{
+            const el = document.getElementById({json.dumps(id)})
+            if (!el) return
+            const size = Math.max(window.{size_prop}, 1)
+            const value = Math.floor(-el.getBoundingClientRect().{start_prop} / size) + ' ' + size
+            if (value !== {json.dumps(var.value)} && value !== window.scroll_window_sent) {{
+                window.scroll_window_sent = value
+                {var.update(js('value'))}
+            }}
+        }}
+        window.addEventListener('scroll', listener, {{passive: true}})
+        window.addEventListener('resize', listener)
+        listener()
+    '''
+    return ((block - 1) * size, (block + 2) * size), script(raw(code), eval=True)
@@ -0,0 +1,181 @@
+'''
+Compression of responses.
+
+Static assets such as viable.js are compressed once at the highest level
+and served with an ETag. Pages and other dynamic responses are compressed
+per response at a faster level. The live stream is compressed as one
+stream which is flushed after every event, so each event is compressed
+against the events before it.
+'''
+from __future__ import annotations
+from dataclasses import *
+from typing import *
+
+import functools
+import gzip
+import hashlib
+import re
+import sys
+import zlib
+
+from flask import Request
+from flask.wrappers import Response
+
+compressible = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/event-stream',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+}
+min_size = 500
+
+@functools.cache
+def get_brotli() -> Any:
+    try:
+        import brotli # type: ignore
+        return brotli
+    except Exception as e:
+        print('Not using brotli:', str(e), file=sys.stderr)
+        return None
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    '''
+    The encoding to use given the Accept-Encoding header: br if brotli is installed, otherwise gzip.
+    '''
+    accepted: set[str] = set()
+    for part in accept_encoding.lower().split(','):
+        name, *params = [s.strip() for s in part.split(';')]
+        if not any(re.fullmatch(r'q=0(\.0*)?', p) for p in params):
+            accepted.add(name)
+    if 'br' in accepted and get_brotli():
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def compress(data: bytes, encoding: str, static: bool=False) -> bytes:
+    if encoding == 'br':
+        return get_brotli().compress(data, quality=11 if static else 5)
+    elif encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+    else:
+        raise ValueError(f'No case for {encoding=}')
+
+@dataclass(frozen=True)
+class Asset:
+    '''
+    A static file with its compressed encodings.
+    '''
+    data: bytes
+    mimetype: str
+    etag: str
+    encoded: dict[str, bytes]
+
+    @staticmethod
+    def make(data: str | bytes, mimetype: str) -> Asset:
+        if isinstance(data, str):
+            data = data.encode()
+        etag = hashlib.sha256(data).hexdigest()[:16]
+        encodings = ['gzip']
+        if get_brotli():
+            encodings += ['br']
+        encoded: dict[str, bytes] = {}
+        for encoding in encodings:
+            compressed = compress(data, encoding, static=True)
+            if len(compressed) < len(data):
+                encoded[encoding] = compressed
+        return Asset(data, mimetype, etag, encoded)
+
+    def response(self, request: Request, immutable: bool=False) -> Response:
+        '''
+        Immutable assets are requested with their etag in the url and may be
+        cached indefinitely, others are revalidated on every use.
+        '''
+        headers = {
+            'ETag': f'"{self.etag}"',
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'public, max-age=31536000, immutable' if immutable else 'no-cache',
+        }
+        if request.if_none_match.contains_weak(self.etag):
+            return Response(status=304, headers=headers)
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding in self.encoded:
+            data = self.encoded[encoding]
+            headers['Content-Encoding'] = encoding
+        else:
+            data = self.data
+        return Response(data, mimetype=self.mimetype, headers=headers)
+
+def compress_response(resp: Response, accept_encoding: str) -> Response:
+    '''
+    Compresses a dynamic response unless it is small, streamed or already encoded.
+    '''
+    if (
+        resp.status_code != 200
+        or resp.direct_passthrough
+        or resp.is_streamed
+        or resp.mimetype not in compressible
+        or 'Content-Encoding' in resp.headers
+    ):
+        return resp
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return resp
+    data = resp.get_data()
+    if len(data) < min_size:
+        return resp
+    resp.set_data(compress(data, encoding))
+    resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+def compress_stream(chunks: Generator[str, None, None], encoding: str) -> Iterator[bytes]:
+    '''
+    Compresses the chunks as one stream, flushing after each chunk so that it
+    reaches the client right away. The earlier chunks act as the dictionary
+    for the later ones, which is where the live updates of a page get most of
+    their compression since they repeat its markup.
+    '''
+    try:
+        if encoding == 'br':
+            compressor = get_brotli().Compressor(quality=5)
+            for chunk in chunks:
+                yield compressor.process(chunk.encode()) + compressor.flush()
+            yield compressor.finish()
+        elif encoding == 'gzip':
+            z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                yield z.compress(chunk.encode()) + z.flush(zlib.Z_SYNC_FLUSH)
+            yield z.flush()
+        else:
+            raise ValueError(f'No case for {encoding=}')
+    finally:
+        chunks.close()
+
+def test_compression():
+    from flask import Flask
+    app = Flask(__name__)
+    asset = Asset.make('x' * 1000, 'application/javascript')
+
+    @app.route('/asset')
+    def asset_route():
+        from flask import request
+        return asset.response(request)
+
+    client = app.test_client()
+    resp = client.get('/asset', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(resp.get_data()) == asset.data
+    resp = client.get('/asset', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.get_data() == asset.data
+    resp = client.get('/asset', headers={'If-None-Match': resp.headers['ETag']})
+    assert resp.status_code == 304
+
+    events = ['data: {"ops": [["i", [1, 0], "div", "version %d"]]}\n\n' % i for i in range(100)]
+    stream = b''.join(compress_stream((e for e in events), 'gzip'))
+    assert gzip.decompress(stream).decode() == ''.join(events)
+    assert len(stream) < sum(len(gzip.compress(e.encode())) for e in events) / 4
@@ -10,16 +10,21 @@ import sys
 import traceback
 import time
 import functools
+import hashlib
 import json
+import threading
 
 from flask import request, jsonify, make_response, Flask
 from flask.wrappers import Response
+from werkzeug.exceptions import NotFound
 from itsdangerous import Serializer, URLSafeSerializer
 
 from flask import g
 from werkzeug.local import LocalProxy
 
-from .tags import Node, Tag, Tags, Css, raw
+from .tags import Node, Tag, Tags, Css, Snapshot, raw
+from . import patch
+from . import compression
 from .minifier import minify
 from .call_js import CallJS
 from .provenance import request_data
@@ -33,6 +38,8 @@ class Env:
     VIABLE_RUN: bool = is_true(os.environ.get('VIABLE_RUN', True))
     VIABLE_HOST: str | None = os.environ.get('VIABLE_HOST')
     VIABLE_PORT: int | None = int(port) if (port := os.environ.get('VIABLE_PORT')) else None
+    VIABLE_WORKERS: int = int(os.environ.get('VIABLE_WORKERS') or 0)
+    VIABLE_THREADS: int = int(os.environ.get('VIABLE_THREADS') or 16)
 
 @functools.cache
 def get_viable_js(env: Env):
@@ -44,8 +51,13 @@ def get_viable_js(env: Env):
         res = minify(res)
     return res
 
+@functools.cache
+def get_viable_js_asset(env: Env) -> compression.Asset:
+    return compression.Asset.make(get_viable_js(env), 'application/javascript')
+
 def serializer_factory() -> Serializer:
-    secret = secrets.token_hex(32)
+    # a fixed secret keeps the calls in pages valid when the server is restarted
+    secret = os.environ.get('VIABLE_SECRET') or secrets.token_hex(32)
     return URLSafeSerializer(secret, serializer=pickle)
 
 P = ParamSpec('P')
@@ -57,12 +69,61 @@ def get_call():
 
 call = LocalProxy(get_call)
 
+@dataclass(frozen=True)
+class Live:
+    version: Callable[[], Any]
+    interval: float
+
+def version_token(version: Any) -> str:
+    return hashlib.sha256(repr(version).encode()).hexdigest()[:16]
+
+def live(version: Callable[[], Any], interval: float=0.1) -> Tag:
+    '''
+    Keeps the page up to date by server push instead of polling.
+
+    The server checks version() every interval seconds and when it has
+    changed renders the page again and sends the top-level elements that
+    changed. Clients viewing the page with the same query and session share
+    the render.
+    '''
+    g.viable_live = Live(version, interval)
+    token = version_token(version())
+    return Tags.script(f'live({json.dumps(token)})', eval=True)
+
+@dataclass(frozen=True)
+class LiveRender:
+    token: str
+    head: str
+    body: str
+    snapshot: Snapshot
+    live: Live | None
+
+    def diff(self, prev: LiveRender | None) -> dict[str, Any]:
+        if prev is None:
+            return {'token': self.token, 'head': self.head, 'body': self.body}
+        if ops := patch.diff(prev.snapshot, self.snapshot):
+            return {'token': self.token, 'ops': ops}
+        else:
+            return {}
+
 @dataclass
 class Serve:
     app: Flask
     env: Env = field(default_factory=Env)
     _routes_added: list[Any] = field(default_factory=list)
     _call_js: CallJS = field(default_factory=lambda: CallJS(serializer_factory()))
+    _views: dict[str, Callable[..., Iterable[Node | Css | str | dict[str, str]]]] = field(default_factory=lambda: dict[str, Callable[..., Iterable[Node | Css | str | dict[str, str]]]]())
+    _live_renders: dict[tuple[str, str], LiveRender] = field(default_factory=lambda: dict[tuple[str, str], LiveRender]())
+    _live_locks: dict[tuple[str, str], threading.Lock] = field(default_factory=lambda: dict[tuple[str, str], threading.Lock]())
+    _live_lock: threading.Lock = field(default_factory=threading.Lock)
+    _live_streams: int = 0
+    _renders: dict[str, Snapshot] = field(default_factory=lambda: dict[str, Snapshot]())
+    _renders_lock: threading.Lock = field(default_factory=threading.Lock)
+    live_heartbeat: float = 15.0
+    live_max_renders: int = 64
+    live_max_streams: int | None = None # defaults to half of VIABLE_THREADS
+    live_retry: float = 5.0
+    max_renders: int = 16
 
     def call(self, f: Callable[P, Any], *args: P.args, **kwargs: P.kwargs) -> str:
         return self._call_js.store_call(f, *args, **kwargs)
@@ -83,18 +144,46 @@ class Serve:
 
         @self.app.route('/viable.js') # type: ignore
         def viable_js_route():
-            return get_viable_js(self.env), {'Content-Type': 'application/javascript'}
+            asset = get_viable_js_asset(self.env)
+            # pages link to it with its etag so it can be cached until it changes
+            return asset.response(request, immutable=request.args.get('v') == asset.etag)
+
+        @self.app.after_request # type: ignore
+        def compress_response(resp: Response) -> Response:
+            if self.env.VIABLE_DEV:
+                return resp
+            return compression.compress_response(resp, request.headers.get('Accept-Encoding', ''))
 
         @self.app.post('/ping') # type: ignore
         def ping_route():
             time.sleep(115)
             return jsonify({})
 
+        @self.app.route('/live') # type: ignore
+        def live_route():
+            path = request.args.get('path', '/')
+            session = request.args.get('session', '{}')
+            token = request.args.get('token', '')
+            chunks = self.live_stream(path, session, token)
+            stream: Iterator[str] | Iterator[bytes] = chunks
+            headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'Vary': 'Accept-Encoding'}
+            encoding = None if self.env.VIABLE_DEV else compression.choose_encoding(request.headers.get('Accept-Encoding', ''))
+            if encoding:
+                stream = compression.compress_stream(chunks, encoding)
+                headers['Content-Encoding'] = encoding
+            return Response(
+                stream,
+                mimetype='text/event-stream',
+                headers=headers,
+                direct_passthrough=True,
+            )
+
     def route(self, rule: str = '/'):
         def inner(f: Callable[..., Iterable[Node | Css | str | dict[str, str]]]):
 
             self._routes_added.append(f)
             endpoint = f'viable_{f.__name__}_{len(self._routes_added)}' # flask insists on getting an endpoint name
+            self._views[endpoint] = f
             self.app.add_url_rule( # type: ignore
                 rule,
                 endpoint=endpoint,
@@ -114,6 +203,10 @@ class Serve:
         g.call_js = self._call_js
 
     def view(self, f: Callable[..., Iterable[Node | Css | str | dict[str, str]]], *args: Any, **kws: Any) -> Response:
+        head_node, body_node = self.render(f, *args, **kws)
+        return self.view_html(head_node, body_node)
+
+    def render(self, f: Callable[..., Iterable[Node | Css | str | dict[str, str]]], *args: Any, **kws: Any) -> tuple[Tag, Tag]:
 
         self.add_call_js()
 
@@ -140,9 +233,13 @@ class Serve:
             '''
             traceback.print_exc()
             body_node += Tags.pre(traceback.format_exc())
-        return self.view_body(body_node, title_str=title_str)
+        return self.render_body(body_node, title_str=title_str)
 
     def view_body(self, body_node: Tag, title_str: str) -> Response:
+        head_node, body_node = self.render_body(body_node, title_str)
+        return self.view_html(head_node, body_node)
+
+    def render_body(self, body_node: Tag, title_str: str) -> tuple[Tag, Tag]:
         head_node = Tags.head()
         for i, node in enumerate(body_node.children):
             if isinstance(node, Tags.head):
@@ -170,19 +267,15 @@ class Serve:
             # favicon because of chromium bug, see https://stackoverflow.com/a/36104057
             head_node += Tags.link(rel="icon", type="image/png", href="data:image/png;base64,iVBORw0KGgo=")
 
-        if self.env.VIABLE_DEV:
-            compress = False
-        else:
-            compress = bool(re.search('gzip|br|deflate', cast(Any, request).headers.get('Accept-encoding', '')))
-        indent = 0 # 0 if compress else 2
-        newline = '' if compress else '\n'
-
         classes = body_node.make_classes({})
 
         if classes:
-            head_node += Tags.style(raw('\n'.join(inst for _, inst in classes.values())))
+            css = '\n'.join(inst for _, inst in classes.values())
+            if not self.env.VIABLE_DEV:
+                css = minify(css, 'css')
+            head_node += Tags.style(raw(css))
 
-        head_node += Tags.script(src='/viable.js') # , defer=True)
+        head_node += Tags.script(src=f'/viable.js?v={get_viable_js_asset(self.env).etag}') # , defer=True)
 
         req_data = request_data()
         if updates := req_data.updates():
@@ -192,32 +285,256 @@ class Serve:
         elif not req_data.session_provided and req_data.did_request_session():
             body_node += Tags.script('refresh()', eval=True)
 
+        return head_node, body_node
+
+    def view_html(self, head_node: Tag, body_node: Tag) -> Response:
+        indent = 0 # 0 if self.env.VIABLE_DEV else 2
+        newline = '\n' if self.env.VIABLE_DEV else ''
+
+        html_node = Tags.html(head_node, body_node, lang='en')
+        [snapshot] = html_node.snapshot()
+        render_id = secrets.token_urlsafe(9)
+        body = request.get_json(force=True, silent=True)
+        base_id: str | None = cast(Any, body).get('base') if isinstance(body, dict) else None
+        with self._renders_lock:
+            base = self._renders.pop(base_id, None) if base_id else None
+            self._renders[render_id] = cast(Snapshot, snapshot)
+            while len(self._renders) > self.max_renders:
+                del self._renders[next(iter(self._renders))]
+        if base is not None:
+            # the client has the base render: send it the operations to get to this one
+            return jsonify({'render': render_id, 'ops': patch.diff(base, cast(Snapshot, snapshot))})
+
+        html_node.extend(render=render_id)
         html_str = (
             f'<!doctype html>{newline}' +
-            Tags.html(head_node, body_node, lang='en').to_str(indent)
+            html_node.to_str(indent)
         )
-        if compress:
-            html_str = minify(html_str, 'html')
 
         resp = make_response(html_str)
         return resp
 
+    def live_render(self, path: str, session: str) -> LiveRender:
+        '''
+        Renders the page at path for the session unless its version is unchanged
+        since the last render. Renders are shared between the clients.
+        '''
+        key = path, session
+        with self._live_lock:
+            lock = self._live_locks.setdefault(key, threading.Lock())
+        with lock:
+            prev = self._live_renders.get(key)
+            version_before: Any = None
+            if prev and prev.live:
+                version_before = version_token(prev.live.version())
+                if version_before == prev.token:
+                    return prev
+            url = path.split('?', 1)[0]
+            endpoint, values = self.app.url_map.bind('localhost').match(url, method='GET')
+            f = self._views.get(endpoint)
+            if f is None:
+                raise NotFound()
+            with self.app.test_request_context(path, method='POST', json={'session': json.loads(session)}):
+                g.pop('viable_live', None)
+                head_node, body_node = self.render(f, **values)
+                live: Live | None = g.get('viable_live')
+                if version_before is not None:
+                    token = version_before
+                elif live:
+                    token = version_token(live.version())
+                else:
+                    token = ''
+            head = head_node.to_str(0)
+            body = body_node.to_str(0)
+            [snapshot] = Tags.html(head_node, body_node, lang='en').snapshot()
+            res = LiveRender(token, head, body, cast(Snapshot, snapshot), live)
+            with self._live_lock:
+                self._live_renders.pop(key, None)
+                self._live_renders[key] = res
+                while len(self._live_renders) > self.live_max_renders:
+                    old_key = next(iter(self._live_renders))
+                    del self._live_renders[old_key]
+                    self._live_locks.pop(old_key, None)
+            return res
+
+    def live_stream(self, path: str, session: str, token: str) -> Generator[str, None, None]:
+        '''
+        Server-sent events with the parts of the page that changed since the
+        last event. The client has the page at the version of the token when
+        it connects, otherwise it is sent the whole page.
+
+        Each stream holds a server thread, so at most live_max_streams are open
+        at a time to leave threads for the other requests. A client over the
+        limit is told to reconnect after live_retry seconds.
+        '''
+        max_streams = self.live_max_streams or max(1, self.env.VIABLE_THREADS // 2)
+        with self._live_lock:
+            full = self._live_streams >= max_streams
+            if not full:
+                self._live_streams += 1
+        if full:
+            yield f'retry: {round(self.live_retry * 1000)}\n\n'
+            return
+        try:
+            yield from self._live_stream(path, session, token)
+        finally:
+            with self._live_lock:
+                self._live_streams -= 1
+
+    def _live_stream(self, path: str, session: str, token: str) -> Generator[str, None, None]:
+        try:
+            current = self.live_render(path, session)
+        except NotFound:
+            yield 'event: done\ndata: {}\n\n'
+            return
+        sent: LiveRender | None = current if current.token == token else None
+        while True:
+            if current is not sent:
+                update = current.diff(sent)
+                if update:
+                    yield f'data: {json.dumps(update)}\n\n'
+                sent = current
+            if current.live is None:
+                yield 'event: done\ndata: {}\n\n'
+                return
+            waited = 0.0
+            while version_token(current.live.version()) == current.token:
+                time.sleep(current.live.interval)
+                waited += current.live.interval
+                if waited >= self.live_heartbeat:
+                    # detects closed connections
+                    yield ': heartbeat\n\n'
+                    waited = 0.0
+            current = self.live_render(path, session)
+
     def run(self, host: str | None = None, port: int | None = None):
         print(' *', self.env)
 
-        if not self.env.VIABLE_DEV:
-            try:
-                from flask_compress import Compress # type: ignore
-                Compress(self.app)
-            except Exception as e:
-                print('Not using flask_compress:', str(e), file=sys.stderr)
-
         if self.env.VIABLE_RUN:
             HOST = self.env.VIABLE_HOST or host
             PORT = self.env.VIABLE_PORT or port
-            self.app.run(host=HOST, port=PORT, threaded=True)
+            if self.env.VIABLE_WORKERS:
+                self.run_workers(HOST or '127.0.0.1', PORT or 5000)
+            else:
+                self.app.run(host=HOST, port=PORT, threaded=True)
+
+    def run_workers(self, host: str, port: int):
+        '''
+        Serves the app with gunicorn using VIABLE_WORKERS processes with
+        VIABLE_THREADS threads each. Uses waitress with VIABLE_THREADS threads
+        in this process if gunicorn is not available, as on windows.
+
+        The workers are forked after the app is created so they share the
+        secret of the calls in the pages. The functions in the calls are
+        identified by their position in the source so that any worker can run
+        calls from pages rendered by another. The renders that refreshes are
+        patched against and the live renders are per worker: a client whose
+        refresh lands on another worker gets the whole page.
+        '''
+        try:
+            from gunicorn.app.base import BaseApplication # type: ignore
+        except Exception as e:
+            print('Not using gunicorn:', str(e), file=sys.stderr)
+        else:
+            from . import freeze_function
+            freeze_function.stable_ids = True
+            app = self.app
+            options = {
+                'bind': f'{host}:{port}',
+                'workers': self.env.VIABLE_WORKERS,
+                'worker_class': 'gthread',
+                'threads': self.env.VIABLE_THREADS,
+                'keepalive': 5,
+            }
+            class Application(BaseApplication):
+                def load_config(self):
+                    for k, v in options.items():
+                        self.cfg.set(k, v)
+                def load(self) -> Any:
+                    return app
+            Application().run()
+            return
+        try:
+            import waitress # type: ignore
+        except Exception as e:
+            print('Not using waitress:', str(e), file=sys.stderr)
+            self.app.run(host=host, port=port, threaded=True)
+        else:
+            waitress.serve(self.app, host=host, port=port, threads=self.env.VIABLE_THREADS)
 
     def suppress_flask_logging(self):
         import logging
         log = logging.getLogger('werkzeug')
         log.setLevel(logging.ERROR)
+
+def test_live():
+    serve = Serve(Flask(__name__), live_heartbeat=0.05)
+    version = [0]
+
+    @serve.route('/')
+    def index():
+        yield Tags.div('static')
+        yield Tags.div(f'version {version[0]}')
+        if version[0] < 2:
+            yield live(lambda: version[0], interval=0.01)
+
+    client = serve.app.test_client()
+    page = client.get('/').get_data(as_text=True)
+    token = version_token(0)
+    assert f'live("{token}")' in page
+
+    resp = client.get('/live', query_string={'path': '/', 'session': '{}', 'token': token})
+    events = resp.iter_encoded()
+    def next_event() -> str:
+        while (event := next(events).decode()).startswith(':'):
+            pass
+        return event
+    version[0] = 1
+    update = json.loads(next_event().removeprefix('data: '))
+    assert update['token'] == version_token(1)
+    assert update['ops'] == [
+        ['i', [1, 1], 'div', 'version 1'],
+        ['i', [1, 2], 'script', f'live("{version_token(1)}")'],
+    ]
+    version[0] = 2
+    update = json.loads(next_event().removeprefix('data: '))
+    assert update['ops'] == [
+        ['i', [1, 1], 'div', 'version 2'],
+        ['-', [1], 'body', 1],
+    ]
+    assert next_event().startswith('event: done')
+
+def test_live_max_streams():
+    serve = Serve(Flask(__name__), live_max_streams=1)
+
+    @serve.route('/')
+    def index():
+        yield Tags.div('static')
+        yield live(lambda: 0)
+
+    first = serve.live_stream('/', '{}', '')
+    assert next(first).startswith('data: ')
+    assert list(serve.live_stream('/', '{}', '')) == ['retry: 5000\n\n']
+    first.close()
+    assert next(serve.live_stream('/', '{}', '')).startswith('data: ')
+
+def test_refresh_patch():
+    serve = Serve(Flask(__name__))
+    version = [0]
+
+    @serve.route('/')
+    def index():
+        yield Tags.div(f'version {version[0]}')
+
+    client = serve.app.test_client()
+    page = client.get('/').get_data(as_text=True)
+    m = re.search(r'<html lang=en render="?([^ >"]*)', page)
+    assert m
+    version[0] = 1
+    res = client.post('/', json={'session': {}, 'base': m[1]}).get_json()
+    assert res['ops'] == [['i', [1, 0], 'div', 'version 1']]
+    res = client.post('/', json={'session': {}, 'base': res['render']}).get_json()
+    assert res['ops'] == []
+    # the base is only used once, after that the whole page is sent
+    page = client.post('/', json={'session': {}, 'base': m[1]}).get_data(as_text=True)
+    assert '<div>version 1</div>' in page
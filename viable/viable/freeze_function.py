@@ -1,8 +1,10 @@
 from __future__ import annotations
 from dataclasses import *
 from typing import *
-from types import FunctionType, CellType, MethodType, CodeType
+from types import FunctionType, CellType, MethodType, CodeType, ModuleType
+import functools
 import pickle
+import sys
 
 from pbutils import p
 
@@ -10,7 +12,7 @@ P = ParamSpec('P')
 R = TypeVar('R')
 
 Fn: TypeAlias = Callable[..., Any]
-FrozenId: TypeAlias = int
+FrozenId: TypeAlias = int | str
 Cell: TypeAlias = Union[
     tuple[Any],
     None,
@@ -33,17 +35,75 @@ Frozen: TypeAlias = Union[
 _reg_co_to_id: dict[CodeType, FrozenId] = {}
 _reg_id_to_fn: dict[FrozenId, Fn] = {}
 
+stable_ids: bool = False
+'''
+If set functions are identified by their module and the position of their code
+in the module's source, instead of by the order they were first frozen in.
+Then a function frozen in one process can be thawed in another process
+running the same source, for example in another worker of the same server.
+'''
+
 def is_function(f: Any) -> TypeGuard[FunctionType]:
     return isinstance(getattr(f, '__code__', None), CodeType)
 
+@functools.cache
+def module_codes(module_name: str) -> tuple[ModuleType, list[CodeType]] | None:
+    '''
+    The module and all code objects in its source, in the order they appear.
+    '''
+    module = sys.modules.get(module_name)
+    filename = getattr(module, '__file__', None)
+    if module is None or not filename or not filename.endswith('.py'):
+        return None
+    try:
+        with open(filename) as fp:
+            source = fp.read()
+        todo = [compile(source, filename, 'exec')]
+    except (OSError, SyntaxError):
+        return None
+    codes: list[CodeType] = []
+    while todo:
+        co = todo.pop(0)
+        codes += [co]
+        todo += [c for c in co.co_consts if isinstance(c, CodeType)]
+    return module, codes
+
+def stable_id(f: Fn) -> str | None:
+    res = module_codes(f.__module__)
+    if res is None:
+        return None
+    _, codes = res
+    try:
+        i = codes.index(f.__code__)
+    except ValueError:
+        # the source has changed since the module was loaded
+        return None
+    return f'{f.__module__}:{i}'
+
+def resolve_stable_id(i: str) -> Fn:
+    module_name, _, index = i.rpartition(':')
+    res = module_codes(module_name)
+    if res is None:
+        raise KeyError(i)
+    module, codes = res
+    co = codes[int(index)]
+    # only its code, globals and name are used by thaw
+    closure = tuple(CellType() for _ in co.co_freevars) or None
+    return FunctionType(co, module.__dict__, co.co_name, None, closure)
+
 def frozen_id(f: Fn) -> FrozenId:
     co = f.__code__
     if co not in _reg_co_to_id:
-        given_id = len(_reg_co_to_id)
+        given_id = stable_ids and stable_id(f) or len(_reg_co_to_id)
         _reg_co_to_id[co] = given_id
         _reg_id_to_fn[given_id] = f
     return _reg_co_to_id[co]
 
+def lookup(i: FrozenId) -> Fn:
+    if i not in _reg_id_to_fn and isinstance(i, str):
+        _reg_id_to_fn[i] = resolve_stable_id(i)
+    return _reg_id_to_fn[i]
+
 def freeze(f: Fn, __seen : None | set[int] = None) -> Frozen:
     assert callable(f)
     if not is_function(f):
@@ -87,7 +147,7 @@ _empty_cell = CellType()
 def thaw(frozen: Frozen) -> Fn:
     match frozen:
         case (i, bound_self):
-            f = _reg_id_to_fn[i]
+            f = lookup(i)
             return MethodType(f, bound_self)
         case (i, None, frozen_closure):
             closure: list[Any] = []
@@ -99,7 +159,7 @@ def thaw(frozen: Frozen) -> Fn:
                         closure += [_make_cell(v)]
                     case _:
                         closure += [_make_cell(thaw(c))]
-            f = _reg_id_to_fn[i]
+            f = lookup(i)
             return FunctionType(
                 f.__code__,
                 f.__globals__,
@@ -110,7 +170,7 @@ def thaw(frozen: Frozen) -> Fn:
         case bytes(bs):
             return pickle.loads(bs)
         case i:
-            f = _reg_id_to_fn[i]
+            f = lookup(i)
             return FunctionType(
                 f.__code__,
                 f.__globals__,
@@ -234,3 +294,28 @@ def test_freeze():
         freeze(f_err)
 
     assert 'recursive' in exc.value.args[0]
+
+def test_stable_ids():
+    import pickle
+    global stable_ids
+
+    def H(xs: list[int]) -> Callable[[int], int]:
+        def inner(i: int):
+            return sum(xs) + i
+        return lambda a: a + inner(a)
+
+    fs: list[Callable[[int], int]] = [G1, H([1, 2]), __Test(3).f]
+    stable_ids = True
+    try:
+        _reg_co_to_id.clear()
+        _reg_id_to_fn.clear()
+        bs = [pickle.dumps(freeze(f)) for f in fs]
+        # as if in another process that has not frozen anything
+        _reg_co_to_id.clear()
+        _reg_id_to_fn.clear()
+        for f, b in zip(fs, bs):
+            assert f(1) == thaw(pickle.loads(b))(1)
+    finally:
+        stable_ids = False
+        _reg_co_to_id.clear()
+        _reg_id_to_fn.clear()
@@ -13,7 +13,11 @@ def minify_string() -> Callable[[str, str], str]:
         print('Not using tdewolff-minify:', str(e), file=sys.stderr)
         return lambda _, s: s
 
+@lru_cache(maxsize=256)
 def minify(s: str, loader: str='js') -> str:
+    '''
+    Cached since the scripts and stylesheets are mostly the same between renders.
+    '''
     if loader in ('js', 'javascript'):
         loader = 'application/javascript'
     elif loader in ('html', 'css'):
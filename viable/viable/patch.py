@@ -0,0 +1,149 @@
+'''
+Patches between two renders of a page.
+
+A render is kept as a snapshot of its html element, see Node.snapshot.
+The client applies the operations from diff to its document instead of
+parsing and morphing the whole page. Elements are addressed by their path
+of child element indexes from the html element and every operation
+starts with the op, the path and the tag name of the element:
+
+    ['a', path, tag, name, value]   set attribute
+    ['r', path, tag, name]          remove attribute
+    ['i', path, tag, html]          replace the contents
+    ['o', path, tag, html]          replace the element
+    ['+', path, tag, html]          append elements
+    ['-', path, tag, n]             remove the last n elements
+
+Elements that the browser parses into a different structure, such as
+tables which get a tbody, and elements with raw html among their children
+are replaced as a whole since the element indexes inside them can differ
+between the document and the snapshot.
+'''
+from __future__ import annotations
+from typing import *
+
+import html
+import json
+
+from .tags import Snapshot, attr_esc, is_void
+
+Op: TypeAlias = list[Any]
+
+opaque_tags = {'table', 'svg', 'math', 'template', 'pre'}
+root_tags = {'html', 'head', 'body'}
+max_child_ops = 10
+
+def to_html(s: Snapshot | str) -> str:
+    if isinstance(s, str):
+        return s
+    name, attrs, children = s
+    kvs = ''.join(
+        f' {k}' if v == '' else
+        f' {k}={v}' if v.isalnum() else
+        f' {k}="{attr_esc(v)}"'
+        for k, v in attrs
+    )
+    close = '' if is_void(name) else f'</{name}>'
+    return f'<{name}{kvs}>' + ''.join(map(to_html, children)) + close
+
+def is_opaque(s: Snapshot) -> bool:
+    name, _, children = s
+    return name in opaque_tags or any(isinstance(c, str) and '<' in c for c in children)
+
+def shape(children: tuple[Snapshot | str, ...]) -> list[str]:
+    return [c if isinstance(c, str) else c[0] for c in children]
+
+def diff(prev: Snapshot, next: Snapshot) -> list[Op]:
+    '''
+    The operations that turn the document of the prev snapshot into the next.
+    Both have the same tag name.
+    '''
+    ops: list[Op] = []
+    diff_into(prev, next, [], ops)
+    return ops
+
+def diff_into(prev: Snapshot, next: Snapshot, path: list[int], ops: list[Op]):
+    if prev == next:
+        return
+    name, attrs, children = next
+    morph_children = dict(attrs).get('morph-children') != 'false'
+    if morph_children and name not in root_tags and (is_opaque(prev) or is_opaque(next)):
+        ops.append(['o', path, name, to_html(next)])
+        return
+    prev_attrs = dict(prev[1])
+    for k in prev_attrs:
+        if k not in dict(attrs):
+            ops.append(['r', path, name, k])
+    for k, v in attrs:
+        if prev_attrs.get(k) != v:
+            ops.append(['a', path, name, k, html.unescape(v) if '&' in v else v])
+    prev_children = prev[2]
+    if not morph_children or prev_children == children:
+        return
+    prev_shape = shape(prev_children)
+    next_shape = shape(children)
+    prev_elems = [c for c in prev_children if not isinstance(c, str)]
+    next_elems = [c for c in children if not isinstance(c, str)]
+    k = min(len(prev_elems), len(next_elems))
+    if is_opaque(prev) or is_opaque(next):
+        ops.append(['i', path, name, ''.join(map(to_html, children))])
+    elif prev_shape == next_shape or (
+        len(prev_elems) == len(prev_shape) and
+        len(next_elems) == len(next_shape) and
+        prev_shape[:k] == next_shape[:k]
+    ):
+        # diff the elements pairwise and then append or remove the rest
+        start = len(ops)
+        for i, (p, n) in enumerate(zip(prev_elems, next_elems)):
+            diff_into(p, n, [*path, i], ops)
+        if len(next_elems) > k:
+            ops.append(['+', path, name, ''.join(map(to_html, next_elems[k:]))])
+        elif len(prev_elems) > k:
+            ops.append(['-', path, name, len(prev_elems) - k])
+        if len(ops) - start > max_child_ops:
+            # when the elements have shifted the contents are usually smaller than the operations
+            inner = ''.join(map(to_html, children))
+            if len(inner) < len(json.dumps(ops[start:])):
+                ops[start:] = [['i', path, name, inner]]
+    else:
+        ops.append(['i', path, name, ''.join(map(to_html, children))])
+
+def test_diff():
+    from .tags import div, html as html_tag, body, span, table, tr, td, raw
+    def snap(*children: Any) -> Snapshot:
+        [s] = html_tag(body(*children)).snapshot()
+        return cast(Snapshot, s)
+    a = snap(div('x', id='a'), div(span('y'), span('z')))
+    assert diff(a, a) == []
+    assert to_html(a) == html_tag(body(div('x', id='a'), div(span('y'), span('z')))).to_str(0)
+    assert diff(a, snap(div('x', id='b', hidden=True), div(span('y'), span('z')))) == [
+        ['a', [0, 0], 'div', 'hidden', ''],
+        ['a', [0, 0], 'div', 'id', 'b'],
+    ]
+    assert diff(a, snap(div('x'), div(span('y'), span('w')))) == [
+        ['r', [0, 0], 'div', 'id'],
+        ['i', [0, 1, 1], 'span', 'w'],
+    ]
+    assert diff(a, snap(div('x', id='a'), div(span('y'), span('z'), span('w')))) == [
+        ['+', [0, 1], 'div', '<span>w</span>'],
+    ]
+    assert diff(a, snap(div('x', id='a'), div(span('y')))) == [
+        ['-', [0, 1], 'div', 1],
+    ]
+    assert diff(a, snap(div('x', id='a'), div('<', span('z')))) == [
+        ['i', [0, 1], 'div', '&lt;<span>z</span>'],
+    ]
+    assert diff(a, snap(div('x', id='a'), div(raw('<b>y</b>'), span('z')))) == [
+        ['o', [0, 1], 'div', '<div><b>y</b><span>z</span></div>'],
+    ]
+    t = snap(table(tr(td('1'))))
+    assert diff(t, snap(table(tr(td('2'))))) == [
+        ['o', [0, 0], 'table', '<table><tr><td>2</td></tr></table>'],
+    ]
+    rows = [div(span(str(i)), id=str(i)) for i in range(20)]
+    assert diff(snap(div(*rows)), snap(div(*rows[1:]))) == [
+        ['i', [0, 0], 'div', ''.join(row.to_str(0) for row in rows[1:])],
+    ]
+    assert diff(a, snap(div('x', onclick='a&amp;b', id='a'), div(span('y'), span('z')))) == [
+        ['a', [0, 0], 'div', 'onclick', 'a&b'],
+    ]
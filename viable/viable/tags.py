@@ -6,10 +6,14 @@ import typing_extensions as tx
 from .css_dsl import Css
 
 import abc
+import hashlib
 import re
+import threading
 
 AttrValue: TypeAlias = None | bool | str | int
 
+Snapshot: TypeAlias = 'tuple[str, tuple[tuple[str, str], ...], tuple[Snapshot | str, ...]]'
+
 def html_esc(txt: str, __table: dict[int, str] = str.maketrans({
     "<": "&lt;",
     ">": "&gt;",
@@ -55,6 +59,27 @@ class Node(abc.ABC):
         sep = '' # '\n' # '' if indent == 0 else '\n'
         return sep.join(self.to_strs(indent=indent))
 
+    def make_classes(self, classes: dict[str, tuple[str, str]]) -> dict[str, tuple[str, str]]:
+        return classes
+
+    def snapshot(self) -> Sequence[Snapshot | str]:
+        '''
+        The rendered node with elements as (tag name, attributes, children)
+        tuples and everything else as html, see viable.patch.
+        '''
+        return [self.to_str(0)]
+
+def is_void(name: str) -> bool:
+    # https://html.spec.whatwg.org/multipage/syntax.html#void-elements
+    return bool(re.match('^area|base|br|col|embed|hr|img|input|link|meta|source|track|wbr$', name))
+
+def class_name(decls: str) -> str:
+    '''
+    Class names are made from the declarations so that they are the same on
+    every request, which lets cached fragments be reused on any page.
+    '''
+    return 'css-' + hashlib.sha256(decls.encode()).hexdigest()[:10]
+
 css_props = {
     p.replace('-', '_'): [p]
     for p in '''
@@ -192,7 +217,7 @@ class Tag(Node):
                 self.attrs[k] = v
         return self
 
-    def __iadd__(self, other: str | Tag) -> Tag:
+    def __iadd__(self, other: Node | str | Css | dict[str, AttrValue]) -> tx.Self:
         return self.append(other)
 
     def __getattr__(self, attr: str) -> IAddable:
@@ -236,8 +261,7 @@ class Tag(Node):
         name = self.tag_name()
         open = f'<{name}{attrs}>'
         close = f'</{name}>'
-        if re.match('^area|base|br|col|embed|hr|img|input|link|meta|source|track|wbr$', name):
-            # https://html.spec.whatwg.org/multipage/syntax.html#void-elements
+        if is_void(name):
             close = ''
         if len(self.children) == 0:
             yield ' ' * i + f'{open}{close}'
@@ -250,6 +274,21 @@ class Tag(Node):
                     yield from child.to_strs(indent=indent, i=i+indent)
             yield ' ' * i + f'{close}'
 
+    def snapshot(self) -> Sequence[Snapshot | str]:
+        attrs = tuple(
+            (k, '' if v is True else str(v))
+            for k, v in sorted(self.attrs.items())
+            if v is not False and v is not None
+        )
+        children: list[Snapshot | str] = []
+        for child in self.children:
+            for s in child.snapshot():
+                if isinstance(s, str) and children and isinstance(children[-1], str):
+                    children[-1] += s
+                else:
+                    children.append(s)
+        return [(self.tag_name(), attrs, tuple(children))]
+
     def make_classes(self, classes: dict[str, tuple[str, str]]) -> dict[str, tuple[str, str]]:
         for decls in self.inline_sheet:
             if decls not in classes:
@@ -259,13 +298,12 @@ class Tag(Node):
             if decls in classes:
                 name, _ = classes[decls]
             else:
-                name = f'css-{len(classes)}'
-                if '-&' in decls:
-                    decls = decls.replace('-&', f'-{name}')
-                if '&' in decls:
-                    inst = decls.replace('&', f'[{name}]')
+                name = class_name(decls)
+                inst = decls.replace('-&', f'-{name}')
+                if '&' in inst:
+                    inst = inst.replace('&', f'[{name}]')
                 else:
-                    inst = f'[{name}] {{{decls}}}'
+                    inst = f'[{name}] {{{inst}}}'
                 classes[decls] = name, inst
             self.extend({name: True})
         self.inline_css.clear()
@@ -278,13 +316,12 @@ class Tag(Node):
             if rx in classes:
                 attr, _ = classes[rx]
             else:
-                attr = f'css-{len(classes)}'
+                attr = class_name(rx)
                 classes[rx] = attr, '\n'.join(x.instantiate(attr))
             if any('&' in entry.selector for entry in x.entries):
                 self.extend({attr: True})
         for child in self.children:
-            if isinstance(child, Tag):
-                child.make_classes(classes)
+            child.make_classes(classes)
         return classes
 
 class tag(Tag):
@@ -317,6 +354,123 @@ class text(Node):
 def raw(txt: str) -> text:
     return text(txt, raw=True)
 
+@dataclass(frozen=True)
+class Fragment:
+    strs: tuple[str, ...]
+    classes: tuple[tuple[str, tuple[str, str]], ...]
+    snapshot: tuple[Snapshot | str, ...]
+    size: int
+
+@dataclass
+class Fragments:
+    '''
+    The least recently used fragments, up to a total length of their strs.
+    '''
+    max_size: int = 32 * 1024 * 1024
+    entries: dict[Hashable, Fragment] = field(default_factory=dict)
+    size: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def get(self, key: Hashable) -> Fragment | None:
+        with self.lock:
+            fragment = self.entries.pop(key, None)
+            if fragment is not None:
+                # reinsert so that the least recently used fragments are evicted first
+                self.entries[key] = fragment
+            return fragment
+
+    def put(self, key: Hashable, fragment: Fragment):
+        with self.lock:
+            if old := self.entries.pop(key, None):
+                self.size -= old.size
+            if fragment.size > self.max_size:
+                return
+            self.entries[key] = fragment
+            self.size += fragment.size
+            while self.size > self.max_size:
+                evicted = self.entries.pop(next(iter(self.entries)))
+                self.size -= evicted.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+fragments = Fragments()
+
+class cached(Node):
+    '''
+    A subtree that is built and rendered once and then reused, together with
+    its classes, on every request until the key changes. The key should
+    identify the fragment and everything it depends on, such as the values
+    of the variables the builder reads. The builder can also return a list
+    of siblings.
+    '''
+    def __init__(self, key: Hashable, builder: Callable[[], Node | Sequence[Node]]):
+        super(cached, self).__init__()
+        self.key = key
+        self.builder = builder
+
+    def get(self, indent: int=0, i: int=0) -> Fragment:
+        key = self.key, indent, i
+        fragment = fragments.get(key)
+        if fragment is not None:
+            return fragment
+        built = self.builder()
+        nodes = [built] if isinstance(built, Node) else built
+        classes: dict[str, tuple[str, str]] = {}
+        strs: list[str] = []
+        snapshot: list[Snapshot | str] = []
+        for node in nodes:
+            node.make_classes(classes)
+            strs += node.to_strs(indent=indent, i=i)
+            snapshot += node.snapshot()
+        fragment = Fragment(tuple(strs), tuple(classes.items()), tuple(snapshot), sum(map(len, strs)))
+        fragments.put(key, fragment)
+        return fragment
+
+    def make_classes(self, classes: dict[str, tuple[str, str]]) -> dict[str, tuple[str, str]]:
+        for decls, entry in self.get().classes:
+            classes.setdefault(decls, entry)
+        return classes
+
+    def to_strs(self, *, indent: int=0, i: int=0) -> Iterable[str]:
+        yield from self.get(indent, i).strs
+
+    def snapshot(self) -> Sequence[Snapshot | str]:
+        return self.get().snapshot
+
+def test_cached():
+    built: list[int] = []
+    def builder():
+        built.append(1)
+        return div(span('hello', css='color: red'), css='& > span { font-weight: bold }')
+    def page(*children: Node):
+        node = div(*children, span('world', css='color: red'))
+        classes = node.make_classes({})
+        return node.to_str(0), sorted(classes.values())
+    assert page(cached(test_cached, builder)) == page(builder())
+    assert page(cached(test_cached, builder)) == page(builder())
+    assert len(built) == 3
+    assert page(cached('siblings', lambda: [builder(), builder()])) == page(builder(), builder())
+    fragments.clear()
+
+def test_fragments():
+    def fragment(s: str):
+        return Fragment((s,), (), (), len(s))
+    fs = Fragments(max_size=10)
+    fs.put('a', fragment('aaaa'))
+    fs.put('b', fragment('bbbb'))
+    assert fs.get('a') == fragment('aaaa')
+    fs.put('c', fragment('cccc'))
+    assert list(fs.entries) == ['a', 'c']
+    fs.put('c', fragment('cc'))
+    assert fs.size == 6
+    # too big to be cached at all
+    fs.put('d', fragment('d' * 11))
+    assert list(fs.entries) == ['a', 'c']
+    assert fs.get('d') is None
+
 class a(Tag): pass
 class abbr(Tag): pass
 class address(Tag): pass
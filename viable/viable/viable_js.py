@@ -77,32 +77,28 @@ viable_js = textwrap.dedent(r'''
         const html = document.querySelector('html')
         needs_refresh = false
         html.setAttribute('loading', '1')
-        let doc
+        let msg
         try {
-            const resp = await fetch(location.href, {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(state()),
-            })
-            const text = await resp.text()
-            const parser = new DOMParser()
-            doc = parser.parseFromString(text, "text/html")
+            msg = await fetch_page(html.getAttribute('render'))
+            if (msg.ops && !apply_patch(msg.ops)) {
+                msg = await fetch_page(null)
+            }
         } catch (e) {
             current_refresh = null
             return {'ok': false}
         }
-        morph(document.head, doc.head)
-        morph(document.body, doc.body)
-        const scripts = []
-        for (const script of document.querySelectorAll('script[eval]')) {
-            scripts.push(script.textContent)
+        if (msg.doc) {
+            morph(document.head, msg.doc.head)
+            morph(document.body, msg.doc.body)
+            html.setAttribute('render', msg.doc.documentElement.getAttribute('render'))
+        } else {
+            sync_inputs()
+            html.setAttribute('render', msg.render)
         }
-        for (const script of scripts) {
-            try {
-                ;(0, eval)(script)
-            } catch (e) {
-                console.error(e)
-            }
+        live_seen = false
+        eval_scripts([document])
+        if (!live_seen) {
+            live_close()
         }
         requestAnimationFrame(() => {
             if (!current_refresh) {
@@ -112,6 +108,157 @@ viable_js = textwrap.dedent(r'''
         current_refresh = null
         return {'ok': true}
     }
+    async function fetch_page(base) {
+        // the server sends patch operations if it still has the base render, otherwise the whole page
+        const resp = await fetch(location.href, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({...state(), base}),
+        })
+        if ((resp.headers.get('Content-Type') || '').startsWith('application/json')) {
+            return await resp.json()
+        }
+        const text = await resp.text()
+        const parser = new DOMParser()
+        return {doc: parser.parseFromString(text, "text/html")}
+    }
+    function apply_patch(ops) {
+        // returns the elements with new contents, or null if the document does not match the patch
+        const roots = []
+        for (const [op, path, tag, x, y] of ops) {
+            let el = document.documentElement
+            let nodiff = false
+            for (const i of path) {
+                nodiff = nodiff || el.hasAttribute('nodiff')
+                el = el.children[i]
+                if (!el) {
+                    return null
+                }
+            }
+            if (el.tagName.toLowerCase() !== tag.toLowerCase()) {
+                return null
+            }
+            if (nodiff || el.hasAttribute('nodiff')) {
+                continue
+            }
+            if (op == 'a') {
+                el.setAttribute(x, y)
+            } else if (op == 'r') {
+                el.removeAttribute(x)
+            } else if (op == 'i') {
+                el.innerHTML = x
+                roots.push(el)
+            } else if (op == 'o') {
+                const parent = el.parentElement
+                const i = path[path.length - 1]
+                el.outerHTML = x
+                roots.push(parent.children[i] || parent)
+            } else if (op == '+') {
+                const n = el.children.length
+                el.insertAdjacentHTML('beforeend', x)
+                roots.push(...[...el.children].slice(n))
+            } else if (op == '-') {
+                for (let i = 0; i < x; ++i) {
+                    el.lastElementChild.remove()
+                }
+            }
+        }
+        return roots
+    }
+    function sync_inputs() {
+        // like morph: inputs without focus show the values from the server
+        for (const el of document.querySelectorAll('input, textarea')) {
+            if (document.activeElement === el && in_focus && !window.ignore_focus) {
+                continue
+            }
+            if (el.closest('[nodiff]')) {
+                continue
+            }
+            if (el.tagName === 'TEXTAREA') {
+                if (el.value !== el.textContent) {
+                    el.value = el.textContent
+                }
+                continue
+            }
+            if (el.type == 'radio' && document.activeElement.name === el.name) {
+                continue
+            }
+            if (el.type != 'checkbox' && el.type != 'radio' && el.type != 'file' && el.value !== el.defaultValue) {
+                el.value = el.defaultValue
+            }
+            if (el.checked !== el.hasAttribute('checked')) {
+                el.checked = el.hasAttribute('checked')
+            }
+        }
+    }
+    function eval_scripts(roots) {
+        const scripts = []
+        for (const root of roots) {
+            if (root.matches && root.matches('script[eval]')) {
+                scripts.push(root.textContent)
+            }
+            for (const script of root.querySelectorAll('script[eval]')) {
+                scripts.push(script.textContent)
+            }
+        }
+        for (const script of scripts) {
+            try {
+                ;(0, eval)(script)
+            } catch (e) {
+                console.error(e)
+            }
+        }
+    }
+
+    let live_source = null
+    let live_key = null
+    let live_token = null
+    let live_seen = false
+    function live(token) {
+        live_seen = true
+        const path = location.pathname + location.search
+        const session = JSON.stringify(get_session())
+        const key = path + '\n' + session
+        if (live_source && live_key === key && live_token === token) {
+            return
+        }
+        // reconnect so that the stream patches the page from this version
+        live_close()
+        const url = new URL('/live', location.href)
+        url.search = new URLSearchParams({path, session, token})
+        live_key = key
+        live_token = token
+        live_source = new EventSource(url)
+        live_source.onmessage = e => live_update(JSON.parse(e.data))
+        live_source.addEventListener('done', () => live_close())
+    }
+    function live_close() {
+        if (live_source) {
+            live_source.close()
+        }
+        live_source = null
+        live_key = null
+        live_token = null
+    }
+    function live_update(msg) {
+        // the page no longer matches the render it was refreshed to
+        document.documentElement.removeAttribute('render')
+        live_token = msg.token
+        let roots = msg.ops && apply_patch(msg.ops)
+        if (roots) {
+            sync_inputs()
+        } else if (msg.ops) {
+            refresh()
+            return
+        } else {
+            const parser = new DOMParser()
+            morph(document.head, parser.parseFromString(msg.head, 'text/html').head)
+            morph(document.body, parser.parseFromString(msg.body, 'text/html').body)
+            roots = [document.body]
+        }
+        eval_scripts(roots)
+    }
+
     async function poll() {
         while (true) {
             try {
@@ -179,6 +326,9 @@ viable_js = textwrap.dedent(r'''
                 }
             }
             if (prev.tagName === 'TEXTAREA') {
+                if (prev.textContent !== next.textContent) {
+                    prev.textContent = next.textContent
+                }
                 if (document.activeElement !== prev || !in_focus || window.ignore_focus) {
                     prev.value = next.textContent
                 }